@@ -0,0 +1,93 @@
+# acervo.py
+# Acervo opcional dos XML originais (config.ACERVO_ATIVO). Cada documento é guardado uma única vez,
+# endereçado pelo sha256 do conteúdo e indexado pela chave de acesso, comprimido com zstd (se o
+# pacote 'zstandard' estiver instalado) ou zlib, como blob em um SQLite separado (ACERVO_DB).
+import hashlib
+import sqlite3
+import zlib
+from datetime import datetime
+from config import ACERVO_DB
+
+try: import zstandard
+except ImportError: zstandard = None # Dependência opcional: cai para zlib
+
+_iniciado = False
+
+def get_connection():
+    return sqlite3.connect(ACERVO_DB, timeout=30, check_same_thread=False)
+
+def init_acervo():
+    global _iniciado
+    conn = get_connection()
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute('''CREATE TABLE IF NOT EXISTS documentos (
+            hash TEXT PRIMARY KEY, chave TEXT, tipo TEXT, nome TEXT, codec TEXT,
+            tamanho INTEGER, comprimido INTEGER, dados BLOB, arquivado_em TEXT
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_documentos_chave ON documentos (chave)')
+        conn.commit(); _iniciado = True
+    finally: conn.close()
+
+def comprimir(raw):
+    if zstandard: return 'zstd', zstandard.ZstdCompressor(level=9).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+def descomprimir(codec, dados):
+    if codec == 'zstd':
+        if zstandard is None: raise RuntimeError("Documento do acervo em zstd: instale o pacote 'zstandard'.")
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return zlib.decompress(dados)
+
+def preparar(raw, tipo, nome, chave=None):
+    """Linha pronta para gravar(). Roda no processo do parse: hash e compressão saem do processo principal."""
+    codec, dados = comprimir(raw)
+    return (hashlib.sha256(raw).hexdigest(), chave, tipo, nome, codec, len(raw), len(dados), dados)
+
+def gravar(linhas):
+    """Grava as linhas de preparar(); conteúdo já arquivado (mesmo hash) é ignorado. Retorna quantos eram novos."""
+    if not linhas: return 0
+    if not _iniciado: init_acervo()
+    conn = get_connection()
+    try:
+        agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        antes = conn.total_changes
+        conn.executemany("INSERT OR IGNORE INTO documentos (hash, chave, tipo, nome, codec, tamanho, comprimido, dados, arquivado_em) VALUES (?,?,?,?,?,?,?,?,?)",
+                         [l + (agora,) for l in linhas])
+        conn.commit()
+        return conn.total_changes - antes
+    finally: conn.close()
+
+def iter_blocos(tipo=None, chaves=None, tamanho=1000):
+    """Gera listas de (hash, tipo, nome, codec, dados) em ordem de gravação, 'tamanho' por bloco."""
+    if not _iniciado: init_acervo()
+    conn = get_connection()
+    try:
+        sql = "SELECT hash, tipo, nome, codec, dados FROM documentos"; cond = []; params = []
+        if tipo: cond.append("tipo = ?"); params.append(tipo)
+        if chaves is not None:
+            conn.execute("CREATE TEMP TABLE sel (chave TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO sel VALUES (?)", [(k,) for k in chaves])
+            cond.append("chave IN (SELECT chave FROM sel)")
+        if cond: sql += " WHERE " + " AND ".join(cond)
+        cur = conn.execute(sql + " ORDER BY rowid", params)
+        while True:
+            bloco = cur.fetchmany(tamanho)
+            if not bloco: break
+            yield bloco
+    finally: conn.close()
+
+def buscar(chave):
+    """[(nome, bytes)] dos documentos arquivados com a chave de acesso."""
+    if not _iniciado: init_acervo()
+    conn = get_connection()
+    try: return [(n, descomprimir(c, d)) for n, c, d in conn.execute("SELECT nome, codec, dados FROM documentos WHERE chave = ?", (chave,))]
+    finally: conn.close()
+
+def estatisticas():
+    if not _iniciado: init_acervo()
+    conn = get_connection()
+    try:
+        n, t, c = conn.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0), COALESCE(SUM(comprimido), 0) FROM documentos").fetchone()
+        return {'docs': n, 'bytes': t, 'comprimido': c, 'taxa': (t / c) if c else 0.0}
+    finally: conn.close()
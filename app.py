@@ -1,33 +1,77 @@
 # app.py
 import streamlit as st
 import pandas as pd
+import json
 import time
-import io
-import zipfile
-import pydeck as pdk
+import os
+import uuid
+import shutil
 import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import acervo
+import cache_disco
 import database as db
-import parsers
+import exportar
+import metrics
 import services
-from config import CNPJS_CIA # Importação necessária para os nomes das filiais
-from utils import br_money, br_weight, br_int, clean_txt, COORDS_UF
+import filters
+from config import ACERVO_ATIVO, CNPJS_CIA, LOG_PAGINA, LOG_RETENCAO_DIAS, SPOOL_DIR, TABELA_ANTT # CNPJS_CIA: nomes das filiais
+from utils import br_money, br_weight, br_int, clean_txt, MESES_ABREV
 
 # --- FUNÇÕES DE CACHE ---
-@st.cache_data(ttl=600, show_spinner="Carregando dados fiscais...")
-def get_dados_dashboard():
-    """Carrega e cacheia os dados do dashboard por 10 minutos (600s)"""
-    return services.get_dashboard_data()
-
-@st.cache_data(ttl=600, show_spinner="Processando CT-es...")
-def get_dados_cte_agregados():
+# A chave 'versao' (db.get_data_version) invalida o cache quando o banco muda. Por baixo do cache
+# em memória, cache_disco guarda os DataFrames em Parquet, compartilhados entre processos e reinícios
+@metrics.medido(cache=True)
+@st.cache_resource(max_entries=2, show_spinner="Carregando dados fiscais...")
+@metrics.calculado
+def get_base_dashboard(versao, anos=None):
+    """
+    Notas enriquecidas (colunas derivadas da sidebar) + índice de filtros, uma vez por versão
+    e anos lidos (None: todos). Objeto compartilhado entre sessões: não alterar, filtrar sempre gera cópia.
+    """
+    dr = cache_disco.obter("dashboard", versao, services.get_dashboard_data, anos)
+    if dr.empty: return dr, {}
+    dr['Dia'] = dr['Dt_Ref'].dt.day.fillna(0).astype(int)
+    dr['Periodo_Label'] = dr['Mes'].map(MESES_ABREV).fillna('') + '-' + dr['Ano'].astype(str).str[-2:]
+    dr['Label_Emitente'] = formatar_participantes(dr['cnpj_emit'], dr['emitente'])
+    dr['Label_Destinatario'] = formatar_participantes(dr['cnpj_dest'], dr['destinatario'])
+    return dr, filters.build_filter_index(dr)
+
+@metrics.medido(cache=True)
+@st.cache_data(max_entries=2, show_spinner="Processando CT-es...")
+@metrics.calculado
+def get_dados_cte_agregados(versao):
     """Carrega e cacheia os dados de CT-e agregados"""
-    return services.get_cte_aggregated()
+    return cache_disco.obter("cte_agregados", versao, services.get_cte_aggregated)
+
+@metrics.medido(cache=True)
+@st.cache_data(max_entries=2, show_spinner="Agregando indicadores...")
+@metrics.calculado
+def get_cubo_dashboard(versao, anos=None):
+    """Cubo pré-agregado sobre as notas carregadas (fatiado pelos filtros da sidebar)"""
+    return cache_disco.obter("cubo", versao, lambda _: services.build_cube(get_base_dashboard(versao, anos)[0]), anos)
+
+@metrics.medido(cache=True)
+@st.cache_data(max_entries=2, show_spinner=False)
+@metrics.calculado
+def get_anos(versao):
+    """{ano: fechado?} para o filtro de ano, sem carregar as notas"""
+    return db.get_anos()
+
+@metrics.medido(cache=True)
+@st.cache_data(max_entries=2, show_spinner=False)
+@metrics.calculado
+def get_distancias(versao):
+    """Distâncias por par de cidades (cache 'distancias'), base da auditoria ANTT"""
+    return db.get_distancias()
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(page_title="Leitor Fiscal Master", layout="wide", page_icon="🚚")
 
+# Tempos deste rerun (consultas, cache, gráficos, tabelas); exibidos no painel de desempenho
+coletor_rerun = metrics.novo_coletor(eventos=True)
+metrics.ativar(coletor_rerun)
+
 # --- ESTILOS CSS ---
 st.markdown("""<style>
     .kpi-card { background-color: #fff; border-left: 5px solid #007bff; padding: 15px; border-radius: 8px; margin-bottom: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.08); } 
@@ -42,15 +86,41 @@ st.markdown("""<style>
 </style>""", unsafe_allow_html=True)
 
 # --- INICIALIZAÇÃO ---
-try: db.init_db()
-except: pass
+# Uma vez por processo (não a cada rerun/sessão): schema do banco e worker de ingestão
+@st.cache_resource(show_spinner=False)
+def inicializar():
+    try: db.init_db()
+    except: pass
+    services.iniciar_worker()
+    return True
 
-services.iniciar_worker()
+inicializar()
 
 # --- FUNÇÕES DE FORMAT E UI ---
 def br_percent(v): return f"{v:,.2f}".replace(".", ",") + "%" if not pd.isna(v) else "0,00%"
 def display_kpi(l, v, s=None, a=False): st.markdown(f'<div class="kpi-card"><div class="kpi-title">{l}</div><div class="kpi-value">{v}</div><div class="{"kpi-sub" if a else "kpi-normal-sub"}">{s if s else ""}</div></div>', unsafe_allow_html=True)
 def load_ui(l, k): return st.file_uploader(l, accept_multiple_files=True, type=["xml","zip"], key=f"upl_{k}")
+def grafico(fig, key): return metrics.medir(f"render:{key}", st.plotly_chart, fig, use_container_width=True, key=key)
+def tabela(nome, data, **kw): return metrics.medir(f"render:{nome}", st.dataframe, data, **kw)
+
+def exportacao(rotulo, blocos, key):
+    """
+    Arquivo gerado em blocos (exportar.py) só no clique, em EXPORT_DIR. O download é adiado
+    (callable): o arquivo só é lido do disco quando o usuário baixa, não a cada rerun.
+    """
+    c1, c2, c3 = st.columns([1, 1, 2])
+    fmt = c1.selectbox("Formato", list(exportar.FORMATOS), key=f"exp_fmt_{key}", label_visibility="collapsed")
+    arq = st.session_state.get(f"exp_arq_{key}")
+    if c2.button(f"📥 Exportar {rotulo}", key=f"exp_{key}"):
+        if arq and os.path.exists(arq): os.remove(arq) # Um arquivo por exportação da sessão
+        with st.spinner("Gerando arquivo..."): arq = metrics.medir(f"exportar:{key}", exportar.exportar, blocos(), fmt, prefixo=key)
+        st.session_state[f"exp_arq_{key}"] = arq
+    if arq and os.path.exists(arq):
+        ext = arq.rsplit('.', 1)[-1]
+        def ler():
+            with open(arq, 'rb') as f: return f.read()
+        c3.download_button(f"Baixar {ext.upper()} ({os.path.getsize(arq) / 1024 / 1024:,.1f} MB)", ler,
+                           file_name=f"{key}.{ext}", mime=exportar.FORMATOS[ext], key=f"exp_dl_{key}", on_click="ignore")
 
 # --- NOVA FUNÇÃO: FORMATAÇÃO DE PARTICIPANTE (FILIAIS) ---
 def formatar_participante(doc_num, nome_xml=None):
@@ -70,21 +140,29 @@ def formatar_participante(doc_num, nome_xml=None):
     
     return f"{nome_exibicao} ({clean_doc})"
 
+def formatar_participantes(docs, nomes):
+    # Formata cada par (documento, nome) distinto uma única vez
+    pares = pd.DataFrame({'doc': docs.values, 'nome': nomes.values})
+    unicos = pares.drop_duplicates().copy()
+    unicos['label'] = [formatar_participante(d, n) for d, n in zip(unicos['doc'], unicos['nome'])]
+    return pares.merge(unicos, on=['doc', 'nome'], how='left')['label'].values
+
 # --- GRÁFICOS ---
 
-def plot_evolution_simple(df, title):
-    if df.empty: return None
-    df_sorted = df.sort_values('Sort_YM')
-    agg_bar = df.groupby(['Periodo_Label', 'Sort_YM'])['peso_bruto'].sum().reset_index().sort_values('Sort_YM')
-    df_valid = df[df['frete_valor'] > 0]
+# Os gráficos abaixo recebem o cubo (services.build_cube), não as notas
+@metrics.medido()
+def plot_evolution_simple(cubo, title):
+    if cubo.empty: return None
+    agg = cubo.groupby(['Periodo_Label', 'Sort_YM']).agg({'peso_bruto':'sum', 'frete_valor':'sum', 'peso_com_frete':'sum'}).reset_index().sort_values('Sort_YM')
+    agg_bar = agg[['Periodo_Label', 'Sort_YM', 'peso_bruto']]
+    agg_line = agg[agg['frete_valor'] > 0].copy()
     
-    if df_valid.empty: 
+    if agg_line.empty: 
         agg_line = pd.DataFrame({'Periodo_Label': agg_bar['Periodo_Label'], 'rs_ton': 0})
     else:
-        agg_line = df_valid.groupby(['Periodo_Label', 'Sort_YM']).agg({'frete_valor':'sum', 'peso_bruto':'sum'}).reset_index()
-        agg_line['rs_ton'] = agg_line['frete_valor'] / (agg_line['peso_bruto']/1000)
-        agg_line = agg_line.sort_values('Sort_YM')
+        agg_line['rs_ton'] = agg_line['frete_valor'] / (agg_line['peso_com_frete']/1000)
         
+    from plotly.subplots import make_subplots # Import tardio: só este gráfico usa, fora do caminho da 1ª pintura
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     
     # Trace de Barras (Peso)
@@ -106,28 +184,27 @@ def plot_evolution_simple(df, title):
         line=dict(width=3, color='#000')
     ), secondary_y=True)
     
-    # ADICIONADO: Anotações Manuais com Fundo Cinza
-    for i, row in agg_line.iterrows():
-        fig.add_annotation(
-            x=row['Periodo_Label'],
-            y=row['rs_ton'],
-            text=f"<b>{br_money(row['rs_ton'])}</b>", # Negrito
-            showarrow=False,
-            yshift=20, # Sobe um pouco acima do ponto
-            bgcolor="#e0e0e0", # Fundo Cinza Claro (Igual ao outro gráfico)
-            bordercolor="#cccccc",
-            font=dict(size=11, color="black"),
-            yref="y2" # Importante: Referencia o eixo secundário
-        )
+    # ADICIONADO: Anotações Manuais com Fundo Cinza (montadas de uma vez, sem add_annotation por ponto)
+    annot = [dict(
+        x=x, y=y,
+        text=f"<b>{br_money(y)}</b>", # Negrito
+        showarrow=False,
+        yshift=20, # Sobe um pouco acima do ponto
+        bgcolor="#e0e0e0", # Fundo Cinza Claro (Igual ao outro gráfico)
+        bordercolor="#cccccc",
+        font=dict(size=11, color="black"),
+        yref="y2" # Importante: Referencia o eixo secundário
+    ) for x, y in zip(agg_line['Periodo_Label'], agg_line['rs_ton'])]
     
-    fig.update_layout(title=title, height=450, legend=dict(orientation="h", y=1.1), xaxis=dict(type='category'))
+    fig.update_layout(title=title, height=450, legend=dict(orientation="h", y=1.1), xaxis=dict(type='category'), annotations=annot)
     fig.update_yaxes(title_text="Volume (Ton)", showgrid=False, secondary_y=False)
     fig.update_yaxes(title_text="R$ / Ton", showgrid=True, secondary_y=True)
     return fig
 
-def plot_top10(df):
-    if df.empty: return None
-    df_filtered = df[~df['Transportadora_Final'].str.contains("FVO", case=False, na=False)].copy()
+@metrics.medido()
+def plot_top10(cubo):
+    if cubo.empty: return None
+    df_filtered = cubo[~cubo['Transportadora_Final'].str.contains("FVO", case=False, na=False)]
     if df_filtered.empty: return None
 
     agg = df_filtered.groupby('Transportadora_Final').agg({'peso_bruto':'sum', 'frete_valor':'sum'}).reset_index()
@@ -137,30 +214,30 @@ def plot_top10(df):
     
     fig = go.Figure()
     fig.add_trace(go.Bar(y=agg['Transportadora_Final'], x=agg['peso_bruto']/1000, orientation='h', name='Peso', marker_color='#5c9ce6', text=agg['peso_bruto'].apply(lambda x: f"{x/1000:,.0f}t".replace(",",".")), textposition='auto'))
-    annot = []
     mx = agg['peso_bruto'].max()/1000 * 1.15
-    for i, r in agg.iterrows(): 
-        # Mantive o bgcolor aqui também para garantir padrão
-        annot.append(dict(x=r['peso_bruto']/1000, y=r['Transportadora_Final'], text=f" <b>{br_money(r['rs_ton'])}</b> ", xanchor='left', showarrow=False, bgcolor='#e0e0e0', bordercolor='#ccc'))
+    # Mantive o bgcolor aqui também para garantir padrão
+    annot = [dict(x=p/1000, y=t, text=f" <b>{br_money(r)}</b> ", xanchor='left', showarrow=False, bgcolor='#e0e0e0', bordercolor='#ccc')
+             for p, t, r in zip(agg['peso_bruto'], agg['Transportadora_Final'], agg['rs_ton'])]
     fig.update_layout(title="Top 10 Transportadoras (Excluindo FVO)", height=500, xaxis_title="Ton", annotations=annot, margin=dict(r=80))
     fig.update_xaxes(range=[0, mx])
     return fig
 
-def plot_transp_pedagio(df):
-    if df.empty: return None
-    agg = df[df['pedagio_valor']>0].groupby('Transportadora_Final')['pedagio_valor'].sum().sort_values(ascending=True).tail(10).reset_index()
+@metrics.medido()
+def plot_transp_pedagio(cubo):
+    if cubo.empty: return None
+    agg = cubo[cubo['pedagio_valor']>0].groupby('Transportadora_Final')['pedagio_valor'].sum().sort_values(ascending=True).tail(10).reset_index()
     agg['fmt_pedagio'] = agg['pedagio_valor'].apply(br_money)
     fig = px.bar(agg, x='pedagio_valor', y='Transportadora_Final', orientation='h', title="Top Transportadoras com Pedágio", text='fmt_pedagio')
     fig.update_traces(textposition='auto')
     return fig
 
-def plot_map_heat(df):
-    if df.empty: return None
-    agg = df.groupby('UF_Dest')['frete_valor'].sum().reset_index()
-    agg_peso = df.groupby('UF_Dest')['peso_bruto'].sum().reset_index()
-    agg = pd.merge(agg, agg_peso, on='UF_Dest')
-    agg['lat'] = agg['UF_Dest'].apply(lambda x: COORDS_UF.get(x, (0,0))[0])
-    agg['lon'] = agg['UF_Dest'].apply(lambda x: COORDS_UF.get(x, (0,0))[1])
+@metrics.medido()
+def plot_map_heat(cubo):
+    if cubo.empty: return None
+    # Por cidade de destino, com as coordenadas gravadas em 'cidades' (um merge, sem busca por linha)
+    agg = cubo.groupby('cidade_destino').agg({'frete_valor':'sum', 'peso_bruto':'sum'}).reset_index()
+    agg = agg.merge(services.get_coords_cidades(), left_on='cidade_destino', right_on='rotulo').dropna(subset=['lat', 'lon'])
+    if agg.empty: return None
     
     def fmt_peso(v):
         if v >= 1000: return f"{v/1000:,.2f} Tons".replace(",", "X").replace(".", ",").replace("X", ".")
@@ -171,35 +248,39 @@ def plot_map_heat(df):
     hover_conf = {'frete_valor':False, 'Frete Formatado':True, 'Peso Formatado':True, 'lat':False, 'lon':False}
     
     try: 
-        return px.density_map(agg, lat='lat', lon='lon', z='frete_valor', radius=40, center=dict(lat=-15, lon=-50), zoom=3, map_style="carto-positron", title="Mapa Logístico (Calor Frete)", hover_name='UF_Dest', hover_data=hover_conf)
+        fig = px.density_map(agg, lat='lat', lon='lon', z='frete_valor', radius=25, center=dict(lat=-15, lon=-50), zoom=3, map_style="carto-positron", title="Mapa Logístico (Calor Frete)", hover_name='cidade_destino', hover_data=hover_conf)
     except: 
-        return px.density_mapbox(agg, lat='lat', lon='lon', z='frete_valor', radius=40, center=dict(lat=-15, lon=-50), zoom=3, mapbox_style="carto-positron", title="Mapa Logístico (Calor Frete)", hover_name='UF_Dest', hover_data=hover_conf)
+        fig = px.density_mapbox(agg, lat='lat', lon='lon', z='frete_valor', radius=25, center=dict(lat=-15, lon=-50), zoom=3, mapbox_style="carto-positron", title="Mapa Logístico (Calor Frete)", hover_name='cidade_destino', hover_data=hover_conf)
+    # municipios.csv de fábrica é parcial (capitais, filiais, polos): o resto fica no centro da UF
+    n_uf = int((agg['precisao'] == 'uf').sum())
+    if n_uf: fig.update_layout(title_subtitle_text=f"{n_uf} de {len(agg)} cidades no centro da UF (fora da tabela de municípios, ver README)")
+    return fig
 
-def plot_vol_regiao_custom(df):
-    if df.empty: return None
-    agg = df.groupby('Regiao').agg({'peso_bruto':'sum', 'frete_valor':'sum'}).reset_index()
+@metrics.medido()
+def plot_vol_regiao_custom(cubo):
+    if cubo.empty: return None
+    agg = cubo.groupby('Regiao').agg({'peso_bruto':'sum', 'frete_valor':'sum'}).reset_index()
     agg['rs_ton'] = agg.apply(lambda x: x['frete_valor'] / (x['peso_bruto']/1000) if x['peso_bruto']>0 else 0, axis=1)
     
     fig = go.Figure()
     fig.add_trace(go.Bar(x=agg['Regiao'], y=agg['peso_bruto'], marker_color='#5c9ce6', name='Volume'))
     annotations = []
-    for i, row in agg.iterrows():
-        peso_txt = br_weight(row['peso_bruto']/1000) + " t"
-        annotations.append(dict(x=row['Regiao'], y=row['peso_bruto'] / 2, text=peso_txt, showarrow=False, font=dict(color='black', size=11, weight='bold'), bgcolor='#e0e0e0', opacity=0.9, borderpad=4))
-        rs_txt = br_money(row['rs_ton'])
-        annotations.append(dict(x=row['Regiao'], y=row['peso_bruto'], text=rs_txt, yshift=15, showarrow=False, font=dict(color='#333', size=12, weight='bold')))
+    for reg, peso, rs in zip(agg['Regiao'], agg['peso_bruto'], agg['rs_ton']):
+        annotations.append(dict(x=reg, y=peso / 2, text=br_weight(peso/1000) + " t", showarrow=False, font=dict(color='black', size=11, weight='bold'), bgcolor='#e0e0e0', opacity=0.9, borderpad=4))
+        annotations.append(dict(x=reg, y=peso, text=br_money(rs), yshift=15, showarrow=False, font=dict(color='#333', size=12, weight='bold')))
     fig.update_layout(title="Volume por Região", annotations=annotations)
     return fig
 
-def plot_ranking_horizontal(df, group_col, metric_col, title, color='#5c9ce6'):
-    if df.empty: return None
+@metrics.medido()
+def plot_ranking_horizontal(cubo, group_col, metric_col, title, color='#5c9ce6'):
+    if cubo.empty: return None
     if metric_col == 'rs_ton':
-        agg = df.groupby(group_col).agg({'peso_bruto':'sum', 'frete_valor':'sum'}).reset_index()
+        agg = cubo.groupby(group_col).agg({'peso_bruto':'sum', 'frete_valor':'sum'}).reset_index()
         agg = agg[agg['peso_bruto']>0]
         agg['val'] = agg['frete_valor'] / (agg['peso_bruto']/1000)
         fmt = br_money
     else:
-        agg = df.groupby(group_col)[metric_col].sum().reset_index()
+        agg = cubo.groupby(group_col)[metric_col].sum().reset_index()
         agg.rename(columns={metric_col: 'val'}, inplace=True)
         if metric_col == 'peso_bruto':
             agg['val'] = agg['val'] / 1000 
@@ -214,65 +295,94 @@ def plot_ranking_horizontal(df, group_col, metric_col, title, color='#5c9ce6'):
     return fig
 
 # --- PLOT COMBO ---
+@metrics.medido()
 def plot_combo_chart(df, x, g, t, stack=False):
     if df.empty: return None
     return plot_evolution_simple(df, t)
 
+# --- CACHE DE FIGURAS ---
+# Chave: (versão dos dados, hash dos filtros). O cubo (_cubo) não entra no hash.
+@metrics.medido(cache=True)
+@st.cache_data(max_entries=32, show_spinner=False)
+@metrics.calculado
+def get_figuras_home(versao, fhash, _cubo):
+    return {
+        'pie': px.pie(_cubo, names='Operacao', values='peso_bruto', title="Volume: Venda vs Transferência", hole=0.4),
+        'map': plot_map_heat(_cubo),
+        'pedagio': plot_transp_pedagio(_cubo),
+        'evol': plot_evolution_simple(_cubo, "Evolução Mensal (Total)")
+    }
+
+@metrics.medido(cache=True)
+@st.cache_data(max_entries=32, show_spinner=False)
+@metrics.calculado
+def get_figuras_dashboard(versao, fhash, _cubo):
+    return {
+        'evol': plot_evolution_simple(_cubo, "Evolução do Custo (R$/Ton)"),
+        'top10': plot_top10(_cubo),
+        'map': plot_map_heat(_cubo),
+        'vol_reg': plot_vol_regiao_custom(_cubo),
+        'cli_vol': plot_ranking_horizontal(_cubo, 'destinatario', 'peso_bruto', 'Maior Volume (Tons)'),
+        'cli_custo': plot_ranking_horizontal(_cubo, 'destinatario', 'frete_valor', 'Maior Custo Frete (R$)'),
+        'cli_rston': plot_ranking_horizontal(_cubo, 'destinatario', 'rs_ton', 'Maior R$ / Ton'),
+        'cid_vol': plot_ranking_horizontal(_cubo, 'cidade_destino', 'peso_bruto', 'Maior Volume (Tons)', color='#ff7f0e'),
+        'cid_custo': plot_ranking_horizontal(_cubo, 'cidade_destino', 'frete_valor', 'Maior Custo Frete (R$)', color='#fb4b4b'),
+        'cid_rston': plot_ranking_horizontal(_cubo, 'cidade_destino', 'rs_ton', 'Maior R$ / Ton', color='#ff7f0e')
+    }
+
 # --- PROCESSAMENTO DE ARQUIVOS ---
-def proc_ui(fs, t):
+# Os uploads são gravados em disco (SPOOL_DIR) e viram um job na fila; o worker
+# (services.iniciar_worker) faz parse e gravação fora da sessão do Streamlit.
+# O tipo de cada XML (CT-e, NF-e ou evento) é identificado pelo elemento raiz, então
+# qualquer aba aceita ZIPs mistos.
+def perfil_ui(k): return "cprofile" if st.checkbox("Gravar perfil (cProfile) do processamento", key=f"perf_{k}") else None
+
+def proc_ui(fs, perfil=None):
     if not fs: return
-    p = st.progress(0, text="Iniciando..."); v = []
+    pasta = os.path.join(SPOOL_DIR, uuid.uuid4().hex)
+    arquivos = []
+    for i, f in enumerate(fs):
+        nome = os.path.basename(f.name)
+        if not nome.lower().endswith((".xml", ".zip")): continue
+        # Uma subpasta por upload: nomes repetidos (ex.: dois 'notas.zip') não se sobrescrevem e o
+        # nome original segue para a coluna 'arquivo'
+        os.makedirs(os.path.join(pasta, str(i)), exist_ok=True)
+        destino = os.path.join(pasta, str(i), nome)
+        with open(destino, 'wb') as out: shutil.copyfileobj(f, out)
+        arquivos.append(destino)
     
-    for f in fs:
-        if f.name.endswith(".xml"): v.append((f.name, f.read()))
-        elif f.name.endswith(".zip"):
-            try:
-                with zipfile.ZipFile(io.BytesIO(f.read())) as zf:
-                    for n in zf.namelist(): 
-                        if n.endswith(".xml"): v.append((n, zf.read(n)))
-            except: pass
+    if not arquivos: st.warning("Sem XML válido."); return
     
-    if not v: st.warning("Sem XML válido."); p.empty(); return
+    job_id = db.create_job("auto", arquivos, perfil)
+    st.session_state.setdefault('jobs_ativos', set()).add(job_id)
+    st.toast(f"Job #{job_id} na fila ({len(arquivos)} arquivo(s)).", icon="🚀")
+
+@st.fragment(run_every=2)
+def painel_jobs():
+    jobs = db.get_jobs(20)
+    if jobs.empty: return
+    ativos = jobs[jobs['status'].isin(['pendente', 'processando'])]
     
-    batch_data = []; batch_items = []; logs = []
-    total = len(v)
+    for _, j in ativos.iterrows():
+        total = j['total'] if pd.notna(j['total']) and j['total'] else 0
+        perc = min(j['processados'] / total, 1.0) if total else 0.0
+        seg = (pd.to_datetime(j['atualizado_em']) - pd.to_datetime(j['inicio'])).total_seconds() if pd.notna(j['inicio']) else 0
+        vel = f" | {j['processados']/seg:,.0f} docs/s | {j['bytes']/seg/1e6:,.1f} MB/s" if seg > 0 else ""
+        st.progress(perc, text=f"Job #{j['id']} ({j['status']}): {j['processados']}/{total or '?'} XML | {j['erros']} erros{vel}")
     
-    for i, (fn, c) in enumerate(v):
-        perc = int(((i+1)/total)*100)
-        p.progress((i+1)/total, text=f"Lendo XML {i+1}/{total} ({perc}%)")
-        
-        if t=="cte":
-            rows, err = parsers.parse_cte(c, fn)
-            if err: logs.append({'arquivo': fn, 'tipo': 'CT-e', 'msg': err})
-            else: batch_data.extend(rows)
-        elif t=="nfe":
-            h, err = parsers.parse_nfe_header(c, fn)
-            if err: logs.append({'arquivo': fn, 'tipo': 'NF-e', 'msg': err})
-            else:
-                batch_data.append(h)
-                it, _ = parsers.parse_nfe_items(c, fn)
-                batch_items.extend(it)
-            
-    p.progress(0.99, text="Salvando no Banco...")
-    
-    sucesso = True
-    msg_erro = ""
-    if t=="cte":
-        ok, msg = db.insert_cte_many(batch_data)
-        if not ok: sucesso = False; msg_erro = msg
-    elif t=="nfe":
-        ok, msg = db.insert_nfe_many(batch_data, batch_items)
-        if not ok: sucesso = False; msg_erro = msg
-        
-    if logs: db.insert_log_many(logs)
+    # Job desta sessão terminou: rerun completo para recarregar os dados
+    vistos = st.session_state.get('jobs_ativos', set())
+    terminados = vistos - set(ativos['id'])
+    if terminados:
+        st.session_state['jobs_ativos'] = vistos - terminados
+        fim = jobs[jobs['id'].isin(terminados)]
+        for _, j in fim.iterrows():
+            if j['status'] == 'erro': st.error(f"❌ Job #{j['id']}: {j['mensagem']}")
+            else: st.toast(f"Job #{j['id']} concluído: {j['mensagem']}", icon="✅")
+        if (fim['status'] != 'erro').any(): st.rerun()
     
-    if sucesso:
-        st.cache_data.clear() # LIMPA CACHE APOS UPLOAD
-        st.toast(f"Sucesso! {len(batch_data)} registros.", icon="🚀")
-        time.sleep(1)
-        st.rerun()
-    else:
-        st.error(f"❌ ERRO BANCO: {msg_erro}")
+    with st.expander("Histórico de processamentos"):
+        st.dataframe(jobs[['id', 'status', 'total', 'processados', 'registros', 'erros', 'mensagem', 'criado_em', 'fim']], use_container_width=True, hide_index=True)
 
 # --- SIDEBAR E DADOS ---
 with st.sidebar:
@@ -284,60 +394,66 @@ with st.sidebar:
     
     st.divider()
     
-    dr = get_dados_dashboard()
+    versao = db.get_data_version()
+    anos_db = get_anos(versao)
+    periodo = st.expander("📅 Período (NF-e)", expanded=True) if anos_db else st.container()
+    with periodo: sa = st.multiselect("Ano", sorted(anos_db, reverse=True), key="sb_ano") if anos_db else []
+    # Com anos fechados (partições), só os anos escolhidos são lidos: as outras partições nem abrem
+    anos_carga = tuple(sorted(sa)) if sa and any(anos_db.values()) else None
+    ausentes = db.get_particoes_ausentes()
+    if ausentes: st.warning(f"Partições sem arquivo, fora dos dados: {', '.join(map(db.arquivo_particao, ausentes))}")
+    try: dr, fidx = get_base_dashboard(versao, anos_carga)
+    except Exception as e: # Ex.: anos fechados acima do limite de anexos do SQLite
+        st.error(f"Erro ao ler as notas: {e}"); dr, fidx = pd.DataFrame(), {}
     
     if not dr.empty:
-        dr['Dia'] = dr['Dt_Ref'].dt.day.fillna(0).astype(int)
-        meses = {1:'Jan',2:'Fev',3:'Mar',4:'Abr',5:'Mai',6:'Jun',7:'Jul',8:'Ago',9:'Set',10:'Out',11:'Nov',12:'Dez'}
-        dr['Periodo_Label'] = dr.apply(lambda x: f"{meses.get(x['Mes'],'')}-{str(x['Ano'])[-2:]}", axis=1)
-
-        dr['Label_Emitente'] = dr.apply(lambda x: formatar_participante(x['cnpj_emit'], x['emitente']), axis=1)
-        dr['Label_Destinatario'] = dr.apply(lambda x: formatar_participante(x['cnpj_dest'], x['destinatario']), axis=1)
-
-        with st.expander("📅 Período (NF-e)", expanded=True):
-            sa = st.multiselect("Ano", sorted(list(dr['Ano'].unique()), reverse=True), key="sb_ano")
-            dt = dr[dr['Ano'].isin(sa)] if sa else dr
-            sm = st.multiselect("Mês", sorted(list(dt['Mes'].unique())), key="sb_mes")
-            sd = st.multiselect("Dia", sorted(list(dt['Dia'].unique())), key="sb_dia")
+        op = lambda c, m=None, r=False: filters.get_options(fidx, c, m, r)
+
+        with periodo:
+            m_ano = filters.build_mask(fidx, {'Ano': sa}, len(dr)) if sa else None
+            sm = st.multiselect("Mês", op('Mes', m_ano), key="sb_mes")
+            sd = st.multiselect("Dia", op('Dia', m_ano), key="sb_dia")
         
         with st.expander("🚚 Logística"):
-            strop = st.multiselect("Transportadora", sorted(list(dr['Transportadora_Final'].unique())), key="sb_transp")
-            sft = st.multiselect("Tipo Frete", sorted(list(dr['Frete_Tipo'].unique())), key="sb_frete")
-            sop = st.multiselect("Operação", sorted(list(dr['Operacao'].unique())), key="sb_operacao")
+            strop = st.multiselect("Transportadora", op('Transportadora_Final'), key="sb_transp")
+            sft = st.multiselect("Tipo Frete", op('Frete_Tipo'), key="sb_frete")
+            sop = st.multiselect("Operação", op('Operacao'), key="sb_operacao")
             
         with st.expander("🌎 Geografia"):
-            suf = st.multiselect("UF Destino", sorted(list(dr['UF_Dest'].unique())), key="sb_uf")
-            sor = st.multiselect("Cidade Origem", sorted(list(dr['cidade_origem'].astype(str).unique())), key="sb_origem")
-            sde = st.multiselect("Cidade Destino", sorted(list(dr['cidade_destino'].astype(str).unique())), key="sb_destino")
+            suf = st.multiselect("UF Destino", op('UF_Dest'), key="sb_uf")
+            sor = st.multiselect("Cidade Origem", op('cidade_origem'), key="sb_origem")
+            sde = st.multiselect("Cidade Destino", op('cidade_destino'), key="sb_destino")
 
         with st.expander("👥 Participantes"):
-            semit = st.multiselect("Emitente", sorted(list(dr['Label_Emitente'].unique())), key="sb_emitente")
-            sdest = st.multiselect("Destinatário", sorted(list(dr['Label_Destinatario'].unique())), key="sb_destinatario")
+            semit = st.multiselect("Emitente", op('Label_Emitente'), key="sb_emitente")
+            sdest = st.multiselect("Destinatário", op('Label_Destinatario'), key="sb_destinatario")
             
-        df = dr.copy()
-        if sa: df = df[df['Ano'].isin(sa)]
-        if sm: df = df[df['Mes'].isin(sm)]
-        if sd: df = df[df['Dia'].isin(sd)]
-        if strop: df = df[df['Transportadora_Final'].isin(strop)]
-        if sft: df = df[df['Frete_Tipo'].isin(sft)]
-        if sop: df = df[df['Operacao'].isin(sop)]
-        if suf: df = df[df['UF_Dest'].isin(suf)]
-        if sor: df = df[df['cidade_origem'].isin(sor)]
-        if sde: df = df[df['cidade_destino'].isin(sde)]
-        if semit: df = df[df['Label_Emitente'].isin(semit)]
-        if sdest: df = df[df['Label_Destinatario'].isin(sdest)]
-    else: df = pd.DataFrame()
+        filtros = {
+            'Ano': sa, 'Mes': sm, 'Dia': sd, 'Transportadora_Final': strop, 'Frete_Tipo': sft,
+            'Operacao': sop, 'UF_Dest': suf, 'cidade_origem': sor, 'cidade_destino': sde,
+            'Label_Emitente': semit, 'Label_Destinatario': sdest
+        }
+        # Um único mask NumPy para todas as seleções, uma única cópia
+        df = dr[filters.build_mask(fidx, filtros, len(dr))]
+        fhash = filters.filter_hash(filtros)
+        
+        # Cubo: fatia o pré-agregado quando os filtros cabem nas dimensões dele
+        cubo = services.slice_cube(get_cubo_dashboard(versao, anos_carga), filtros)
+        if cubo is None: cubo = services.build_cube(df)
+    else: df = pd.DataFrame(); cubo = pd.DataFrame(); fhash = ''
+    
+    st.divider()
+    st.toggle("⏱️ Painel de desempenho", key="debug_perf", help="Tempo de consultas, cache e gráficos deste rerun")
 
 # --- DEFINIÇÃO DE CARDS ---
-def cards_gerais(d):
-    if d.empty: return
-    tnf=d['valor_nf'].sum(); tp=d['peso_bruto'].sum(); tf=d['frete_valor'].sum(); tped=d['pedagio_valor'].sum()
-    
-    if 'Frete_Tipo' not in d.columns: d['Frete_Tipo'] = 'Outros'
+def cards_gerais(cubo):
+    if cubo.empty: return
+    tnf=cubo['valor_nf'].sum(); tp=cubo['peso_bruto'].sum(); tf=cubo['frete_valor'].sum(); tped=cubo['pedagio_valor'].sum()
     
     perc = (tf/tnf*100) if tnf>0 else 0
-    c_cif = len(d[d['Frete_Tipo']=='CIF'])
-    c_fob = len(d[d['Frete_Tipo']=='FOB'])
+    c_cif = int(cubo.loc[cubo['Frete_Tipo']=='CIF', 'qtd'].sum())
+    c_fob = int(cubo.loc[cubo['Frete_Tipo']=='FOB', 'qtd'].sum())
+    qtd = int(cubo['qtd'].sum())
     
     c1,c2,c3,c4,c5 = st.columns(5)
     with c1: display_kpi("Custo NFs", br_money(tnf))
@@ -346,70 +462,83 @@ def cards_gerais(d):
     with c4: display_kpi("Pedágio", br_money(tped))
     with c5: display_kpi("% Frete/Nota", br_percent(perc))
     
-    c6,c7,c8,c9 = st.columns(4)
+    c6,c7,c8,c9,c10 = st.columns(5)
     rst = (tf/(tp/1000)) if tp>0 else 0
     rskg = (tf/tp) if tp>0 else 0
+    tkm = cubo['ton_km'].sum(); rstkm = (cubo['frete_com_km'].sum()/tkm) if tkm>0 else 0
     
     with c6: display_kpi("Custo/Ton", f"R$ {br_int(rst)}")
     with c7: display_kpi("Custo/Kg", f"R$ {rskg:.2f}")
-    with c8: display_kpi("Qtd Viagens", f"{len(d):,}".replace(",", "."))
-    with c9: display_kpi("Modalidade", f"CIF: {c_cif} | FOB: {c_fob}")
+    tkm_est = cubo['ton_km_estimada'].sum()
+    with c8: display_kpi("Custo/t·km" + (" (estimado)" if tkm_est > 0 else ""), f"R$ {rstkm:.4f}".replace(".", ","),
+                         f"Notas com distância | {br_percent(tkm_est / tkm * 100)} das t·km estimadas" if tkm_est > 0 else "Notas com distância (matriz)")
+    with c9: display_kpi("Qtd Viagens", f"{qtd:,}".replace(",", "."))
+    with c10: display_kpi("Modalidade", f"CIF: {c_cif} | FOB: {c_fob}")
 
 # --- ABAS ---
-t_home, t_dash, t_analise, t_classificacao, t_cte, t_nfe, t_logs, t_sim = st.tabs(["🏠 HOME", "📊 DASHBOARD", "🔍 ANÁLISE CT-E", "🧠 CLASSIFICAÇÃO", "🚚 CT-e", "📦 NF-e", "⚠️ LOG DE ERROS", "🌎 SIMULADOR"])
+# st.tabs executa o corpo de todas as abas a cada rerun; com a navegação por radio
+# apenas a aba selecionada é renderizada.
+ABAS = ["🏠 HOME", "📊 DASHBOARD", "🔍 ANÁLISE CT-E", "🧠 CLASSIFICAÇÃO", "🚚 CT-e", "📦 NF-e", "⚠️ LOG DE ERROS", "🩺 DIAGNÓSTICO", "🌎 SIMULADOR"]
+aba = st.radio("Aba", ABAS, horizontal=True, label_visibility="collapsed", key="aba_ativa")
 
-with t_home:
+if aba == "🏠 HOME":
     if df.empty: st.info("Sem dados. Faça upload na aba CT-e ou NF-e.")
     else:
-        cards_gerais(df); st.divider(); c1, c2 = st.columns(2)
-        with c1: st.plotly_chart(px.pie(df, names='Operacao', values='peso_bruto', title="Volume: Venda vs Transferência", hole=0.4), use_container_width=True, key="home_pie_op")
+        figs = get_figuras_home(versao, fhash, cubo)
+        cards_gerais(cubo); st.divider(); c1, c2 = st.columns(2)
+        with c1: grafico(figs['pie'], "home_pie_op")
         with c2: 
-            f = plot_map_heat(df)
-            if f: st.plotly_chart(f, use_container_width=True, key="home_map")
+            f = figs['map']
+            if f: grafico(f, "home_map")
             else: st.info("Sem dados de localização.")
         st.divider(); c3, c4 = st.columns(2)
         with c3: 
-            f = plot_transp_pedagio(df)
-            if f: st.plotly_chart(f, use_container_width=True, key="home_pedagio")
+            f = figs['pedagio']
+            if f: grafico(f, "home_pedagio")
             else: st.info("Sem dados de Pedágio.")
         with c4: 
-            f = plot_evolution_simple(df, "Evolução Mensal (Total)")
-            if f: st.plotly_chart(f, use_container_width=True, key="home_evol")
+            f = figs['evol']
+            if f: grafico(f, "home_evol")
             else: st.info("Sem dados de Data.")
 
-with t_dash:
+elif aba == "📊 DASHBOARD":
     if df.empty: st.info("Sem dados.")
     else:
+        figs = get_figuras_dashboard(versao, fhash, cubo)
         d1,d2=st.columns(2)
         with d1: 
-            f = plot_evolution_simple(df, "Evolução do Custo (R$/Ton)")
-            if f: st.plotly_chart(f, use_container_width=True, key="dash_evol")
+            f = figs['evol']
+            if f: grafico(f, "dash_evol")
         with d2: 
-            f = plot_top10(df)
-            if f: st.plotly_chart(f, use_container_width=True, key="dash_top10")
+            f = figs['top10']
+            if f: grafico(f, "dash_top10")
             else: st.info("Sem dados para Top 10.")
         
         d3,d4=st.columns(2)
-        with d3: st.plotly_chart(plot_map_heat(df), use_container_width=True, key="dash_map")
+        with d3: grafico(figs['map'], "dash_map")
         with d4:
-            f = plot_vol_regiao_custom(df)
-            if f: st.plotly_chart(f, use_container_width=True, key="dash_vol_reg")
+            f = figs['vol_reg']
+            if f: grafico(f, "dash_vol_reg")
             
         st.divider()
         
         st.markdown("#### 🏆 Top 10 Clientes (Destinatário)")
         c_c1, c_c2, c_c3 = st.columns(3)
-        with c_c1: st.plotly_chart(plot_ranking_horizontal(df, 'destinatario', 'peso_bruto', 'Maior Volume (Tons)'), use_container_width=True, key="cli_vol")
-        with c_c2: st.plotly_chart(plot_ranking_horizontal(df, 'destinatario', 'frete_valor', 'Maior Custo Frete (R$)'), use_container_width=True, key="cli_custo")
-        with c_c3: st.plotly_chart(plot_ranking_horizontal(df, 'destinatario', 'rs_ton', 'Maior R$ / Ton'), use_container_width=True, key="cli_rston")
+        with c_c1: grafico(figs['cli_vol'], "cli_vol")
+        with c_c2: grafico(figs['cli_custo'], "cli_custo")
+        with c_c3: grafico(figs['cli_rston'], "cli_rston")
         
         st.markdown("#### 🏙️ Top 10 Cidades (Destino)")
         c_t1, c_t2, c_t3 = st.columns(3)
-        with c_t1: st.plotly_chart(plot_ranking_horizontal(df, 'cidade_destino', 'peso_bruto', 'Maior Volume (Tons)', color='#ff7f0e'), use_container_width=True, key="cid_vol")
-        with c_t2: st.plotly_chart(plot_ranking_horizontal(df, 'cidade_destino', 'frete_valor', 'Maior Custo Frete (R$)', color='#fb4b4b'), use_container_width=True, key="cid_custo")
-        with c_t3: st.plotly_chart(plot_ranking_horizontal(df, 'cidade_destino', 'rs_ton', 'Maior R$ / Ton', color='#ff7f0e'), use_container_width=True, key="cid_rston")
+        with c_t1: grafico(figs['cid_vol'], "cid_vol")
+        with c_t2: grafico(figs['cid_custo'], "cid_custo")
+        with c_t3: grafico(figs['cid_rston'], "cid_rston")
+
+        st.divider()
+        st.markdown("#### 📥 Exportar notas filtradas")
+        exportacao("notas filtradas", lambda: exportar.blocos_frame(df), "notas_filtradas")
 
-with t_analise:
+elif aba == "🔍 ANÁLISE CT-E":
     st.header("🔍 Análise Detalhada (CT-e / NF-e)")
     if df.empty: st.info("Carregue dados.")
     else:
@@ -460,7 +589,7 @@ with t_analise:
             
             cols_show = ['data', 'numero_cte', 'numero_nf', 'Transportadora_Final', 'cidade_origem', 'cidade_destino', 'destinatario', 'valor_nf_fmt', 'frete_fmt']
             
-            event = st.dataframe(
+            event = tabela("analise_cte",
                 view[cols_show], 
                 use_container_width=True,
                 on_select="rerun",
@@ -488,7 +617,7 @@ with t_analise:
                     
                     df_clients = df_clients.sort_values('Peso Total', ascending=False)
                     df_clients['Peso Total'] = df_clients['Peso Total'].apply(lambda x: br_weight(x))
-                    st.dataframe(df_clients, use_container_width=True)
+                    tabela("analise_clientes", df_clients, use_container_width=True)
                 else: st.write("Nenhum dado.")
                 
             with c_right:
@@ -513,7 +642,7 @@ with t_analise:
                         ).rename(columns={'data': 'Data Emissão'})
 
                     if not items_view.empty:
-                        st.dataframe(
+                        tabela("analise_itens",
                             items_view[['Data Emissão', 'produto', 'qtd_display']].rename(columns={'qtd_display': 'Qtd', 'produto': 'Produto'}), 
                             use_container_width=True,
                             hide_index=True
@@ -523,11 +652,16 @@ with t_analise:
                 else:
                     st.info("Sem dados de itens no banco.")
 
-with t_classificacao:
+        st.divider()
+        st.markdown("#### 📥 Exportar")
+        exportacao("CT-e agregados", lambda: exportar.blocos_frame(get_dados_cte_agregados(versao)), "cte_agregados")
+        exportacao("itens", lambda: exportar.blocos_sql(exportar.SQL_FONTES['itens']), "itens")
+
+elif aba == "🧠 CLASSIFICAÇÃO":
     st.header("🧠 Classificação Inteligente de Operações")
     st.info("Utilize esta aba para auditar e corrigir o Tipo de Operação (Venda, Transferência, etc.) e a Etapa Logística (Coleta, Entrega).")
     
-    df_cte_class = get_dados_cte_agregados()
+    df_cte_class = get_dados_cte_agregados(versao)
     
     if not df_cte_class.empty:
         df_cte_class['Label_Emitente'] = df_cte_class.apply(lambda x: formatar_participante(x['CNPJ Emitente']), axis=1)
@@ -559,7 +693,7 @@ with t_classificacao:
         if f_dest: view_class = view_class[view_class['Label_Destinatario'] == f_dest]
         
         if nfe_search:
-            df_dash = get_dados_dashboard()
+            df_dash = dr
             found_nfs = df_dash[df_dash['numero_nf'].astype(str) == nfe_search]['chave_nf'].unique()
             
             if len(found_nfs) > 0:
@@ -583,7 +717,7 @@ with t_classificacao:
         cols_editor = ['Data Emissão', 'N° CTE', 'Transportadora', 'Valor Frete', 'Tipo de Frete', 'Tipo de Operação', 'Etapa Logística', 'cfop_predominante', 'chave_cte_propria', 'CNPJ Emitente', 'CNPJ Destinatário']
         cols_editor = [c for c in cols_editor if c in view_class.columns]
         
-        event_class = st.dataframe(
+        event_class = tabela("classificacao",
             view_class[cols_editor],
             use_container_width=True,
             on_select="rerun",
@@ -606,7 +740,8 @@ with t_classificacao:
         )
         
         if st.button("💾 Salvar Alterações", key="btn_save_class"):
-            count_upd = 0
+            # Todas as alterações vão ao escritor de uma vez (futures): gravadas em poucos commits
+            futuros, etapas = [], []
             for idx, row in edited_class.iterrows():
                 cfop = row.get('cfop_predominante')
                 op_nova = row.get('Tipo de Operação')
@@ -617,11 +752,12 @@ with t_classificacao:
                 
                 if cfop and op_nova:
                     fl = services.get_fluxo(c_emit, c_dest)
-                    db.update_ia_memory(cfop, fl, op_nova, None)
+                    futuros.append(db.update_ia_memory.enviar(cfop, fl, op_nova, None))
                 
                 if chave and etapa:
-                    db.update_cte_etapa(chave, etapa)
-                    count_upd += 1
+                    etapas.append(db.update_cte_etapa.enviar(chave, etapa))
+            count_upd = sum(f.exception() is None for f in etapas) # Espera os commits
+            for f in futuros: f.exception()
             
             st.cache_data.clear()
             st.toast(f"{count_upd} registros atualizados com sucesso!", icon="✅")
@@ -638,7 +774,7 @@ with t_classificacao:
             
             st.subheader(f"📦 Produtos das Notas vinculadas ao CT-e {cte_sel}")
             
-            df_dash = get_dados_dashboard()
+            df_dash = dr
             mask_cte = df_dash['numero_cte'].astype(str).apply(lambda x: str(cte_sel) in [s.strip() for s in x.split(',')])
             nfs_linked = df_dash[mask_cte]
             
@@ -655,7 +791,7 @@ with t_classificacao:
                     
                     items_final = pd.merge(items_show, nfs_map, on='chave_nf', how='left')
                     
-                    st.dataframe(
+                    tabela("classificacao_itens",
                         items_final[['numero_nf', 'Data Emissão', 'produto', 'qtd_display', 'vl_total']].rename(
                             columns={'numero_nf': 'Nota Fiscal', 'produto': 'Produto', 'qtd_display': 'Qtd', 'vl_total': 'Valor Item'}
                         ),
@@ -669,30 +805,147 @@ with t_classificacao:
     else:
         st.info("Nenhum dado disponível para classificação.")
 
-with t_cte:
-    st.header("CT-e"); up = load_ui("XML CT-e", "c")
-    if up and st.button("Processar", key="btn_proc_cte"): proc_ui(up, "cte")
+elif aba == "🚚 CT-e":
+    st.header("CT-e"); up = load_ui("XML CT-e / NF-e / Eventos", "c")
+    perf = perfil_ui("c")
+    if up and st.button("Processar", key="btn_proc_cte"): proc_ui(up, perf)
+    painel_jobs()
     
-    df_cte_view = get_dados_cte_agregados()
+    df_cte_view = get_dados_cte_agregados(versao)
     if not df_cte_view.empty:
         st.subheader("Visão Geral")
-        st.dataframe(df_cte_view, use_container_width=True)
+        tabela("cte", df_cte_view, use_container_width=True)
     else: st.info("Nenhum CT-e processado.")
-
-with t_nfe:
-    st.header("NF-e"); up = load_ui("XML NF-e", "n")
-    if up and st.button("Processar", key="btn_proc_nfe"): proc_ui(up, "nfe")
+    
+    df_ev = db.load_data("eventos")
+    if not df_ev.empty:
+        with st.expander(f"📑 Eventos recebidos ({len(df_ev)})"):
+            tabela("eventos", df_ev, use_container_width=True, hide_index=True)
+
+elif aba == "📦 NF-e":
+    st.header("NF-e"); up = load_ui("XML NF-e / CT-e / Eventos", "n")
+    perf = perfil_ui("n")
+    if up and st.button("Processar", key="btn_proc_nfe"): proc_ui(up, perf)
+    painel_jobs()
     if not df.empty:
-        cards_gerais(df)
-        st.dataframe(df[['data','numero_nf','emitente','destinatario','cidade_origem','cidade_destino','distancia','numero_cte','peso_bruto','valor_nf','cfop_predominante','Frete_Tipo','tipo_operacao','Transportadora_Final']], use_container_width=True)
-
-with t_logs:
-    st.header("⚠️ Logs de Erros"); dlogs = db.get_all_logs()
-    if not dlogs.empty:
-        st.dataframe(dlogs, use_container_width=True)
-        csv = dlogs.to_csv(index=False).encode('utf-8')
-        st.download_button("Baixar Log (CSV)", data=csv, file_name="logs_erros.csv", mime="text/csv")
+        cards_gerais(cubo)
+        tabela("nfe", df[['data','numero_nf','emitente','destinatario','cidade_origem','cidade_destino','distancia','fonte_distancia','numero_cte','peso_bruto','valor_nf','cfop_predominante','Frete_Tipo','tipo_operacao','Transportadora_Final']].assign(fonte_distancia=lambda d: d['fonte_distancia'].map(services.FONTES_DISTANCIA)), use_container_width=True)
+
+elif aba == "⚠️ LOG DE ERROS":
+    st.header("⚠️ Logs de Erros"); resumo, n_grupos = db.get_logs_resumo(LOG_RETENCAO_DIAS, LOG_PAGINA)
+    if not resumo.empty:
+        st.markdown("#### Resumo por dia")
+        tabela("logs_resumo", resumo.rename(columns={'dia': 'Dia', 'tipo_doc': 'Tipo', 'mensagem': 'Mensagem', 'qtd': 'Ocorrências', 'ultimo': 'Última'}),
+               use_container_width=True, hide_index=True)
+        if n_grupos > len(resumo): st.caption(f"{br_int(len(resumo))} de {br_int(n_grupos)} grupos dos últimos {LOG_RETENCAO_DIAS} dias (mais recentes primeiro). Filtre o detalhe abaixo.")
+        st.markdown("#### Detalhe")
+        tipos, dias = db.get_logs_filtros()
+        l1, l2, l3, l4 = st.columns([1, 1, 2, 1])
+        filtros = {'tipo_doc': l1.selectbox("Tipo", [""] + tipos, key="logs_tipo"),
+                   'dia': l2.selectbox("Dia", [""] + dias, key="logs_dia"),
+                   'busca': l3.text_input("Buscar (mensagem ou arquivo)", key="logs_busca")}
+        pagina = int(l4.number_input("Página", min_value=1, step=1, key="logs_pagina"))
+        dlogs, total = db.get_logs_pagina(pagina - 1, LOG_PAGINA, **filtros)
+        paginas = max(1, -(-total // LOG_PAGINA))
+        if pagina > paginas: pagina = paginas; dlogs, total = db.get_logs_pagina(pagina - 1, LOG_PAGINA, **filtros)
+        st.caption(f"{br_int(total)} registros | página {pagina} de {paginas}")
+        tabela("logs", dlogs, use_container_width=True, hide_index=True)
+        exportacao("log", lambda: exportar.blocos_sql(*db.consulta_logs(**filtros)), "logs_erros")
     else: st.success("Nenhum erro registrado.")
 
-with t_sim:
-    st.header("Simulador"); st.info("Simulador de rotas desativado para otimização.")
\ No newline at end of file
+elif aba == "🩺 DIAGNÓSTICO":
+    st.header("🩺 Diagnóstico da Ingestão")
+    if ACERVO_ATIVO:
+        ea = acervo.estatisticas()
+        st.caption(f"Acervo XML: {ea['docs']:,} documentos, {ea['bytes']/1e6:,.1f} MB originais em {ea['comprimido']/1e6:,.1f} MB ({ea['taxa']:.1f}x). Reextração: python -m reextrair")
+    runs = db.get_ingest_runs(50)
+    if runs.empty: st.info("Nenhuma execução de ingestão registrada.")
+    else:
+        seg = runs['duracao'].clip(lower=1e-6)
+        runs['docs/s'] = (runs['docs'] / seg).round(0); runs['MB/s'] = (runs['bytes'] / seg / 1e6).round(2)
+        st.dataframe(runs[['id', 'origem', 'inicio', 'duracao', 'docs', 'registros', 'erros', 'docs/s', 'MB/s']], use_container_width=True, hide_index=True)
+        
+        rotulos = {r['id']: f"#{r['id']} - {r['origem']} ({r['inicio']})" for _, r in runs.iterrows()}
+        run_id = st.selectbox("Execução", runs['id'], format_func=rotulos.get)
+        run = runs[runs['id'] == run_id].iloc[0]
+        et = pd.DataFrame.from_dict(json.loads(run['etapas'] or "{}"), orient='index')
+        if not et.empty:
+            et = et.rename_axis('etapa').reset_index().sort_values('total_s', ascending=False)
+            et['% tempo'] = (et['total_s'] / et['total_s'].sum() * 100).round(1)
+            c1, c2 = st.columns([1, 1])
+            with c1: st.dataframe(et[['etapa', 'n', 'total_s', '% tempo', 'p50_ms', 'p95_ms']], use_container_width=True, hide_index=True)
+            with c2:
+                fig = px.bar(et, x='total_s', y='etapa', orientation='h', title="Tempo por etapa (s)", text='% tempo')
+                fig.update_layout(yaxis={'categoryorder': 'total ascending'}, height=350, margin=dict(l=0, r=0, t=40, b=0))
+                st.plotly_chart(fig, use_container_width=True)
+            st.caption("Etapas de parse somam o tempo de todos os processos; p50/p95 por documento (gravação: por lote).")
+        
+        if pd.notna(run['perfil']) and os.path.exists(run['perfil']):
+            with open(run['perfil'], 'rb') as f:
+                st.download_button("Baixar perfil", data=f.read(), file_name=os.path.basename(run['perfil']))
+            if run['perfil'].endswith(".prof"): st.caption("Abrir com snakeviz ou python -m pstats.")
+
+elif aba == "🌎 SIMULADOR":
+    st.header("Simulador")
+    a1, a2, a3 = st.columns(3)
+    tipo_carga = a1.selectbox("Tipo de Carga (ANTT)", list(TABELA_ANTT), key="antt_tipo")
+    eixos = a2.selectbox("Eixos", list(TABELA_ANTT[tipo_carga]), index=min(3, len(TABELA_ANTT[tipo_carga])-1), key="antt_eixos")
+    margem = a3.slider("Tolerância acima do piso (%)", 0, 200, 50, 10, key="antt_margem") / 100
+    # Distância offline (rotas.py): matriz rodoviária quando houver, senão linha reta x fator de circuidade
+    cidades = sorted(db.load_data("cidades", ['rotulo'])['rotulo'].dropna().tolist()) if versao else []
+    if not cidades: st.info("Sem cidades gravadas. Importe NF-e para simular rotas.")
+    else:
+        s1, s2 = st.columns(2)
+        orig = s1.selectbox("Origem", cidades, key="sim_origem")
+        dest = s2.selectbox("Destino", cidades, index=min(1, len(cidades)-1), key="sim_destino")
+        km, fonte, _ = services.get_route_data(orig, dest)
+        k1, k2, k3, k4 = st.columns(4)
+        with k1: display_kpi("Distância", f"{br_int(km)} km" if km is not None else "---", services.FONTES_DISTANCIA.get(fonte, fonte))
+        with k4: display_kpi("Piso ANTT", br_money(services.piso_antt(km, tipo_carga, eixos)) if km else "---", f"{tipo_carga}, {eixos} eixos")
+        if fonte == 'estimada_uf': st.caption("Cidade fora da tabela de municípios (municipios.csv de fábrica traz só capitais, filiais e polos de frete): distância pelo centro da UF. Para precisão de município, troque pelo arquivo completo do IBGE (README) e rode python -m rotas.")
+        if not df.empty and km:
+            par = df[(df['cidade_origem'] == orig) & (df['cidade_destino'] == dest) & (df['ton_km'] > 0)]
+            tkm = par['ton_km'].sum()
+            with k2: display_kpi("Notas na Rota", f"{len(par):,}".replace(",", "."), "Com frete (filtros da sidebar)")
+            est = (par['fonte_distancia'] != 'matriz').any()
+            with k3: display_kpi("Custo/t·km Histórico" + (" (estimado)" if est else ""), f"R$ {par['frete_com_km'].sum()/tkm:.4f}".replace(".", ",") if tkm > 0 else "---",
+                                 "Distância fora da matriz rodoviária" if est else None)
+
+    # Auditoria: piso ANTT de todos os CT-e de uma vez (vetorizado, sobre os caches por versão)
+    st.divider(); st.subheader("Auditoria ANTT dos CT-e")
+    aud = services.auditar_antt(get_dados_cte_agregados(versao), get_distancias(versao), tipo_carga, eixos, margem) if versao else pd.DataFrame()
+    if aud.empty: st.info("Sem CT-e para auditar.")
+    else:
+        cont = aud['Status ANTT'].value_counts()
+        abaixo = aud[aud['Status ANTT'] == 'Abaixo do piso']
+        m1, m2, m3, m4, m5 = st.columns(5)
+        with m1: display_kpi("Abaixo do Piso", f"{cont.get('Abaixo do piso', 0):,}".replace(",", "."), f"Diferença: {br_money((abaixo['Piso ANTT'] - abaixo['Valor Frete']).sum())}", a=True)
+        with m2: display_kpi("Acima da Tolerância", f"{cont.get('Acima do piso', 0):,}".replace(",", "."))
+        with m3: display_kpi("Dentro da Faixa", f"{cont.get('Dentro da faixa', 0):,}".replace(",", "."))
+        with m4: display_kpi("Distância Estimada", f"{cont.get('Distância estimada', 0):,}".replace(",", "."), "Centroide da UF: sem veredito")
+        with m5: display_kpi("Sem Distância", f"{cont.get('Sem distância', 0):,}".replace(",", "."))
+        ver = st.multiselect("Status", ['Abaixo do piso', 'Acima do piso', 'Dentro da faixa', 'Distância estimada', 'Sem distância'], ['Abaixo do piso', 'Acima do piso'], key="antt_status")
+        tabela("antt", aud[aud['Status ANTT'].isin(ver)].sort_values('Frete/Piso'), use_container_width=True, hide_index=True)
+
+# --- PAINEL DE DESEMPENHO (DEBUG) ---
+# Cada consulta/agregação (@metrics.medido), gráfico e tabela deste rerun: tempo, linhas in/out e cache hit/miss.
+metrics.ativar(None)
+PERF_JSONL = os.path.join(metrics.PASTA_PERFIS, "app_timing.jsonl")
+if st.session_state.get('debug_perf'):
+    total_ms = (time.time() - coletor_rerun['inicio']) * 1000
+    ev = pd.DataFrame(coletor_rerun['eventos'])
+    with st.expander(f"⏱️ Desempenho do rerun: {total_ms:,.0f} ms ({aba})", expanded=True):
+        if ev.empty: st.info("Nada medido neste rerun.")
+        else:
+            ev = ev.sort_values('em_ms', kind='stable').reindex(columns=['em_ms', 'etapa', 'ms', 'linhas_in', 'linhas_out', 'cache'])
+            res = ev.groupby('etapa').agg(n=('ms', 'size'), total_ms=('ms', 'sum'), max_ms=('ms', 'max')).sort_values('total_ms', ascending=False).reset_index()
+            hits = (ev['cache'] == 'hit').sum(); misses = (ev['cache'] == 'miss').sum()
+            st.caption(f"Cache: {hits} hit(s), {misses} miss(es). Tempos aninhados: uma função cacheada inclui as consultas que disparou no miss.")
+            c1, c2 = st.columns([2, 3])
+            with c1: st.dataframe(res, use_container_width=True, hide_index=True)
+            with c2: st.dataframe(ev, use_container_width=True, hide_index=True)
+        if st.checkbox(f"Gravar cada rerun em {PERF_JSONL} (JSON-lines)", key="debug_perf_jsonl"):
+            sessao = st.session_state.setdefault('sessao_perf', uuid.uuid4().hex[:8])
+            metrics.exportar_jsonl(coletor_rerun, PERF_JSONL, sessao=sessao, aba=aba, rerun_ms=round(total_ms, 1))
+        if os.path.exists(PERF_JSONL):
+            with open(PERF_JSONL, 'rb') as f: st.download_button("Baixar JSON-lines", data=f.read(), file_name="app_timing.jsonl", mime="application/x-ndjson")
@@ -0,0 +1,110 @@
+# backfill.py
+# Backfill após mudança de schema/parser: encontra as linhas com campos novos ainda nulos
+# (gravadas antes de o parser extraí-los), reprocessa só esses documentos - primeiro do acervo,
+# depois dos arquivos originais (coluna 'arquivo' + --origem) - e atualiza o banco em lotes.
+# Retomável: cada lote é uma transação; o que já foi preenchido sai da próxima detecção e o que
+# não tem origem ou continua nulo vai para backfill_pendencias (--refazer tenta de novo).
+# Uso: python -m backfill --tabela cte
+#      python -m backfill --tabela nfe --campos cep_origem,cep_destino --origem /mnt/erp/xml --workers 8
+import argparse
+import os
+import sys
+import time
+import zipfile
+import acervo
+import database as db
+import ingest
+import metrics
+import reextrair
+from config import ACERVO_ATIVO, ACERVO_DB
+
+# tabela: (coluna da chave, tipo do documento, campos verificados por padrão)
+ALVOS = {
+    'cte': ('chave_cte_propria', 'cte', ['tp_cte', 'chave_ref_cte', 'pedagio_valor']),
+    'nfe': ('chave_nf', 'nfe', ['cfop_predominante', 'qtd_itens', 'mod_frete', 'cep_origem', 'cep_destino']),
+    'eventos': ('chave', 'evento', ['n_seq']),
+    'itens': ('chave_nf', 'nfe', None),  # NF-e com qtd_itens > 0 e sem linhas em itens
+}
+
+def indexar_origem(pastas):
+    """{nome gravado em 'arquivo': (caminho, membro)} dos .xml e membros de .zip nas pastas."""
+    idx = {}
+    for pasta in pastas:
+        for raiz, _, arquivos in os.walk(pasta):
+            for a in arquivos:
+                caminho = os.path.join(raiz, a)
+                if a.lower().endswith(".xml"): idx.setdefault(a, (caminho, None))
+                elif a.lower().endswith(".zip"):
+                    try:
+                        with zipfile.ZipFile(caminho) as zf:
+                            for n in zf.namelist():
+                                if not n.endswith(".xml"): continue
+                                idx.setdefault(n, (caminho, n)); idx.setdefault(os.path.basename(n), (caminho, n))
+                    except zipfile.BadZipFile: print(f"ZIP inválido ignorado: {caminho}")
+    return idx
+
+def tarefas_origem(arquivos, idx, tamanho):
+    """Tarefas do importador (listas de (caminho, membro)) para os arquivos localizados, agrupadas por ZIP."""
+    itens = sorted({idx[a] for a in arquivos.values() if a in idx}, key=lambda x: (x[0], x[1] or ""))
+    return [itens[i:i + tamanho] for i in range(0, len(itens), tamanho)]
+
+def executar(tabela, campos, workers, tamanho, pastas=(), refazer=False):
+    chave, tipo, padrao = ALVOS[tabela]
+    campos = campos or padrao
+    if refazer: db.limpar_pendencias(tabela)
+    incompletas = lambda: set(db.get_chaves_incompletas(tabela, chave, campos))
+    chaves = incompletas()
+    print(f"{tabela}: {len(chaves):,} documento(s) com {', '.join(campos or ['itens'])} faltando")
+    tot = {'docs': 0, 'registros': 0, 'erros': 0, 'bytes': 0, 'lotes_falhos': 0, 'docs_falhos': 0}; vistas = set(); falhas = set()
+    if not chaves: return tot
+    inicio = time.perf_counter()
+
+    with metrics.coletar() as col:
+        def consumir(lote):
+            ok, msg = ingest.gravar_lote(lote, substituir=True)
+            if lote['metricas']: metrics.juntar(col, lote['metricas'])
+            if not ok: # Não vira pendência: a próxima execução tenta de novo
+                print(f"\nERRO ao gravar lote de {lote['docs']:,} documentos: {msg}")
+                falhas.update(d[ingest.CHAVE_DOC[tipo]] for d in lote[tipo])
+                tot['lotes_falhos'] += 1; tot['docs_falhos'] += lote['docs']; return
+            vistas.update(d[ingest.CHAVE_DOC[tipo]] for d in lote[tipo])
+            tot['docs'] += lote['docs']; tot['bytes'] += lote['bytes']
+            tot['registros'] += ingest.registros(lote); tot['erros'] += len(lote['logs'])
+            print(f"\r{tot['docs']:,} documentos reprocessados ({tot['docs']/(time.perf_counter()-inicio):,.0f} docs/s)", end="", flush=True)
+
+        # 1) Acervo: documentos arquivados na ingestão, sem tocar a rede
+        if os.path.exists(ACERVO_DB):
+            ingest.em_paralelo(reextrair.reparse_bloco, acervo.iter_blocos(tipo, chaves, tamanho), workers, consumir)
+            chaves &= incompletas()
+
+        # 2) Arquivos originais: nome gravado na coluna 'arquivo', localizado nas pastas --origem
+        if chaves and pastas:
+            with metrics.etapa('listagem'): idx = indexar_origem(pastas)
+            tarefas = tarefas_origem(db.get_arquivos_origem(tabela, chave, chaves), idx, tamanho)
+            ingest.em_paralelo(ingest.parse_tarefa, tarefas, workers, consumir, tipo, ACERVO_ATIVO)
+            chaves &= incompletas()
+
+    # 3) O que sobrou não é refeito nas próximas execuções (até --refazer)
+    db.registrar_pendencias(tabela, [(k, "campo continua nulo" if k in vistas else "sem origem") for k in chaves - falhas])
+    ingest.registrar_execucao("backfill", col, tot['docs'], tot['registros'], tot['erros'], tot['bytes'])
+    print(f"\nConcluído: {tot['docs']:,} documentos, {tot['registros']:,} registros, {tot['erros']:,} erros em {time.perf_counter()-inicio:,.1f}s"
+          f" | {len(chaves - falhas):,} pendente(s)")
+    if tot['lotes_falhos']: print(f"ATENÇÃO: {tot['lotes_falhos']:,} lote(s) com {tot['docs_falhos']:,} documentos NÃO gravados; rode de novo")
+    return tot
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m backfill", description="Preenche campos novos reprocessando só os documentos incompletos.")
+    ap.add_argument("--tabela", choices=list(ALVOS), default="cte")
+    ap.add_argument("--campos", help="Colunas a verificar, separadas por vírgula (padrão: as do parser atual)")
+    ap.add_argument("--origem", action="append", default=[], help="Pasta com os XML/ZIP originais (pode repetir)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch-size", type=int, default=1000, help="Documentos por tarefa/commit")
+    ap.add_argument("--refazer", action="store_true", help="Tenta de novo as chaves em backfill_pendencias")
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    campos = [c.strip() for c in args.campos.split(",") if c.strip()] if args.campos else None
+    return executar(args.tabela, campos, args.workers, args.batch_size, args.origem, args.refazer)['lotes_falhos']
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0) # Código 1 se algum lote não foi gravado
@@ -0,0 +1,36 @@
+# benchmarks/bench_filters.py
+# Caminho de filtro da sidebar: índice de filtros, opções encadeadas, mask único e fatia do cubo.
+import pytest
+import filters
+import services
+
+pytest.importorskip("pytest_benchmark")
+
+@pytest.fixture(scope="module")
+def indice(dashboard): return filters.build_filter_index(dashboard)
+
+@pytest.fixture(scope="module")
+def selecao(dashboard):
+    """Seleção típica: um ano, duas UFs, uma transportadora e o tipo de frete."""
+    ufs = dashboard['UF_Dest'].value_counts().index[:2].tolist()
+    return {
+        'Ano': [dashboard['Ano'].max()], 'UF_Dest': ufs,
+        'Transportadora_Final': [dashboard['Transportadora_Final'].mode().iloc[0]], 'Frete_Tipo': ['CIF']
+    }
+
+def test_build_filter_index(benchmark, dashboard, rodadas):
+    benchmark.pedantic(filters.build_filter_index, args=(dashboard,), rounds=rodadas, iterations=1)
+
+def test_get_options(benchmark, dashboard, indice, selecao):
+    m = filters.build_mask(indice, {'Ano': selecao['Ano']}, len(dashboard))
+    benchmark(lambda: [filters.get_options(indice, c, m) for c in indice])
+
+def test_build_mask_e_copia(benchmark, dashboard, indice, selecao):
+    df = benchmark(lambda: dashboard[filters.build_mask(indice, selecao, len(dashboard))])
+    benchmark.extra_info['linhas'] = len(df)
+
+def test_slice_cube(benchmark, dashboard, selecao):
+    cubo = services.build_cube(dashboard)
+    fatia = benchmark(services.slice_cube, cubo, selecao)
+    benchmark.extra_info['linhas_cubo'] = len(cubo)
+    benchmark.extra_info['linhas_fatia'] = len(fatia)
@@ -0,0 +1,22 @@
+# benchmarks/bench_insert.py
+# Gravação em massa (ingest.gravar_lote -> insert_*_many) dos documentos da escala em banco novo.
+import itertools
+import pytest
+import database as db
+import ingest
+
+pytest.importorskip("pytest_benchmark")
+
+def test_gravar_lotes(benchmark, lotes, rodadas, tmp_path, monkeypatch):
+    cont = itertools.count()
+    def novo_banco():
+        monkeypatch.setattr(db, "DB_FILE", str(tmp_path / f"insert_{next(cont)}.db"))
+        db.init_db()
+    def gravar():
+        for lote in lotes:
+            ok, msg = ingest.gravar_lote(lote)
+            if not ok: raise RuntimeError(msg)
+    benchmark.pedantic(gravar, setup=novo_banco, rounds=rodadas, iterations=1)
+    regs = sum(ingest.registros(l) + len(l['itens']) for l in lotes)
+    benchmark.extra_info['linhas'] = regs
+    benchmark.extra_info['linhas_s'] = round(regs / benchmark.stats.stats.mean)
@@ -0,0 +1,12 @@
+# benchmarks/bench_memoria.py
+# Orçamentos de memória (benchmarks/orcamento_memoria.json) na escala BENCH_ESCALAS.
+# Lento: tracemalloc e ingestão em um único processo.
+import tracemalloc
+from benchmarks import memoria
+
+def test_orcamento_memoria(zip_docs, escala):
+    tracemalloc.start()
+    try: res = memoria.executar(zip_docs)
+    finally: tracemalloc.stop()
+    falhas = memoria.verificar(res, memoria.carregar_orcamento(memoria.ORCAMENTO_PADRAO), escala)
+    assert not falhas, "\n".join(falhas)
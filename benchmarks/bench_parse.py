@@ -0,0 +1,46 @@
+# benchmarks/bench_parse.py
+# Parse por documento (parsers), extratores isolados (parsers.extrair sobre o XML já carregado) e
+# vazão de leitura + parse de um ZIP inteiro (ingest.parse_tarefa).
+import pytest
+import importar
+import ingest
+import parsers
+from benchmarks import gerador
+
+pytest.importorskip("pytest_benchmark")
+
+AMOSTRA = 1000
+
+@pytest.fixture(scope="module")
+def amostra():
+    docs = list(gerador.gerar_documentos(AMOSTRA, seed=7))
+    return [d for d in docs if d[0].startswith("NFe")], [d for d in docs if d[0].startswith("CTe")]
+
+def test_detect_doc_type(benchmark, amostra):
+    docs = amostra[0] + amostra[1]
+    benchmark(lambda: [parsers.detect_doc_type(x) for _, x in docs])
+
+def test_parse_nfe(benchmark, amostra, banco_vazio):
+    nfe = amostra[0]
+    benchmark(lambda: [parsers.parse_nfe(x, n) for n, x in nfe])
+    benchmark.extra_info['docs'] = len(nfe)
+
+def test_parse_cte(benchmark, amostra):
+    cte = amostra[1]
+    benchmark(lambda: [parsers.parse_cte(x, n) for n, x in cte])
+    benchmark.extra_info['docs'] = len(cte)
+
+@pytest.mark.parametrize("modelo", ["nfe", "cte"])
+def test_extrair(benchmark, amostra, modelo):
+    """Só a extração dos campos (plano compilado), sem o parse do XML."""
+    docs, grupo, plano = (amostra[0], "infNFe", parsers.PLANO_NFE) if modelo == "nfe" else (amostra[1], "infCte", parsers.PLANO_CTE)
+    infs = [parsers.carregar_xml(x).find(f".//{grupo}") for _, x in docs]
+    benchmark(lambda: [parsers.extrair(i, plano) for i in infs])
+    benchmark.extra_info['docs'] = len(infs)
+
+def test_parse_zip(benchmark, zip_docs, escala, rodadas, banco_vazio):
+    """Leitura do ZIP + detecção do tipo + parse de todos os documentos da escala, em um processo."""
+    tarefas = importar.montar_tarefas([zip_docs], 5000)
+    n = benchmark.pedantic(lambda: sum(ingest.parse_tarefa(t, "auto", False)['docs'] for t in tarefas), rounds=rodadas, iterations=1)
+    benchmark.extra_info['docs'] = n
+    benchmark.extra_info['docs_s'] = round(n / benchmark.stats.stats.mean)
@@ -0,0 +1,18 @@
+# benchmarks/bench_services.py
+# Agregações do dashboard sobre o banco populado: get_dashboard_data, get_cte_aggregated e o cubo.
+import pytest
+import services
+
+pytest.importorskip("pytest_benchmark")
+
+def test_get_dashboard_data(benchmark, usar_banco, rodadas):
+    df = benchmark.pedantic(services.get_dashboard_data, rounds=rodadas, iterations=1)
+    benchmark.extra_info['linhas'] = len(df)
+
+def test_get_cte_aggregated(benchmark, usar_banco, rodadas):
+    df = benchmark.pedantic(services.get_cte_aggregated, rounds=rodadas, iterations=1)
+    benchmark.extra_info['linhas'] = len(df)
+
+def test_build_cube(benchmark, dashboard, rodadas):
+    cubo = benchmark.pedantic(services.build_cube, args=(dashboard,), rounds=rodadas, iterations=1)
+    benchmark.extra_info['linhas_cubo'] = len(cubo)
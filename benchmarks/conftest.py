@@ -0,0 +1,98 @@
+# benchmarks/conftest.py
+# Fixtures dos benchmarks (pip install pytest-benchmark). Os arquivos se chamam bench_*.py para não entrar
+# no `pytest` comum; rode-os explicitamente a partir da raiz do projeto:
+#   python -m pytest benchmarks/bench_parse.py benchmarks/bench_insert.py benchmarks/bench_services.py benchmarks/bench_filters.py
+#   BENCH_ESCALAS=10000,100000,1000000 python -m pytest benchmarks/bench_services.py --benchmark-autosave
+# Memória (pico por etapa + orçamentos): benchmarks/bench_memoria.py ou python -m benchmarks.memoria
+# Os dados sintéticos (um ZIP e um banco por escala/seed) ficam em benchmarks/.cache e são
+# reaproveitados entre execuções; apague a pasta ao mudar parsers/gerador.
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pytest
+import database as db
+import importar
+import ingest
+import services
+from benchmarks import gerador
+
+ESCALAS = [int(x) for x in os.environ.get("BENCH_ESCALAS", "10000").split(",") if x.strip()]
+SEED = int(os.environ.get("BENCH_SEED", "42"))
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+LOTE = 2000
+
+def rotulo(n): return f"{n // 1000}k" if n < 10**6 else f"{n // 10**6}M"
+
+def parsear(zip_docs, caminho_banco):
+    """Gera os lotes parseados do ZIP (em paralelo). A classificação consulta memoria_ia de 'caminho_banco'."""
+    anterior = db.DB_FILE; db.DB_FILE = caminho_banco
+    try:
+        db.init_db()
+        tarefas = importar.montar_tarefas([zip_docs], LOTE)
+        with ProcessPoolExecutor() as pool:
+            yield from pool.map(ingest.parse_tarefa, tarefas, repeat("auto"), repeat(False)) # Sem acervo
+    finally: db.DB_FILE = anterior
+
+def popular_banco(caminho, zip_docs):
+    """Ingestão completa do ZIP em 'caminho' (parse em paralelo, gravação em lotes)."""
+    for lote in parsear(zip_docs, caminho): # DB_FILE aponta para 'caminho' enquanto o gerador roda
+        ok, msg = ingest.gravar_lote(lote)
+        if not ok: raise RuntimeError(msg)
+
+@pytest.fixture(scope="session", params=ESCALAS, ids=rotulo)
+def escala(request): return request.param
+
+@pytest.fixture(scope="session")
+def zip_docs(escala):
+    os.makedirs(CACHE, exist_ok=True)
+    caminho = os.path.join(CACHE, f"docs_{rotulo(escala)}_{SEED}.zip")
+    if not os.path.exists(caminho):
+        gerador.escrever_zip(caminho + ".tmp", gerador.gerar_documentos(escala, SEED))
+        os.replace(caminho + ".tmp", caminho)
+    return caminho
+
+@pytest.fixture(scope="session")
+def banco(escala, zip_docs):
+    """Banco SQLite já populado com os documentos da escala."""
+    caminho = os.path.join(CACHE, f"banco_{rotulo(escala)}_{SEED}.db")
+    if not os.path.exists(caminho):
+        popular_banco(caminho + ".tmp", zip_docs)
+        os.replace(caminho + ".tmp", caminho)
+    anterior = db.DB_FILE; db.DB_FILE = caminho
+    try: db.init_db() # Banco do cache criado por uma versão anterior do schema: migra
+    finally: db.DB_FILE = anterior
+    return caminho
+
+@pytest.fixture(scope="session")
+def rodadas(escala):
+    """Rodadas por benchmark: menos repetições nas escalas grandes."""
+    return 5 if escala <= 10000 else 3 if escala <= 100000 else 1
+
+@pytest.fixture(scope="session")
+def lotes(zip_docs):
+    """Todos os documentos da escala já parseados (atenção à memória em 1M)."""
+    return list(parsear(zip_docs, os.path.join(CACHE, "classificacao.db")))
+
+@pytest.fixture(scope="session")
+def dashboard(banco):
+    """Notas enriquecidas (services.get_dashboard_data) + colunas da sidebar do app."""
+    anterior = db.DB_FILE; db.DB_FILE = banco
+    try: dr = services.get_dashboard_data()
+    finally: db.DB_FILE = anterior
+    dr['Dia'] = dr['Dt_Ref'].dt.day.fillna(0).astype(int)
+    dr['Label_Emitente'] = dr['emitente'].fillna('').astype(str)
+    dr['Label_Destinatario'] = dr['destinatario'].fillna('').astype(str)
+    return dr
+
+@pytest.fixture
+def usar_banco(banco, monkeypatch):
+    """Aponta database.DB_FILE para o banco populado durante o teste."""
+    monkeypatch.setattr(db, "DB_FILE", banco)
+    return banco
+
+@pytest.fixture
+def banco_vazio(tmp_path, monkeypatch):
+    caminho = str(tmp_path / "vazio.db")
+    monkeypatch.setattr(db, "DB_FILE", caminho)
+    db.init_db()
+    return caminho
@@ -0,0 +1,185 @@
+# benchmarks/gerador.py
+# Gerador de XML sintético de CT-e/NF-e (cteProc/nfeProc) para benchmarks e testes de carga.
+# Uso: python -m benchmarks.gerador --docs 100000 --saida /tmp/bench_100k.zip
+import argparse
+import random
+import zipfile
+from config import CNPJS_CIA
+
+NS_CTE = "http://www.portalfiscal.inf.br/cte"
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+# (município, UF, código IBGE)
+CIDADES = [
+    ("SAO PAULO", "SP", "3550308"), ("PIRASSUNUNGA", "SP", "3539301"), ("CAMPINAS", "SP", "3509502"),
+    ("BRASILIA", "DF", "5300108"), ("GOIANIA", "GO", "5208707"), ("VALPARAISO DE GOIAS", "GO", "5221858"),
+    ("CONTAGEM", "MG", "3118601"), ("BELO HORIZONTE", "MG", "3106200"), ("RIO DE JANEIRO", "RJ", "3304557"),
+    ("VIANA", "ES", "3205101"), ("RECIFE", "PE", "2611606"), ("OLINDA", "PE", "2609600"),
+    ("FORTALEZA", "CE", "2304400"), ("TERESINA", "PI", "2211001"), ("TIMON", "MA", "2112209"),
+    ("SALVADOR", "BA", "2927408"), ("CAMPO GRANDE", "MS", "5002704"), ("CUIABA", "MT", "5103403"),
+    ("CURITIBA", "PR", "4106902"), ("PORTO ALEGRE", "RS", "4314902"), ("MANAUS", "AM", "1302603"),
+    ("BELEM", "PA", "1501402"),
+]
+COD_UF = {"SP": "35", "DF": "53", "GO": "52", "MG": "31", "RJ": "33", "ES": "32", "PE": "26", "CE": "23", "PI": "22",
+          "MA": "21", "BA": "29", "MS": "50", "MT": "51", "PR": "41", "RS": "43", "AM": "13", "PA": "15"}
+TRANSPORTADORAS = [(f"{40000000 + i:08d}0001{i % 90 + 10:02d}", f"TRANSPORTES SINTETICOS {i:02d} LTDA") for i in range(12)]
+CFOP_VENDA = ["5102", "6102", "6108", "5405"]
+CFOP_TRANSF = ["5152", "6152"]
+CFOP_COMPRA = ["1102", "2102"]
+PRODUTOS = [(f"{i:06d}", f"PRODUTO SINTETICO {i}", f"0201{i % 10000:04d}") for i in range(500)]
+
+# Variações de namespace vistas em arquivos reais de ERPs/SEFAZ
+VARIANTES_NS = ('padrao', 'sem_namespace', 'prefixo', 'sem_proc')
+
+def dv_chave(base):
+    """Dígito verificador (módulo 11) dos 43 primeiros dígitos da chave de acesso."""
+    soma = sum(int(d) * (2 + i % 8) for i, d in enumerate(reversed(base)))
+    r = soma % 11
+    return "0" if r < 2 else str(11 - r)
+
+def chave_acesso(uf, ano, mes, cnpj, modelo, numero, rng):
+    base = f"{COD_UF[uf]}{ano % 100:02d}{mes:02d}{cnpj}{modelo}001{numero % 10**9:09d}1{rng.randrange(10**8):08d}"
+    return base + dv_chave(base)
+
+def _variante(corpo, raiz_proc, ns, versao, variante):
+    """Monta o documento final. corpo: XML do NFe/CTe (sem xmlns)."""
+    if variante == 'sem_proc':
+        i = corpo.index('>'); corpo = f'{corpo[:i]} xmlns="{ns}"{corpo[i:]}'
+        return '<?xml version="1.0" encoding="UTF-8"?>' + corpo
+    if variante == 'sem_namespace':
+        return f'<?xml version="1.0" encoding="UTF-8"?><{raiz_proc} versao="{versao}">{corpo}</{raiz_proc}>'
+    doc = f'<{raiz_proc} versao="{versao}">{corpo}</{raiz_proc}>'
+    if variante == 'prefixo':
+        doc = doc.replace('</', '\x00').replace('<', '<p:').replace('\x00', '</p:')
+        i = doc.index(' '); doc = f'{doc[:i]} xmlns:p="{ns}"{doc[i:]}'
+    else:
+        i = doc.index(' '); doc = f'{doc[:i]} xmlns="{ns}"{doc[i:]}'
+    return '<?xml version="1.0" encoding="UTF-8"?>' + doc
+
+def _participante(rng, clientes):
+    """CNPJ da empresa (CNPJS_CIA) ou de um cliente/fornecedor sintético."""
+    if rng.random() < 0.5: return rng.choice(CIA)
+    return rng.choice(clientes)
+
+CIA = list(CNPJS_CIA)
+
+def gerar_nfe(rng, numero, clientes, anos=(2023, 2024), itens=(1, 8), variante='padrao'):
+    """Retorna (chave, bytes, meta) de uma NF-e autorizada (nfeProc)."""
+    c_emit = _participante(rng, clientes); c_dest = _participante(rng, clientes)
+    if c_emit == c_dest: c_dest = rng.choice(clientes)
+    orig = rng.choice(CIDADES); dest = rng.choice(CIDADES)
+    ano = rng.choice(anos); mes = rng.randint(1, 12); dia = rng.randint(1, 28)
+    chave = chave_acesso(orig[1], ano, mes, c_emit, "55", numero, rng)
+    if c_emit in CNPJS_CIA and c_dest in CNPJS_CIA: cfops = CFOP_TRANSF
+    elif c_emit in CNPJS_CIA: cfops = CFOP_VENDA
+    else: cfops = CFOP_COMPRA
+    cfop = rng.choice(cfops)
+    n_itens = rng.randint(*itens) if isinstance(itens, tuple) else itens
+    dets = []; v_total = 0.0
+    for i in range(1, n_itens + 1):
+        cod, nome, ncm = rng.choice(PRODUTOS)
+        q = rng.randint(1, 2000); v = round(q * rng.uniform(2, 60), 2); v_total += v
+        dets.append(f'<det nItem="{i}"><prod><cProd>{cod}</cProd><xProd>{nome}</xProd><NCM>{ncm}</NCM><CFOP>{cfop}</CFOP>'
+                    f'<uCom>KG</uCom><qCom>{q}.0000</qCom><vUnCom>{v / q:.4f}</vUnCom><vProd>{v:.2f}</vProd></prod></det>')
+    transp = rng.choice(TRANSPORTADORAS)
+    peso = rng.randint(50, 28000)
+    corpo = (
+        f'<NFe><infNFe Id="NFe{chave}" versao="4.00"><ide><cUF>{COD_UF[orig[1]]}</cUF><nNF>{numero}</nNF><serie>1</serie>'
+        f'<dhEmi>{ano}-{mes:02d}-{dia:02d}T{rng.randint(6, 20):02d}:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        f'<emit><CNPJ>{c_emit}</CNPJ><xNome>EMITENTE {c_emit[:8]}</xNome><enderEmit><xLgr>RUA A</xLgr><cMun>{orig[2]}</cMun>'
+        f'<xMun>{orig[0]}</xMun><UF>{orig[1]}</UF><CEP>{rng.randint(10000000, 99999999)}</CEP></enderEmit></emit>'
+        f'<dest><CNPJ>{c_dest}</CNPJ><xNome>DESTINATARIO {c_dest[:8]}</xNome><enderDest><xLgr>RUA B</xLgr><cMun>{dest[2]}</cMun>'
+        f'<xMun>{dest[0]}</xMun><UF>{dest[1]}</UF><CEP>{rng.randint(10000000, 99999999)}</CEP></enderDest></dest>'
+        f'{"".join(dets)}<total><ICMSTot><vProd>{v_total:.2f}</vProd><vNF>{v_total:.2f}</vNF></ICMSTot></total>'
+        f'<transp><modFrete>{rng.choice("0011")}</modFrete><transporta><CNPJ>{transp[0]}</CNPJ><xNome>{transp[1]}</xNome></transporta>'
+        f'<vol><qVol>{rng.randint(1, 40)}</qVol><pesoL>{peso * 0.95:.3f}</pesoL><pesoB>{peso}.000</pesoB></vol></transp>'
+        f'</infNFe></NFe>'
+    )
+    if variante != 'sem_proc':
+        corpo += f'<protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe><cStat>100</cStat></infProt></protNFe>'
+    meta = {'ano': ano, 'mes': mes, 'orig': orig, 'dest': dest, 'peso': peso}
+    return chave, _variante(corpo, 'nfeProc', NS_NFE, "4.00", variante).encode('utf-8'), meta
+
+def gerar_cte(rng, numero, chaves_nf, meta_nf, complemento_de=None, variante='padrao'):
+    """
+    Retorna (chave, bytes) de um CT-e. chaves_nf: NF-e transportadas (multi-NF).
+    complemento_de: chave do CT-e complementado (tpCTe=1, sem infCTeNorm).
+    """
+    transp = rng.choice(TRANSPORTADORAS)
+    orig, dest = meta_nf['orig'], meta_nf['dest']
+    ano, mes = meta_nf['ano'], meta_nf['mes']
+    chave = chave_acesso(orig[1], ano, mes, transp[0], "57", numero, rng)
+    frete = round(rng.uniform(80, 9000), 2) if not complemento_de else round(rng.uniform(10, 400), 2)
+    comps = f'<Comp><xNome>FRETE PESO</xNome><vComp>{frete * 0.9:.2f}</vComp></Comp>'
+    if rng.random() < 0.4: comps += f'<Comp><xNome>PEDAGIO</xNome><vComp>{frete * 0.1:.2f}</vComp></Comp>'
+    if complemento_de:
+        tp, norm = "1", f'<infCteComp><chCTe>{complemento_de}</chCTe></infCteComp>'
+    else:
+        tp = "0"
+        docs = "".join(f'<infNFe><chave>{k}</chave></infNFe>' for k in chaves_nf)
+        norm = (f'<infCTeNorm><infCarga><vCarga>{rng.randint(1000, 900000)}.00</vCarga><proPred>DIVERSOS</proPred>'
+                f'<infQ><cUnid>01</cUnid><tpMed>PESO BRUTO</tpMed><qCarga>{meta_nf["peso"]}.0000</qCarga></infQ></infCarga>'
+                f'<infDoc>{docs}</infDoc></infCTeNorm>')
+    corpo = (
+        f'<CTe><infCte Id="CTe{chave}" versao="4.00"><ide><cUF>{COD_UF[orig[1]]}</cUF><CFOP>6353</CFOP><mod>57</mod><serie>1</serie>'
+        f'<nCT>{numero}</nCT><dhEmi>{ano}-{mes:02d}-{rng.randint(1, 28):02d}T12:00:00-03:00</dhEmi><tpCTe>{tp}</tpCTe>'
+        f'<cMunIni>{orig[2]}</cMunIni><xMunIni>{orig[0]}</xMunIni><UFIni>{orig[1]}</UFIni>'
+        f'<cMunFim>{dest[2]}</cMunFim><xMunFim>{dest[0]}</xMunFim><UFFim>{dest[1]}</UFFim></ide>'
+        f'<emit><CNPJ>{transp[0]}</CNPJ><xNome>{transp[1]}</xNome></emit><rem><xNome>REMETENTE</xNome></rem>'
+        f'<dest><xNome>DESTINATARIO</xNome><enderDest><xMun>{dest[0]}</xMun><UF>{dest[1]}</UF></enderDest></dest>'
+        f'<vPrest><vTPrest>{frete:.2f}</vTPrest><vRec>{frete:.2f}</vRec>{comps}</vPrest>{norm}</infCte></CTe>'
+    )
+    if variante != 'sem_proc':
+        corpo += f'<protCTe versao="4.00"><infProt><chCTe>{chave}</chCTe><cStat>100</cStat></infProt></protCTe>'
+    return chave, _variante(corpo, 'cteProc', NS_CTE, "4.00", variante).encode('utf-8')
+
+def gerar_documentos(n_docs, seed=42, anos=(2023, 2024), itens=(1, 8), nfs_por_cte=(1, 4),
+                     frac_complemento=0.05, pesos_variantes=(85, 5, 5, 5), n_clientes=2000):
+    """
+    Gera (nome, bytes) de n_docs documentos: NF-e e os CT-e que as transportam
+    (1 CT-e a cada 'nfs_por_cte' NF-e, parte com CT-e complementar). Determinístico por seed.
+    """
+    rng = random.Random(seed)
+    clientes = [f"{10000000 + i * 7919 % 89999999:08d}0001{i % 90 + 10:02d}" for i in range(n_clientes)]
+    pendentes = []; meta = None; ctes = []
+    alvo = rng.randint(*nfs_por_cte); n_nf = n_ct = gerados = 0
+    var = lambda: rng.choices(VARIANTES_NS, pesos_variantes)[0]
+    while gerados < n_docs:
+        n_nf += 1
+        k, x, meta = gerar_nfe(rng, n_nf, clientes, anos, itens, var())
+        yield f"NFe{k}.xml", x; gerados += 1
+        pendentes.append(k)
+        if len(pendentes) < alvo or gerados >= n_docs: continue
+        n_ct += 1
+        kc, xc = gerar_cte(rng, n_ct, pendentes, meta, variante=var())
+        yield f"CTe{kc}.xml", xc; gerados += 1
+        ctes.append((kc, meta))
+        pendentes = []; alvo = rng.randint(*nfs_por_cte)
+        if gerados < n_docs and rng.random() < frac_complemento:
+            n_ct += 1; ref, m = rng.choice(ctes[-1000:])
+            kc, xc = gerar_cte(rng, n_ct, [], m, complemento_de=ref, variante=var())
+            yield f"CTe{kc}.xml", xc; gerados += 1
+
+def escrever_zip(caminho, docs, compressao=zipfile.ZIP_DEFLATED):
+    n = 0
+    with zipfile.ZipFile(caminho, 'w', compressao) as zf:
+        for nome, x in docs: zf.writestr(nome, x); n += 1
+    return n
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.gerador", description="Gera XML sintéticos de CT-e/NF-e em um ZIP.")
+    ap.add_argument("--docs", type=int, default=10000, help="Total de documentos (NF-e + CT-e)")
+    ap.add_argument("--saida", default="sintetico.zip")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--itens", type=int, nargs=2, default=(1, 8), metavar=("MIN", "MAX"), help="Itens por NF-e")
+    ap.add_argument("--nfs-por-cte", type=int, nargs=2, default=(1, 4), metavar=("MIN", "MAX"))
+    ap.add_argument("--complemento", type=float, default=0.05, help="Fração de CT-e complementares (tpCTe=1)")
+    ap.add_argument("--variantes", type=int, nargs=4, default=(85, 5, 5, 5), metavar=("PADRAO", "SEM_NS", "PREFIXO", "SEM_PROC"),
+                    help="Pesos das variantes de namespace")
+    args = ap.parse_args(argv)
+    n = escrever_zip(args.saida, gerar_documentos(args.docs, args.seed, itens=tuple(args.itens), nfs_por_cte=tuple(args.nfs_por_cte),
+                                                  frac_complemento=args.complemento, pesos_variantes=args.variantes))
+    print(f"{n:,} documentos gravados em {args.saida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# benchmarks/memoria.py
+# Modo memória: roda a ingestão e as agregações do services sob tracemalloc + amostragem de RSS,
+# reporta o pico por etapa e o tamanho dos DataFrames resultantes e falha (código 1) quando
+# algum orçamento de benchmarks/orcamento_memoria.json (ou --orcamento) é excedido.
+# Uso: python -m benchmarks.memoria --docs 100000
+#      python -m benchmarks.memoria --zip /dados/2024.zip --orcamento get_dashboard_data:pico_py_mb=300
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+import database as db
+import filters
+import importar
+import ingest
+import services
+from benchmarks import gerador
+
+MB = 1024 * 1024
+ORCAMENTO_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orcamento_memoria.json")
+
+def rss_atual():
+    """RSS do processo em bytes (psutil se instalado, senão /proc; 0 se indisponível)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError: pass
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError): return 0
+
+def tamanho_mb(obj):
+    """Memória (deep) de DataFrame/Series, ou da 1ª posição de uma tupla (ex.: (df, índice))."""
+    if isinstance(obj, tuple) and obj: obj = obj[0]
+    if isinstance(obj, pd.DataFrame): return obj.memory_usage(deep=True).sum() / MB
+    if isinstance(obj, pd.Series): return obj.memory_usage(deep=True) / MB
+    return None
+
+@contextmanager
+def medir(nome, resultados, intervalo=0.01):
+    """
+    Mede a etapa: pico e retenção do heap Python (tracemalloc, se ativo) e pico de RSS
+    amostrado em thread. Campos extras (ex.: 'df_mb') podem ser postos no dict devolvido.
+    """
+    rastreando = tracemalloc.is_tracing()
+    if rastreando: tracemalloc.reset_peak(); base = tracemalloc.get_traced_memory()[0]
+    rss0 = rss_atual(); pico = {'rss': rss0}; parar = threading.Event()
+    def amostrar():
+        while not parar.wait(intervalo): pico['rss'] = max(pico['rss'], rss_atual())
+    th = threading.Thread(target=amostrar, daemon=True); th.start()
+    info = {}; t = time.perf_counter()
+    try: yield info
+    finally:
+        parar.set(); th.join()
+        pico['rss'] = max(pico['rss'], rss_atual())
+        r = {'etapa': nome, 'seg': round(time.perf_counter() - t, 2),
+             'rss_inicio_mb': round(rss0 / MB, 1), 'pico_rss_mb': round(pico['rss'] / MB, 1), 'delta_rss_mb': round((pico['rss'] - rss0) / MB, 1)}
+        if rastreando:
+            atual, pico_py = tracemalloc.get_traced_memory()
+            r['pico_py_mb'] = round((pico_py - base) / MB, 1); r['retido_py_mb'] = round((atual - base) / MB, 1)
+        r.update(info); resultados.append(r)
+
+def executar(zip_docs, lote=2000):
+    """
+    Ingere o ZIP em um banco temporário (parse e gravação no processo atual, para o
+    tracemalloc enxergar) e roda as cargas/agregações do dashboard. Retorna a lista de medições.
+    """
+    res = []; anterior = db.DB_FILE
+    pasta = tempfile.mkdtemp(prefix="mem_")
+    db.DB_FILE = os.path.join(pasta, "memoria.db")
+    try:
+        db.init_db()
+        tarefas = importar.montar_tarefas([zip_docs], lote)
+        with medir('ingestao', res) as info:
+            n = 0
+            for t in tarefas:
+                lt = ingest.parse_tarefa(t, "auto", False); n += lt['docs']
+                ok, msg = ingest.gravar_lote(lt)
+                if not ok: raise RuntimeError(msg)
+                del lt
+            info['docs'] = n
+        for tabela in ('nfe', 'cte', 'itens'):
+            with medir(f'load_data:{tabela}', res) as info:
+                df = db.load_data(tabela); info['linhas'] = len(df); info['df_mb'] = round(tamanho_mb(df), 1)
+            del df
+        with medir('get_dashboard_data', res) as info:
+            dr = services.get_dashboard_data(); info['linhas'] = len(dr); info['df_mb'] = round(tamanho_mb(dr), 1)
+        with medir('get_cte_aggregated', res) as info:
+            ag = services.get_cte_aggregated(); info['linhas'] = len(ag); info['df_mb'] = round(tamanho_mb(ag) or 0, 1)
+        del ag
+        if not dr.empty:
+            dr['Dia'] = dr['Dt_Ref'].dt.day.fillna(0).astype(int)
+            dr['Label_Emitente'] = dr['emitente'].fillna('').astype(str)
+            dr['Label_Destinatario'] = dr['destinatario'].fillna('').astype(str)
+            with medir('build_cube', res) as info:
+                cubo = services.build_cube(dr); info['linhas'] = len(cubo); info['df_mb'] = round(tamanho_mb(cubo), 1)
+            with medir('build_filter_index', res) as info:
+                idx = filters.build_filter_index(dr)
+                info['df_mb'] = round(sum(c.nbytes for c, _ in idx.values()) / MB, 1)
+    finally:
+        db.DB_FILE = anterior
+        for a in os.listdir(pasta): os.remove(os.path.join(pasta, a))
+        os.rmdir(pasta)
+    return res
+
+def carregar_orcamento(caminho, extras=()):
+    """
+    JSON: {"docs": N, "etapas": {etapa: {metrica: MB}}}. Limites valem para N documentos e
+    crescem linearmente acima disso. extras: ["etapa:metrica=MB"] da linha de comando.
+    """
+    orc = {'docs': 0, 'etapas': {}}
+    if caminho and os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as f: orc = json.load(f)
+    for e in extras:
+        alvo, valor = e.split("=", 1); etapa, metrica = alvo.split(":", 1)
+        orc['etapas'].setdefault(etapa, {})[metrica] = float(valor)
+    return orc
+
+def verificar(resultados, orcamento, docs):
+    """Lista de violações (texto) das medições contra o orçamento."""
+    escala = max(1.0, docs / orcamento['docs']) if orcamento.get('docs') else 1.0
+    falhas = []
+    for r in resultados:
+        for metrica, limite in orcamento['etapas'].get(r['etapa'], {}).items():
+            if metrica in r and r[metrica] > limite * escala:
+                falhas.append(f"{r['etapa']}: {metrica} = {r[metrica]:,.1f} MB > {limite * escala:,.1f} MB")
+    return falhas
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.memoria", description="Pico de memória por etapa da ingestão e do dashboard.")
+    ap.add_argument("--docs", type=int, default=100000, help="Documentos sintéticos (ignorado com --zip)")
+    ap.add_argument("--zip", help="ZIP de XML reais em vez do gerador")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--orcamento", action="append", default=[], metavar="ETAPA:METRICA=MB", help="Sobrescreve/adiciona limite")
+    ap.add_argument("--arquivo-orcamento", default=ORCAMENTO_PADRAO)
+    ap.add_argument("--sem-tracemalloc", action="store_true", help="Só RSS (tracemalloc deixa tudo ~2x mais lento)")
+    ap.add_argument("--json", help="Grava as medições neste arquivo")
+    args = ap.parse_args(argv)
+
+    zip_docs = args.zip; temp = None
+    if not zip_docs:
+        temp = zip_docs = os.path.join(tempfile.gettempdir(), f"mem_{args.docs}_{args.seed}.zip")
+        gerador.escrever_zip(zip_docs, gerador.gerar_documentos(args.docs, args.seed))
+    if not args.sem_tracemalloc: tracemalloc.start()
+    try: res = executar(zip_docs)
+    finally:
+        if tracemalloc.is_tracing(): tracemalloc.stop()
+        if temp: os.remove(temp)
+
+    df = pd.DataFrame(res).set_index('etapa')
+    print(df.fillna('').to_string())
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(res, f, ensure_ascii=False, indent=1)
+    docs = res[0].get('docs', 0) if res else 0
+    falhas = verificar(res, carregar_orcamento(args.arquivo_orcamento, args.orcamento), docs)
+    if falhas:
+        print("\nOrçamento de memória excedido:")
+        for f in falhas: print(" - " + f)
+        raise SystemExit(1)
+    print("\nOrçamentos de memória OK.")
+
+if __name__ == "__main__":
+    main()
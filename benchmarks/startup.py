@@ -0,0 +1,101 @@
+# benchmarks/startup.py
+# Tempo de partida do app, para a prontidão dos pods: importação dos módulos em processo novo
+# (python -X importtime, maiores custos acumulados), servidor pronto (/_stcore/health de um
+# 'streamlit run') e primeira pintura (AppTest: 1ª execução do script a frio e rerun a quente).
+# Falha (código 1) se alguma medida passar de --limite (ex.: --limite primeira_pintura=4000).
+# Uso: python -m benchmarks.startup
+#      python -m benchmarks.startup --pasta /dados --sem-servidor --json startup.json
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, "app.py")
+# Módulos que o app.py importa no topo
+MODULOS = ["streamlit", "pandas", "plotly.express", "plotly.graph_objects", "acervo", "cache_disco", "database",
+           "exportar", "metrics", "services", "filters", "config", "utils"]
+
+def importacao(modulos=MODULOS, top=12):
+    """(total_ms, [(módulo, acumulado_ms)]) da importação em processo novo, maiores primeiro."""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modulos)],
+                       cwd=RAIZ, capture_output=True, text=True)
+    total, raiz = 0, []
+    for linha in r.stderr.splitlines():
+        if not linha.startswith("import time:") or "|" not in linha: continue
+        partes = linha[len("import time:"):].split("|")
+        try: proprio, acumulado = int(partes[0]), int(partes[1])
+        except ValueError: continue # cabeçalho
+        total += proprio
+        if not partes[2][1:].startswith(" "): raiz.append((partes[2].strip(), acumulado / 1000)) # Nível mais externo
+    return total / 1000, sorted(raiz, key=lambda x: -x[1])[:top]
+
+def _porta_livre():
+    with socket.socket() as s: s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+def servidor_pronto(pasta, timeout=120):
+    """ms até o /_stcore/health de um 'streamlit run app.py' responder (None se não subir)."""
+    porta = _porta_livre()
+    p = subprocess.Popen([sys.executable, "-m", "streamlit", "run", APP, "--server.headless", "true", "--server.port", str(porta),
+                          "--browser.gatherUsageStats", "false"], cwd=pasta, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    inicio = time.perf_counter()
+    try:
+        while time.perf_counter() - inicio < timeout and p.poll() is None:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{porta}/_stcore/health", timeout=1) as r:
+                    if r.status == 200: return (time.perf_counter() - inicio) * 1000
+            except OSError: time.sleep(0.05)
+        return None
+    finally:
+        p.terminate()
+        try: p.wait(10)
+        except subprocess.TimeoutExpired: p.kill()
+
+def primeira_pintura(pasta, timeout=300):
+    """(ms da 1ª execução do app.py a frio, ms do rerun seguinte, exceções) via streamlit AppTest."""
+    os.chdir(pasta); sys.path.insert(0, RAIZ)
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    t = time.perf_counter(); at.run(); frio = (time.perf_counter() - t) * 1000
+    t = time.perf_counter(); at.run(); quente = (time.perf_counter() - t) * 1000
+    return frio, quente, [e.message for e in at.exception]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.startup", description="Tempo de importação, servidor pronto e primeira pintura do app.")
+    ap.add_argument("--pasta", default=os.getcwd(), help="Pasta de trabalho do app (onde está o banco)")
+    ap.add_argument("--top", type=int, default=12, help="Módulos mais caros listados")
+    ap.add_argument("--sem-servidor", action="store_true", help="Não sobe o 'streamlit run' (só importação e AppTest)")
+    ap.add_argument("--limite", action="append", default=[], metavar="MEDIDA=MS", help="Ex.: primeira_pintura=4000 (pode repetir)")
+    ap.add_argument("--json", help="Grava as medições neste arquivo")
+    args = ap.parse_args(argv)
+    pasta = os.path.abspath(args.pasta)
+
+    res = {}
+    res['importacao'], top = importacao(top=args.top)
+    print(f"Importação (processo novo): {res['importacao']:,.0f} ms")
+    for m, ms in top: print(f"  {m:<28}{ms:>10,.1f} ms")
+    if not args.sem_servidor:
+        res['servidor_pronto'] = servidor_pronto(pasta)
+        print(f"Servidor pronto (/_stcore/health): {res['servidor_pronto']:,.0f} ms" if res['servidor_pronto'] else "Servidor não respondeu")
+    res['primeira_pintura'], res['rerun'], excecoes = primeira_pintura(pasta)
+    print(f"Primeira pintura (script a frio): {res['primeira_pintura']:,.0f} ms | rerun: {res['rerun']:,.0f} ms")
+    for e in excecoes: print(f"  exceção no app: {e}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(res, f, indent=1)
+
+    falhas = []
+    for l in args.limite:
+        medida, valor = l.split("=", 1)
+        if res.get(medida) is None or res[medida] > float(valor): falhas.append(f"{medida}: {res.get(medida) or 0:,.0f} ms > {valor} ms")
+    if excecoes: falhas.append(f"{len(excecoes)} exceção(ões) na primeira execução")
+    if falhas:
+        print("\nPartida acima do limite:")
+        for f in falhas: print(" - " + f)
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# cache_disco.py
+# Cache persistente dos DataFrames caros do app (notas enriquecidas, CT-e agregados, cubo) em
+# Parquet, compartilhado entre processos/réplicas da mesma máquina e entre reinícios.
+# Chave: nome + banco (caminho e id sorteado na criação, db.get_id_banco) + versão dos dados
+# (db.get_data_version) + versão do código que monta os DataFrames (versao_codigo) + argumentos:
+# só recalcula quando os dados, o banco ou o código mudam. Escrita atômica (arquivo temporário + os.replace), um único cálculo por chave
+# entre processos (arquivo .lock exclusivo) e LRU por tamanho (CACHE_MAX_MB, pelo mtime de acesso).
+import glob
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+import pandas as pd
+import database as db
+import metrics
+from config import CACHE_DIR, CACHE_MAX_MB
+
+LOCK_ESPERA = 120 # Segundos até considerar abandonado o .lock de um processo que morreu calculando
+CODIGO = ("services.py", "database.py", "utils.py", "rotas.py") # Módulos que definem as colunas/valores dos DataFrames
+
+@lru_cache(maxsize=None)
+def versao_codigo():
+    """Hash dos módulos em CODIGO e da versão do pandas: atualização do app invalida o cache antigo."""
+    h = hashlib.sha1(pd.__version__.encode())
+    for m in CODIGO:
+        try:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), m), 'rb') as f: h.update(f.read())
+        except OSError: h.update(m.encode())
+    return h.hexdigest()[:16]
+
+def caminho(nome, versao, args=()):
+    chave = repr((os.path.abspath(db.DB_FILE), db.get_id_banco(), versao, versao_codigo(), args)).encode()
+    return os.path.join(CACHE_DIR, f"{nome}-{hashlib.sha1(chave).hexdigest()[:16]}.parquet")
+
+def obter(nome, versao, funcao, *args):
+    """DataFrame de funcao(*args) para a versão dos dados: do disco se já calculado, senão calcula e grava."""
+    arq = caminho(nome, versao, args); t = time.perf_counter()
+    df = _ler(arq)
+    if df is None:
+        with _trava(arq):
+            df = _ler(arq) # Outro processo pode ter gravado enquanto esperávamos
+            if df is None:
+                df = funcao(*args); _gravar(arq, df); origem = 'miss'
+            else: origem = 'hit'
+    else: origem = 'hit'
+    c = metrics.coletor_ativo()
+    if c is not None: metrics.registrar(c, f"cache_disco:{nome}", time.perf_counter() - t, linhas_out=len(df), cache=origem)
+    return df
+
+def _ler(arq):
+    try: df = pd.read_parquet(arq)
+    except Exception: return None # Inexistente, incompleto ou sem pyarrow
+    try: os.utime(arq) # Acesso recente para o LRU
+    except OSError: pass
+    return df
+
+def _gravar(arq, df):
+    tmp = f"{arq}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, arq)
+    except Exception: # Tipos que o Parquet não representa: segue sem cache
+        try: os.remove(tmp)
+        except OSError: pass
+        return
+    limpar()
+
+@contextmanager
+def _trava(arq):
+    """Lock entre processos: arquivo .lock criado com O_EXCL (portável, sem fcntl)."""
+    lock = arq + ".lock"; minha = False
+    try: os.makedirs(CACHE_DIR, exist_ok=True)
+    except OSError: pass
+    while not minha:
+        try: os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)); minha = True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > LOCK_ESPERA: os.remove(lock)
+            except OSError: pass
+            time.sleep(0.1)
+        except OSError: break # Pasta sem escrita: calcula sem coordenar
+    try: yield
+    finally:
+        if minha:
+            try: os.remove(lock)
+            except OSError: pass
+
+def limpar(limite_mb=CACHE_MAX_MB):
+    """Remove os arquivos menos acessados até o cache caber em limite_mb."""
+    arquivos = []
+    for a in glob.glob(os.path.join(CACHE_DIR, "*.parquet")):
+        try: st = os.stat(a); arquivos.append((st.st_mtime, st.st_size, a))
+        except OSError: pass
+    total = sum(s for _, s, _ in arquivos); limite = limite_mb * 1024 * 1024
+    for _, s, a in sorted(arquivos):
+        if total <= limite: break
+        try: os.remove(a); total -= s
+        except OSError: pass
@@ -1,4 +1,5 @@
 # config.py
+import os
 
 # Lista de CNPJs da Empresa (Para lógica interna)
 CNPJS_CIA = [
@@ -48,4 +49,40 @@ TABELA_ANTT = {
     "Neogranel": {2: (3.3436, 417.95), 3: (4.6495, 509.23), 4: (5.3428, 562.44), 5: (6.0021, 607.56), 6: (6.7230, 658.16), 7: (7.3493, 763.86), 9: (8.2608, 813.33)}
 }
 
-DB_FILE = "dados_fiscais.db"
\ No newline at end of file
+DB_FILE = "dados_fiscais.db"
+# Cache em disco (cache_disco.py) dos DataFrames do app, por versão dos dados; LRU acima do limite
+CACHE_DIR = "cache_app"
+CACHE_MAX_MB = 1024
+# Log de erros: detalhe mantido por LOG_RETENCAO_DIAS e até LOG_MAX_LINHAS; o resumo por dia, por
+# LOG_RESUMO_DIAS. LOG_PAGINA linhas por página na aba de logs (detalhe e resumo)
+LOG_RETENCAO_DIAS = 90
+LOG_RESUMO_DIAS = 365
+LOG_MAX_LINHAS = 200000
+LOG_PAGINA = 100
+# Exportações (exportar.py): linhas por bloco lido do banco e gravado no arquivo. Os arquivos
+# gerados no app ficam em EXPORT_DIR e são apagados depois de EXPORT_RETENCAO_HORAS
+EXPORT_LOTE = 20000
+EXPORT_DIR = "exportacoes"
+EXPORT_RETENCAO_HORAS = 24
+# Escritor único (escritor.py): máximo de escritas enfileiradas gravadas num mesmo commit
+ESCRITOR_GRUPO = 64
+
+# Ingestão em segundo plano: uploads são gravados em SPOOL_DIR e processados pelo worker
+SPOOL_DIR = "spool"
+WORKER_LOTE = 500 # Documentos por commit no banco
+WORKER_INTERVALO = 2 # Segundos entre consultas à fila quando ociosa
+WORKER_TENTATIVAS = 3 # Job que falha volta à fila até esse total de tentativas; depois fica 'erro'
+SPOOL_RETENCAO_HORAS = 72 # Pastas do spool sem job ativo mais antigas que isso são apagadas
+
+# Acervo dos XML originais (acervo.py): cada documento uma vez, comprimido, em banco separado.
+# Permite reextrair campos novos (python -m reextrair) sem reenviar os arquivos.
+ACERVO_ATIVO = True
+ACERVO_DB = "acervo_xml.db"
+
+# Distâncias (rotas.py): km rodoviário estimado = linha reta x fator de circuidade da malha.
+# Pares presentes na matriz (CSV origem;destino;km, rótulos 'Município-UF') usam o km dela.
+FATOR_CIRCUITO = 1.25
+MATRIZ_DISTANCIAS = "distancias_rodoviarias.csv"
+# Municípios (código IBGE;nome;uf;lat;lon) que acompanham o código; a tabela completa do IBGE
+# pode substituir o arquivo (também aceita codigo_ibge/latitude/longitude, UF pelo código)
+MUNICIPIOS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "municipios.csv")
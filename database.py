@@ -1,55 +1,143 @@
 # database.py
+import os
+import re
+import shutil
 import sqlite3
+import sys
+import json
+from collections import Counter
+from functools import wraps
+import numpy as np
 import pandas as pd
-from config import DB_FILE
-from datetime import datetime
+import escritor
+import rotas
+from config import DB_FILE, LOG_MAX_LINHAS, LOG_RESUMO_DIAS, LOG_RETENCAO_DIAS
+from datetime import datetime, timedelta
+from urllib.request import pathname2url
+from metrics import medido
 
 def get_connection():
     return sqlite3.connect(DB_FILE, timeout=30, check_same_thread=False)
 
+def conexao_fatos(anos=None):
+    """
+    Conexão de leitura dos fatos. Com anos fechados (partições) ou 'anos' pedidos, anexa só as
+    partições dos anos pedidos (todas se None), somente leitura, e cria views TEMP com a união
+    do principal e das partições: nfe_base, itens_base, cte_header, cte_nf e as views nfe, itens, cte.
+    Partição sem arquivo fica fora (aviso no stderr; o app mostra get_particoes_ausentes); acima do
+    limite de anexos do SQLite, OperationalError.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=30, check_same_thread=False, uri=True)
+    fechados = _anos_fechados(conn)
+    if anos is not None:
+        anos = sorted({str(int(a)) for a in anos}); fechados = [a for a in fechados if a in anos]
+    ausentes = [a for a in fechados if not os.path.exists(arquivo_particao(a))]
+    if ausentes:
+        print(f"Aviso: partições sem arquivo, anos fora da leitura: {', '.join(arquivo_particao(a) for a in ausentes)}", file=sys.stderr)
+        fechados = [a for a in fechados if a not in ausentes]
+    if fechados or anos is not None:
+        try: _anexar(conn, fechados, anos)
+        except Exception: conn.close(); raise
+    return conn
+
+def escrita(falha=None, exclusiva=False):
+    """
+    Função de escrita f(c, ...) executada pelo escritor único (escritor.py), dentro do group commit.
+    A chamada normal espera o commit e devolve o retorno de f; falha(e) converte o erro no retorno
+    (None: propaga). f.enviar(...) devolve o Future sem esperar. exclusiva: f roda fora do group
+    commit, em autocommit, e abre as próprias transações (ATTACH/VACUUM).
+    """
+    def deco(f):
+        f.exclusiva = exclusiva
+        @wraps(f)
+        def chamar(*args):
+            try: return escritor.enviar(DB_FILE, f, *args).result()
+            except Exception as e:
+                if falha is None: raise
+                return falha(e)
+        chamar.enviar = lambda *args: escritor.enviar(DB_FILE, f, *args)
+        return chamar
+    return deco
+
 def init_db():
+    """Cria/migra o schema. Conexão direta: roda na partida, antes das escritas."""
     conn = get_connection()
     try: conn.execute("PRAGMA journal_mode=WAL;")
     except: pass
-    c = conn.cursor()
-    
-    # Tabela CTE: Adicionado campo 'tp_cte' para diferenciar Complemento de Normal
-    c.execute('''CREATE TABLE IF NOT EXISTS cte (
-        chave_cte_propria TEXT,
-        chave_nf TEXT,
+    _criar_schema(conn.cursor())
+    conn.commit()
+    _alinhar_particoes(conn)
+    conn.close()
+
+def _criar_schema(c):
+    # Dimensões: textos repetidos (participantes, cidades, produtos) gravados uma vez, fatos guardam o id
+    c.execute('''CREATE TABLE IF NOT EXISTS participantes (
+        id INTEGER PRIMARY KEY, cnpj TEXT NOT NULL, nome TEXT NOT NULL, UNIQUE(cnpj, nome)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS cidades (
+        id INTEGER PRIMARY KEY, rotulo TEXT NOT NULL UNIQUE, nome TEXT, uf TEXT, cod_ibge TEXT
+    )''')
+    _add_column(c, 'cidades', 'lat', 'REAL'); _add_column(c, 'cidades', 'lon', 'REAL')
+    _add_column(c, 'cidades', 'precisao', 'TEXT') # 'uf' / 'municipio'; '' = sem coordenada; NULL = não resolvida
+    # Cache persistente do motor de distâncias (rotas.py), por par de cidades
+    c.execute('''CREATE TABLE IF NOT EXISTS distancias (
+        origem_id INTEGER, destino_id INTEGER, km REAL, fonte TEXT, PRIMARY KEY (origem_id, destino_id)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS produtos (
+        id INTEGER PRIMARY KEY, codigo TEXT NOT NULL, descricao TEXT NOT NULL, ncm TEXT NOT NULL, UNIQUE(codigo, descricao, ncm)
+    )''')
+    _preparar_migracao(c)
+
+    # CT-e: cabeçalho uma vez por documento + vínculo enxuto com as NF-e transportadas.
+    # 'tp_cte' diferencia Complemento de Normal.
+    c.execute('''CREATE TABLE IF NOT EXISTS cte_header (
+        chave_cte_propria TEXT PRIMARY KEY,
         data TEXT, 
         numero_cte TEXT, 
-        emitente TEXT, 
-        cnpj_emit TEXT, 
-        remetente TEXT, 
-        destinatario TEXT, 
+        emitente_id INTEGER, 
+        remetente_id INTEGER, 
+        destinatario_id INTEGER, 
         frete_valor REAL, 
         peso_kg REAL, 
-        numero_nf_cte TEXT, 
-        cidade_origem TEXT, 
-        cidade_destino TEXT, 
+        cidade_origem_id INTEGER, 
+        cidade_destino_id INTEGER, 
         pedagio_valor REAL, 
         chave_ref_cte TEXT, 
         tp_cte TEXT,
         arquivo TEXT,
-        etapa_manual TEXT,
-        UNIQUE(chave_cte_propria, chave_nf) ON CONFLICT IGNORE
+        etapa_manual TEXT
     )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS cte_nf (
+        chave_cte_propria TEXT, chave_nf TEXT, numero_nf_cte TEXT,
+        PRIMARY KEY (chave_cte_propria, chave_nf)
+    ) WITHOUT ROWID''')
     
     # Tabela NFe
-    c.execute('''CREATE TABLE IF NOT EXISTS nfe (
-        chave_nf TEXT PRIMARY KEY, data TEXT, numero_nf TEXT, emitente TEXT, destinatario TEXT, 
-        cnpj_emit TEXT, cnpj_dest TEXT, uf_dest TEXT, valor_nf REAL, peso_bruto REAL, 
-        transportadora TEXT, cidade_origem TEXT, cidade_destino TEXT, mod_frete TEXT, 
+    c.execute('''CREATE TABLE IF NOT EXISTS nfe_base (
+        chave_nf TEXT PRIMARY KEY, data TEXT, numero_nf TEXT, emitente_id INTEGER, destinatario_id INTEGER, 
+        uf_dest TEXT, valor_nf REAL, peso_bruto REAL, 
+        transportadora_id INTEGER, cidade_origem_id INTEGER, cidade_destino_id INTEGER, mod_frete TEXT, 
         cfop_predominante TEXT, tipo_operacao TEXT, qtd_itens INTEGER, 
         cep_origem TEXT, cep_destino TEXT, distancia REAL, arquivo TEXT
-    )''')
+    )''') # distancia: legado; a leitura usa o cache 'distancias' pelo par de cidades (DO_CACHE)
+    _add_column(c, 'nfe_base', 'tipo_manual', 'INTEGER') # 1: tipo_operacao definido no app para a nota (a reextração mantém)
     
-    c.execute('''CREATE TABLE IF NOT EXISTS itens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, chave_nf TEXT, numero_nf TEXT, emitente TEXT, 
-        item_num TEXT, produto TEXT, ncm TEXT, cfop TEXT, unidade TEXT, qtd_display TEXT, 
+    c.execute('''CREATE TABLE IF NOT EXISTS itens_base (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, chave_nf TEXT, numero_nf TEXT, emitente_id INTEGER, 
+        item_num TEXT, produto_id INTEGER, cfop TEXT, unidade TEXT, qtd_display TEXT, 
         qtd_float REAL, vl_total REAL, arquivo TEXT
     )''')
+    _migrar_textos(c)
+
+    # Compatibilidade: views com as colunas de texto das antigas tabelas (cte: uma linha por CT-e x NF-e)
+    for fato in FATOS: _criar_view(c, fato)
+    
+    # Eventos de CT-e/NF-e (cancelamento, carta de correção...)
+    c.execute('''CREATE TABLE IF NOT EXISTS eventos (
+        chave TEXT, modelo TEXT, tp_evento TEXT, n_seq TEXT, desc_evento TEXT, data TEXT,
+        protocolo TEXT, status TEXT, motivo TEXT, arquivo TEXT,
+        UNIQUE(chave, tp_evento, n_seq) ON CONFLICT IGNORE
+    )''')
     
     c.execute('''CREATE TABLE IF NOT EXISTS memoria_ia (
         id INTEGER PRIMARY KEY AUTOINCREMENT, cfop TEXT, fluxo TEXT, tipo_definido TEXT, UNIQUE(cfop, fluxo)
@@ -58,100 +146,889 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS logs (
         id INTEGER PRIMARY KEY AUTOINCREMENT, data_hora TEXT, arquivo TEXT, tipo_doc TEXT, status TEXT, mensagem TEXT
     )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_logs_data ON logs (data_hora)')
+    # Resumo dos erros (mensagem x tipo x dia), atualizado na inserção; sobrevive à retenção do detalhe
+    novo_resumo = _tipo_objeto(c, 'logs_resumo') is None
+    c.execute('''CREATE TABLE IF NOT EXISTS logs_resumo (
+        dia TEXT, tipo_doc TEXT, mensagem TEXT, qtd INTEGER, ultimo TEXT, PRIMARY KEY (dia, tipo_doc, mensagem)
+    ) WITHOUT ROWID''')
+    if novo_resumo:
+        c.connection.create_function('msg_resumo', 1, msg_resumo, deterministic=True)
+        c.execute('''INSERT INTO logs_resumo (dia, tipo_doc, mensagem, qtd, ultimo)
+                     SELECT substr(data_hora, 1, 10), COALESCE(tipo_doc, ''), msg_resumo(mensagem), COUNT(*), MAX(data_hora)
+                     FROM logs GROUP BY 1, 2, 3''')
 
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cte_propria ON cte (chave_cte_propria)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cte_nf ON cte (chave_nf)')
-    
-    conn.commit()
-    conn.close()
+    # Fila de ingestão em segundo plano (ver worker.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT, status TEXT, arquivos TEXT,
+        total INTEGER, processados INTEGER DEFAULT 0, registros INTEGER DEFAULT 0, erros INTEGER DEFAULT 0, bytes INTEGER DEFAULT 0,
+        mensagem TEXT, criado_em TEXT, inicio TEXT, fim TEXT, atualizado_em TEXT
+    )''')
+    _add_column(c, 'jobs', 'perfil', 'TEXT') # Modo de profiling pedido no upload (None, 'cprofile', 'pyinstrument')
+    _add_column(c, 'jobs', 'tentativas', 'INTEGER DEFAULT 0')
+
+    # Métricas por etapa de cada execução de ingestão (worker, importador, watcher)
+    c.execute('''CREATE TABLE IF NOT EXISTS ingest_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, origem TEXT, inicio TEXT, duracao REAL,
+        docs INTEGER, registros INTEGER, erros INTEGER, bytes INTEGER, etapas TEXT, perfil TEXT
+    )''')
+
+    # Backfill: documentos que não puderam ser completados (sem origem / campo ausente no XML)
+    c.execute('''CREATE TABLE IF NOT EXISTS backfill_pendencias (
+        tabela TEXT, chave TEXT, motivo TEXT, tentado_em TEXT, PRIMARY KEY (tabela, chave)
+    )''')
+
+    # Arquivos já ingeridos pelo watcher de pasta (caminho + mtime + hash)
+    c.execute('''CREATE TABLE IF NOT EXISTS arquivos_processados (
+        caminho TEXT PRIMARY KEY, mtime REAL, hash TEXT, processado_em TEXT
+    )''')
+
+    # Versão dos dados: incrementada a cada escrita, usada como chave dos caches do app
+    c.execute('''CREATE TABLE IF NOT EXISTS controle (chave TEXT PRIMARY KEY, valor INTEGER)''')
+    c.execute("INSERT OR IGNORE INTO controle (chave, valor) VALUES ('versao_dados', 0)")
+    # Identidade do arquivo: sorteada na criação, distingue um banco recriado no mesmo caminho
+    c.execute("INSERT OR IGNORE INTO controle (chave, valor) VALUES ('id_banco', ?)", (int.from_bytes(os.urandom(7), 'big'),))
+
+    # Anos fechados: fatos do ano num arquivo próprio (arquivo_particao), somente leitura
+    c.execute('''CREATE TABLE IF NOT EXISTS particoes (
+        ano TEXT PRIMARY KEY, fechada_em TEXT, notas INTEGER, ctes INTEGER, bytes INTEGER
+    )''')
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_cte_nf_nf ON cte_nf (chave_nf)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_itens_nf ON itens_base (chave_nf)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_eventos_chave ON eventos (chave)')
+
+RESUMO_MSG = 200 # Caracteres da mensagem usados no agrupamento do resumo de erros
+# Posição (lxml: 'line 3, column 17') e números longos (chaves, valores) variam por arquivo
+_RE_POSICAO = re.compile(r"\b(line|column|linha|coluna|col)\s+\d+", re.I)
+_RE_NUMERO = re.compile(r"\d{4,}")
+
+def msg_resumo(msg):
+    """Mensagem agrupável do resumo: sem posição no arquivo nem números longos, até RESUMO_MSG caracteres."""
+    return _RE_NUMERO.sub("#", _RE_POSICAO.sub(r"\1 #", str(msg or "")))[:RESUMO_MSG]
+
+# Colunas das views (ordem das antigas tabelas) e quais ficam no vínculo CT-e x NF-e
+COLS_CTE = ['chave_cte_propria', 'chave_nf', 'data', 'numero_cte', 'emitente', 'cnpj_emit', 'remetente', 'destinatario',
+            'frete_valor', 'peso_kg', 'numero_nf_cte', 'cidade_origem', 'cidade_destino', 'pedagio_valor', 'chave_ref_cte',
+            'tp_cte', 'arquivo', 'etapa_manual']
+COLS_CTE_NF = ['chave_cte_propria', 'chave_nf', 'numero_nf_cte']
+COLS_NFE = ['chave_nf', 'data', 'numero_nf', 'emitente', 'destinatario', 'cnpj_emit', 'cnpj_dest', 'uf_dest', 'valor_nf',
+            'peso_bruto', 'transportadora', 'cidade_origem', 'cidade_destino', 'mod_frete', 'cfop_predominante',
+            'tipo_operacao', 'qtd_itens', 'cep_origem', 'cep_destino', 'distancia', 'fonte_distancia', 'arquivo']
+COLS_ITENS = ['id', 'chave_nf', 'numero_nf', 'emitente', 'cnpj_emit', 'item_num', 'cod_produto', 'produto', 'ncm', 'cfop',
+              'unidade', 'qtd_display', 'qtd_float', 'vl_total', 'arquivo']
+
+# Dimensão: colunas da chave natural (textos ausentes viram '')
+DIMS = {'participantes': ('cnpj', 'nome'), 'cidades': ('rotulo',), 'produtos': ('codigo', 'descricao', 'ncm')}
+_PART = 'participantes'
+# Fato: (FROM das tabelas base, colunas da view, {coluna id: (dimensão, {coluna de texto: campo da dimensão})})
+FATOS = {
+    'nfe': ("nfe_base t", COLS_NFE, {
+        'emitente_id': (_PART, {'cnpj_emit': 'cnpj', 'emitente': 'nome'}),
+        'destinatario_id': (_PART, {'cnpj_dest': 'cnpj', 'destinatario': 'nome'}),
+        'transportadora_id': (_PART, {'transportadora': 'nome'}),
+        'cidade_origem_id': ('cidades', {'cidade_origem': 'rotulo'}),
+        'cidade_destino_id': ('cidades', {'cidade_destino': 'rotulo'})}),
+    'itens': ("itens_base t", COLS_ITENS, {
+        'emitente_id': (_PART, {'cnpj_emit': 'cnpj', 'emitente': 'nome'}),
+        'produto_id': ('produtos', {'cod_produto': 'codigo', 'produto': 'descricao', 'ncm': 'ncm'})}),
+    'cte': ("cte_header t JOIN cte_nf n USING (chave_cte_propria)", COLS_CTE, {
+        'emitente_id': (_PART, {'cnpj_emit': 'cnpj', 'emitente': 'nome'}),
+        'remetente_id': (_PART, {'remetente': 'nome'}),
+        'destinatario_id': (_PART, {'destinatario': 'nome'}),
+        'cidade_origem_id': ('cidades', {'cidade_origem': 'rotulo'}),
+        'cidade_destino_id': ('cidades', {'cidade_destino': 'rotulo'})}),
+}
+BASE = {'nfe': 'nfe_base', 'itens': 'itens_base', 'cte': 'cte_header'}
+# Colunas do fato lidas do cache 'distancias' pelo par (cidade_origem_id, cidade_destino_id), não da
+# linha: partição congelada e rotas recalculadas sempre leem a distância atual
+DO_CACHE = {'nfe': {'distancia': 'km', 'fonte_distancia': 'fonte'}}
+_JOIN_CACHE = " LEFT JOIN distancias x ON x.origem_id = t.cidade_origem_id AND x.destino_id = t.cidade_destino_id"
+COLUNAS_DIM = {col for _, _, refs in FATOS.values() for _, campos in refs.values() for col in campos}
+# Cidade gravada como 'Município-UF': nome e UF separados uma vez, na dimensão
+_SQL_CIDADES = """UPDATE cidades SET nome = substr(rotulo, 1, length(rotulo) - 3), uf = substr(rotulo, -2)
+                  WHERE nome IS NULL AND substr(rotulo, -3, 1) = '-'"""
+
+def _por_coluna(fato):
+    """{coluna de texto: (coluna id, dimensão, campo)}"""
+    return {col: (id_col, dim, campo) for id_col, (dim, campos) in FATOS[fato][2].items() for col, campo in campos.items()}
+
+def _qualificar(fato, col): return f"n.{col}" if fato == 'cte' and col in COLS_CTE_NF[1:] else f"t.{col}"
+
+def _sql_view(fato, temp=False):
+    origem, cols, refs = FATOS[fato]
+    alias = {id_col: f"d{i}" for i, id_col in enumerate(refs)}
+    por_col = _por_coluna(fato)
+    cache = DO_CACHE.get(fato, {})
+    sel = [f"{alias[por_col[k][0]]}.{por_col[k][2]} AS {k}" if k in por_col else f"x.{cache[k]} AS {k}" if k in cache
+           else _qualificar(fato, k) for k in cols]
+    joins = ''.join(f" LEFT JOIN {dim} {alias[id_col]} ON {alias[id_col]}.id = t.{id_col}" for id_col, (dim, _) in refs.items())
+    if cache: joins += _JOIN_CACHE
+    return f"CREATE {'TEMP ' if temp else ''}VIEW {fato} AS SELECT {', '.join(sel)} FROM {origem}{joins}"
+
+def _criar_view(c, fato):
+    sql = _sql_view(fato)
+    atual = c.execute("SELECT sql FROM sqlite_master WHERE type='view' AND name=?", (fato,)).fetchone()
+    if atual and atual[0] == sql: return
+    c.execute(f"DROP VIEW IF EXISTS {fato}"); c.execute(sql)
 
-def destroy_db():
-    conn = get_connection(); c = conn.cursor()
-    tables = ['cte', 'nfe', 'itens', 'memoria_ia', 'logs']
+def _tipo_objeto(c, nome):
+    r = c.execute("SELECT type FROM sqlite_master WHERE name=?", (nome,)).fetchone()
+    return r[0] if r else None
+
+def _preparar_migracao(c):
+    """
+    Bancos antigos guardam os textos nas próprias tabelas (nfe, itens, cte e o cte_header com
+    texto): renomeia para _<nome>_antiga, migradas por _migrar_textos depois das novas criadas.
+    """
+    antigas = [t for t in ('nfe', 'itens', 'cte') if _tipo_objeto(c, t) == 'table']
+    if _tipo_objeto(c, 'cte_header') and 'emitente' in [r[1] for r in c.execute("PRAGMA table_info(cte_header)")]: antigas.append('cte_header')
+    if not antigas: return
+    for v in FATOS:
+        if _tipo_objeto(c, v) == 'view': c.execute(f"DROP VIEW {v}")
+    for t in antigas: c.execute(f"ALTER TABLE {t} RENAME TO _{t}_antiga")
+
+def _migrar_textos(c):
+    if _tipo_objeto(c, '_nfe_antiga'):
+        _migrar_fato(c, 'nfe', '_nfe_antiga'); c.execute("DROP TABLE _nfe_antiga")
+    if _tipo_objeto(c, '_itens_antiga'):
+        # CNPJ do emitente vem do cabeçalho da NF-e (a antiga tabela de itens só tinha o nome)
+        _migrar_fato(c, 'itens', "(SELECT i.*, (SELECT p.cnpj FROM nfe_base b JOIN participantes p ON p.id = b.emitente_id WHERE b.chave_nf = i.chave_nf) AS cnpj_emit FROM _itens_antiga i)")
+        c.execute("DROP TABLE _itens_antiga")
+    if _tipo_objeto(c, '_cte_antiga'):
+        # 'cte' antiga: cabeçalho repetido por NF-e. MAX ignora NULL de linhas parciais.
+        cols = [r[1] for r in c.execute("PRAGMA table_info(_cte_antiga)")]
+        cab = [k for k in COLS_CTE if k in cols and k not in COLS_CTE_NF[1:]]
+        sel = ','.join(k if k == 'chave_cte_propria' else f"MAX({k}) AS {k}" for k in cab)
+        _migrar_fato(c, 'cte', f"(SELECT {sel} FROM _cte_antiga GROUP BY chave_cte_propria)")
+        c.execute("INSERT OR IGNORE INTO cte_nf (chave_cte_propria, chave_nf, numero_nf_cte) SELECT chave_cte_propria, chave_nf, numero_nf_cte FROM _cte_antiga")
+        c.execute("DROP TABLE _cte_antiga")
+    if _tipo_objeto(c, '_cte_header_antiga'):
+        _migrar_fato(c, 'cte', '_cte_header_antiga'); c.execute("DROP TABLE _cte_header_antiga")
+
+def _migrar_fato(c, fato, origem):
+    """Copia linhas com os textos (tabela antiga ou subconsulta) para a base do fato, trocando textos por ids."""
+    base = BASE[fato]
+    tem = [d[0] for d in c.execute(f"SELECT * FROM {origem} LIMIT 0").description]
+    val = lambda k: f"o.{k}" if k in tem else "NULL"
+    sel = {}
+    for id_col, (dim, campos) in FATOS[fato][2].items():
+        expr = {campo: f"COALESCE({val(k)}, '')" for k, campo in campos.items()}
+        chave = [expr.get(f, "''") for f in DIMS[dim]]
+        nulo = ' AND '.join(f"{val(k)} IS NULL" for k in campos)
+        c.execute(f"INSERT OR IGNORE INTO {dim} ({','.join(DIMS[dim])}) SELECT DISTINCT {','.join(chave)} FROM {origem} o WHERE NOT ({nulo})")
+        busca = ' AND '.join(f"d.{f} = {e}" for f, e in zip(DIMS[dim], chave))
+        sel[id_col] = f"CASE WHEN {nulo} THEN NULL ELSE (SELECT id FROM {dim} d WHERE {busca}) END"
+    cols = [r[1] for r in c.execute(f"PRAGMA table_info({base})") if r[1] in sel or r[1] in tem]
+    c.execute(f"INSERT OR IGNORE INTO {base} ({','.join(cols)}) SELECT {','.join(sel.get(k, 'o.' + k) for k in cols)} FROM {origem} o")
+    _completar_cidades(c)
+
+def _internar(c, fato, linhas):
+    """Linhas do parser -> linhas da base: textos dicionarizados viram ids (entradas novas são criadas)."""
+    refs = FATOS[fato][2]
+    texto = {k for _, campos in refs.values() for k in campos}
+    saida = [{k: v for k, v in d.items() if k not in texto} for d in linhas]
+    for id_col, (dim, campos) in refs.items():
+        # Coluna de texto de cada campo da chave ('' não existe no dict: o fato não tem o campo)
+        cols = [next((k for k, f in campos.items() if f == campo), '') for campo in DIMS[dim]]
+        brutos = [tuple(map(d.get, cols)) for d in linhas]
+        # Só os valores distintos vão ao banco; todos nulos -> id NULL
+        chave = {b: tuple(v or '' for v in b) for b in set(brutos) if any(v is not None for v in b)}
+        novas = set(chave.values())
+        c.executemany(f"INSERT OR IGNORE INTO {dim} ({','.join(DIMS[dim])}) VALUES ({','.join(['?']*len(DIMS[dim]))})", novas)
+        busca = f"SELECT id FROM {dim} WHERE {' AND '.join(f'{f} = ?' for f in DIMS[dim])}"
+        ids = {k: c.execute(busca, k).fetchone()[0] for k in novas}
+        ids = {b: ids[k] for b, k in chave.items()}
+        for d, b in zip(saida, brutos): d[id_col] = ids.get(b)
+    _completar_cidades(c)
+    if fato in ('nfe', 'cte'): _distancias(c, {(d.get('cidade_origem_id'), d.get('cidade_destino_id')) for d in saida}) # Lida na carga (DO_CACHE) e na auditoria ANTT
+    return saida
+
+def _completar_cidades(c):
+    """Cidades novas: nome/UF separados do rótulo e coordenadas (rotas.coordenada)."""
+    c.execute(_SQL_CIDADES)
+    novas = c.execute("SELECT id, rotulo FROM cidades WHERE precisao IS NULL").fetchall()
+    if novas: c.executemany("UPDATE cidades SET lat = ?, lon = ?, precisao = ?, cod_ibge = COALESCE(?, cod_ibge) WHERE id = ?",
+                            [(*rotas.coordenada(r), i) for i, r in novas])
+
+def _distancias(c, pares):
+    """{(origem_id, destino_id): km} pelo cache 'distancias'; os pares que faltam são calculados e gravados."""
+    pares = {p for p in pares if None not in p}
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS _pares (origem_id INTEGER, destino_id INTEGER, PRIMARY KEY (origem_id, destino_id))")
+    c.execute("DELETE FROM _pares")
+    c.executemany("INSERT INTO _pares VALUES (?,?)", pares)
+    km = {(o, d): k for o, d, k in c.execute("SELECT x.origem_id, x.destino_id, x.km FROM distancias x JOIN _pares p USING (origem_id, destino_id)")}
+    faltam = [p for p in pares if p not in km]
+    if faltam:
+        ids = list({i for p in faltam for i in p})
+        cid = {}
+        for i in range(0, len(ids), 500):
+            parte = ids[i:i + 500]
+            cid.update({r[0]: r[1:] for r in c.execute(f"SELECT id, rotulo, lat, lon, precisao FROM cidades WHERE id IN ({','.join(['?']*len(parte))})", parte)})
+        calc = rotas.calcular([(cid[o], cid[d]) for o, d in faltam])
+        c.executemany("INSERT OR REPLACE INTO distancias (origem_id, destino_id, km, fonte) VALUES (?,?,?,?)", [(*p, k, f) for p, (k, f) in zip(faltam, calc)])
+        km.update({p: k for p, (k, _) in zip(faltam, calc)})
+    return km
+
+def _dividir_cte(linhas):
+    """Linhas do parse_cte (uma por NF-e) -> (cabeçalhos únicos, vínculos)."""
+    cab = {}
+    for d in linhas: cab.setdefault(d['chave_cte_propria'], {k: v for k, v in d.items() if k not in COLS_CTE_NF[1:]})
+    return list(cab.values()), [{k: d.get(k) for k in COLS_CTE_NF} for d in linhas]
+
+def _carregar_fato(conn, fato, colunas=None, anos=None, condicao=None):
+    """
+    Lê a base com os ids e decodifica pelas dimensões (um vetor por campo): o DataFrame aponta
+    para um único objeto str por valor distinto, em vez de um por linha como a view.
+    Com partições anexadas, uma parte por arquivo (cada junção no próprio arquivo, pelos índices).
+    """
+    origem, cols, _ = FATOS[fato]
+    cols = colunas or cols; por_col = _por_coluna(fato)
+    cache = {k: v for k, v in DO_CACHE.get(fato, {}).items() if k in cols}
+    ids = list(dict.fromkeys([por_col[k][0] for k in cols if k in por_col] + (['cidade_origem_id', 'cidade_destino_id'] if cache else [])))
+    sel = ','.join([_qualificar(fato, k) for k in cols if k not in por_col and k not in cache] + [f"t.{i}" for i in ids])
+    partes = []
+    for esq, ano in _esquemas(conn):
+        where = _filtro_ano(BASE[fato], anos, ano)
+        if condicao: where = f"{where} AND {condicao}" if where else f" WHERE {condicao}"
+        partes.append(f"SELECT {sel} FROM {_no_esquema(origem, esq)}{where}")
+    df = pd.read_sql(" UNION ALL ".join(partes), conn)
+    vetores = {}
+    for k in cols:
+        if k not in por_col: continue
+        id_col, dim, campo = por_col[k]
+        if (dim, campo) not in vetores:
+            d = pd.read_sql(f"SELECT id, {campo} FROM {dim}", conn)
+            v = np.full(int(d['id'].max()) + 1 if len(d) else 1, None, dtype=object); v[d['id'].to_numpy()] = d[campo].to_numpy()
+            vetores[(dim, campo)] = v
+        df[k] = vetores[(dim, campo)][df[id_col].fillna(0).astype('int64').to_numpy()]
+    if cache:
+        x = pd.read_sql(f"SELECT origem_id, destino_id, {', '.join(set(cache.values()))} FROM distancias", conn)
+        pos = pd.MultiIndex.from_frame(x[['origem_id', 'destino_id']]).get_indexer(
+            pd.MultiIndex.from_arrays([df['cidade_origem_id'].fillna(-1).astype('int64'), df['cidade_destino_id'].fillna(-1).astype('int64')]))
+        for k, campo in cache.items():
+            v = x[campo].to_numpy(); df[k] = np.append(v, np.nan if v.dtype.kind == 'f' else None)[pos] # pos -1: par fora do cache
+    return df[cols]
+
+def _add_column(c, tabela, coluna, tipo):
+    """Migração simples: adiciona a coluna em bancos criados antes dela existir."""
+    if coluna not in [r[1] for r in c.execute(f"PRAGMA table_info({tabela})")]:
+        c.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+def _bump_version(c):
+    c.execute("UPDATE controle SET valor = valor + 1 WHERE chave = 'versao_dados'")
+
+@medido()
+def get_data_version():
+    conn = get_connection()
     try:
-        for t in tables: c.execute(f"DROP TABLE IF EXISTS {t}")
-        conn.commit()
-        init_db()
-        return True, "Banco recriado com sucesso."
-    except Exception as e: return False, str(e)
+        res = conn.execute("SELECT valor FROM controle WHERE chave = 'versao_dados'").fetchone()
+        return res[0] if res else 0
+    except: return 0
     finally: conn.close()
 
-def insert_cte_many(lista_dados):
-    if not lista_dados: return True, "Sem dados"
-    conn = get_connection(); c = conn.cursor()
-    cols = ','.join(lista_dados[0].keys())
-    pl = ','.join(['?']*len(lista_dados[0]))
+def get_id_banco():
+    conn = get_connection()
     try:
-        c.executemany(f"INSERT OR IGNORE INTO cte ({cols}) VALUES ({pl})", [tuple(d.values()) for d in lista_dados])
-        conn.commit()
-        return True, f"{c.rowcount} registros."
-    except Exception as e:
-        return False, f"Erro CTE: {str(e)}"
+        res = conn.execute("SELECT valor FROM controle WHERE chave = 'id_banco'").fetchone()
+        return res[0] if res else 0
+    except: return 0
     finally: conn.close()
 
-def insert_nfe_many(lista_header, lista_items):
-    conn = get_connection(); c = conn.cursor()
+@escrita(lambda e: (False, str(e)))
+def destroy_db(c):
+    for ano in _anos_fechados(c): _apagar_particao(ano)
+    tables = ['cte_header', 'cte_nf', 'nfe_base', 'itens_base', 'participantes', 'cidades', 'produtos', 'eventos', 'memoria_ia', 'logs', 'logs_resumo', 'distancias', 'particoes']
+    for v in FATOS: c.execute(f"DROP {'VIEW' if _tipo_objeto(c, v) == 'view' else 'TABLE'} IF EXISTS {v}")
+    for t in tables: c.execute(f"DROP TABLE IF EXISTS {t}")
+    _criar_schema(c)
+    _bump_version(c)
+    return True, "Banco recriado com sucesso."
+
+@escrita(lambda e: (False, f"Erro CTE: {str(e)}"))
+def insert_cte_many(c, lista_dados):
+    if not lista_dados: return True, "Sem dados"
+    cabecalhos, vinculos = _dividir_cte(lista_dados)
+    _reabrir(c, 'cte_header', [d['chave_cte_propria'] for d in cabecalhos]) # Ano fechado: a cópia (com edições) ignora a reimportação
+    cabecalhos = _internar(c, 'cte', cabecalhos)
+    for tabela, linhas in (('cte_header', cabecalhos), ('cte_nf', vinculos)):
+        cols = ','.join(linhas[0].keys())
+        pl = ','.join(['?']*len(linhas[0]))
+        c.executemany(f"INSERT OR IGNORE INTO {tabela} ({cols}) VALUES ({pl})", [tuple(d.values()) for d in linhas])
+    n = c.rowcount
+    _bump_version(c)
+    return True, f"{n} registros."
+
+@escrita(lambda e: (False, f"Erro NFe: {str(e)}"))
+def insert_nfe_many(c, lista_header, lista_items):
+    chaves = [d['chave_nf'] for d in lista_header + lista_items]
+    _reabrir(c, 'nfe_base', chaves) # Ano fechado: a cópia (com edições) ignora a reimportação
+    existentes = _na_main(c, 'nfe_base', list(dict.fromkeys(chaves)))
+    if lista_header:
+        lista_header = _internar(c, 'nfe', lista_header)
+        cols = ','.join(lista_header[0].keys())
+        pl = ','.join(['?']*len(lista_header[0]))
+        c.executemany(f"INSERT OR IGNORE INTO nfe_base ({cols}) VALUES ({pl})", [tuple(d.values()) for d in lista_header])
+    lista_items = [d for d in lista_items if d['chave_nf'] not in existentes] # NF-e já gravada: itens ficam como estão
+    if lista_items:
+        lista_items = _internar(c, 'itens', lista_items)
+        ic = ','.join(lista_items[0].keys())
+        ip = ','.join(['?']*len(lista_items[0]))
+        c.executemany(f"INSERT INTO itens_base ({ic}) VALUES ({ip})", [tuple(d.values()) for d in lista_items])
+    _bump_version(c)
+    return True, "Sucesso"
+
+@escrita(lambda e: (False, f"Erro Evento: {str(e)}"))
+def insert_eventos_many(c, lista_eventos):
+    if not lista_eventos: return True, "Sem dados"
+    cols = ','.join(lista_eventos[0].keys())
+    pl = ','.join(['?']*len(lista_eventos[0]))
+    c.executemany(f"INSERT OR IGNORE INTO eventos ({cols}) VALUES ({pl})", [tuple(d.values()) for d in lista_eventos])
+    _bump_version(c)
+    return True, "Sucesso"
+
+@escrita(lambda e: (False, f"Erro reextração: {str(e)}"))
+def upsert_documentos(c, lista_cte, lista_nfe, lista_itens, lista_eventos):
+    """
+    Reextração: atualiza as linhas existentes com os valores do parse atual (colunas fora do
+    dict, como etapa_manual, ficam como estão; tipo_operacao marcado tipo_manual também). Itens
+    das NF-e e vínculos CT-e x NF-e que sumiram do documento são substituídos. Uma transação por lote.
+    """
+    manter = {'nfe_base': {'tipo_operacao': 'tipo_manual'}} # Coluna: flag de valor definido no app
+    def upsert(tabela, linhas, chaves):
+        if not linhas: return
+        cols = list(linhas[0].keys())
+        flag = manter.get(tabela, {})
+        sets = ','.join(f"{k}=CASE WHEN {tabela}.{flag[k]} THEN {tabela}.{k} ELSE excluded.{k} END" if k in flag else f"{k}=excluded.{k}"
+                        for k in cols if k not in chaves)
+        c.executemany(f"INSERT INTO {tabela} ({','.join(cols)}) VALUES ({','.join(['?']*len(cols))}) ON CONFLICT({','.join(chaves)}) DO UPDATE SET {sets}",
+                      [tuple(d.values()) for d in linhas])
+    # Ano fechado: atualiza a cópia no principal (com as edições), não uma linha nova
+    _reabrir(c, 'cte_header', [d['chave_cte_propria'] for d in lista_cte])
+    _reabrir(c, 'nfe_base', [d['chave_nf'] for d in lista_nfe + lista_itens])
+    vinculos = {}
+    for d in lista_cte: vinculos.setdefault(d['chave_cte_propria'], []).append(d['chave_nf'])
+    for k, nfs in vinculos.items():
+        c.execute(f"DELETE FROM cte_nf WHERE chave_cte_propria = ? AND chave_nf NOT IN ({','.join(['?']*len(nfs))})", [k] + nfs)
+    cabecalhos, links = _dividir_cte(lista_cte)
+    upsert('cte_header', _internar(c, 'cte', cabecalhos), ['chave_cte_propria'])
+    upsert('cte_nf', links, ['chave_cte_propria', 'chave_nf'])
+    upsert('nfe_base', _internar(c, 'nfe', lista_nfe), ['chave_nf'])
+    if lista_nfe:
+        c.executemany("DELETE FROM itens_base WHERE chave_nf = ?", [(d['chave_nf'],) for d in lista_nfe])
+    if lista_itens:
+        lista_itens = _internar(c, 'itens', lista_itens)
+        ic = ','.join(lista_itens[0].keys()); ip = ','.join(['?']*len(lista_itens[0]))
+        c.executemany(f"INSERT INTO itens_base ({ic}) VALUES ({ip})", [tuple(d.values()) for d in lista_itens])
+    upsert('eventos', lista_eventos, ['chave', 'tp_evento', 'n_seq'])
+    _bump_version(c)
+    return True, "Sucesso"
+
+@escrita(lambda e: (False, f"Erro log: {str(e)}"))
+def insert_log_many(c, lista_logs):
+    if not lista_logs: return True, "Sem dados"
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    dados = [(agora, l['arquivo'], l['tipo'], 'ERRO', l['msg']) for l in lista_logs]
+    c.executemany("INSERT INTO logs (data_hora, arquivo, tipo_doc, status, mensagem) VALUES (?,?,?,?,?)", dados)
+    resumo = Counter((agora[:10], l['tipo'] or '', msg_resumo(l['msg'])) for l in lista_logs)
+    c.executemany("""INSERT INTO logs_resumo (dia, tipo_doc, mensagem, qtd, ultimo) VALUES (?,?,?,?,?)
+                     ON CONFLICT(dia, tipo_doc, mensagem) DO UPDATE SET qtd = qtd + excluded.qtd, ultimo = excluded.ultimo""",
+                  [(*k, n, agora) for k, n in resumo.items()])
+    _rotacionar_logs(c)
+    return True, "Sucesso"
+
+def _rotacionar_logs(c):
+    """Retenção: detalhe dos últimos LOG_RETENCAO_DIAS e no máximo LOG_MAX_LINHAS linhas; resumo de LOG_RESUMO_DIAS."""
+    limite = (datetime.now() - timedelta(days=LOG_RETENCAO_DIAS)).strftime("%Y-%m-%d %H:%M:%S")
+    c.execute("DELETE FROM logs WHERE data_hora < ?", (limite,))
+    c.execute("DELETE FROM logs WHERE id <= (SELECT MAX(id) FROM logs) - ?", (LOG_MAX_LINHAS,))
+    c.execute("DELETE FROM logs_resumo WHERE dia < ?", ((datetime.now() - timedelta(days=LOG_RESUMO_DIAS)).strftime("%Y-%m-%d"),))
+
+@escrita(lambda e: False)
+def update_cte_etapa(c, chave_cte, etapa):
+    sql = "UPDATE cte_header SET etapa_manual = ? WHERE chave_cte_propria = ?"
+    if not c.execute(sql, (etapa, chave_cte)).rowcount and _reabrir(c, 'cte_header', [chave_cte]): c.execute(sql, (etapa, chave_cte))
+    _bump_version(c)
+    return True
+
+@escrita(lambda e: False)
+def update_ia_memory(c, cfop, fluxo, tipo, chave):
+    sql = "UPDATE nfe_base SET tipo_operacao=?, tipo_manual=1 WHERE chave_nf=?"
+    if chave and not c.execute(sql, (tipo, chave)).rowcount and _reabrir(c, 'nfe_base', [chave]): c.execute(sql, (tipo, chave))
+    c.execute("INSERT OR REPLACE INTO memoria_ia (cfop, fluxo, tipo_definido) VALUES (?, ?, ?)", (cfop, fluxo, tipo))
+    _bump_version(c)
+    return True
+
+def get_ia_memory(cfop, fluxo):
+    conn = get_connection()
     try:
-        if lista_header:
-            cols = ','.join(lista_header[0].keys())
-            pl = ','.join(['?']*len(lista_header[0]))
-            c.executemany(f"INSERT OR IGNORE INTO nfe ({cols}) VALUES ({pl})", [tuple(d.values()) for d in lista_header])
-        if lista_items:
-            ic = ','.join(lista_items[0].keys())
-            ip = ','.join(['?']*len(lista_items[0]))
-            c.executemany(f"INSERT INTO itens ({ic}) VALUES ({ip})", [tuple(d.values()) for d in lista_items])
-        conn.commit()
-        return True, "Sucesso"
-    except Exception as e:
-        return False, f"Erro NFe: {str(e)}"
+        res = conn.execute("SELECT tipo_definido FROM memoria_ia WHERE cfop=? AND fluxo=?", (cfop, fluxo)).fetchone()
+        return res[0] if res else None
+    except: return None
     finally: conn.close()
 
-def insert_log_many(lista_logs):
-    if not lista_logs: return
-    conn = get_connection(); c = conn.cursor()
+@medido()
+def get_logs_resumo(dias=None, limite=None):
+    """(erros por dia x tipo x mensagem, mais recentes e frequentes primeiro, total de grupos); dias: só os últimos N."""
+    conn = get_connection()
     try:
-        agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        dados = [(agora, l['arquivo'], l['tipo'], 'ERRO', l['msg']) for l in lista_logs]
-        c.executemany("INSERT INTO logs (data_hora, arquivo, tipo_doc, status, mensagem) VALUES (?,?,?,?,?)", dados)
-        conn.commit()
-    except: pass
+        desde = (datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d") if dias else ''
+        total = conn.execute("SELECT COUNT(*) FROM logs_resumo WHERE dia >= ?", (desde,)).fetchone()[0]
+        df = pd.read_sql("SELECT dia, tipo_doc, mensagem, qtd, ultimo FROM logs_resumo WHERE dia >= ? ORDER BY dia DESC, qtd DESC LIMIT ?",
+                         conn, params=(desde, limite or -1))
+    except: df, total = pd.DataFrame(), 0
+    conn.close()
+    return df, total
+
+@medido()
+def get_logs_filtros():
+    """(tipos, dias) presentes no detalhe dos logs, para os filtros da tela (dias mais recentes primeiro)."""
+    conn = get_connection()
+    try:
+        tipos = [r[0] for r in conn.execute("SELECT DISTINCT tipo_doc FROM logs WHERE tipo_doc IS NOT NULL ORDER BY 1")]
+        dias = [r[0] for r in conn.execute("SELECT DISTINCT substr(data_hora, 1, 10) FROM logs ORDER BY 1 DESC")]
+    except: tipos, dias = [], []
+    conn.close()
+    return tipos, dias
+
+def _filtro_logs(tipo_doc=None, dia=None, busca=None):
+    where, params = [], []
+    if tipo_doc: where.append("tipo_doc = ?"); params.append(tipo_doc)
+    if dia: where.append("data_hora >= ? AND data_hora < ?"); params += [dia, f"{dia}~"] # Faixa no índice de data_hora
+    if busca: where.append("(mensagem LIKE ? OR arquivo LIKE ?)"); params += [f"%{busca}%"] * 2
+    return (' WHERE ' + ' AND '.join(where) if where else ''), params
+
+def consulta_logs(**filtros):
+    """(sql, params) do detalhe dos logs com os filtros da tela (tipo_doc, dia, busca), mais recentes primeiro."""
+    where, params = _filtro_logs(**filtros)
+    return f"SELECT * FROM logs{where} ORDER BY id DESC", params
+
+@medido()
+def get_logs_pagina(pagina=0, tamanho=100, **filtros):
+    """(DataFrame da página, total de linhas do filtro)."""
+    sql, params = consulta_logs(**filtros)
+    where, _ = _filtro_logs(**filtros)
+    conn = get_connection()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM logs{where}", params).fetchone()[0]
+        df = pd.read_sql(f"{sql} LIMIT ? OFFSET ?", conn, params=params + [tamanho, pagina * tamanho])
+    except: df, total = pd.DataFrame(), 0
+    conn.close()
+    return df, total
+
+@medido()
+def load_data(table, colunas=None, anos=None):
+    """
+    Tabela inteira; fatos de todos os anos ou só de 'anos' (abre só as partições deles).
+    Erro ao ler os fatos (partição ilegível, anexos demais) propaga: vazio esconderia os anos abertos.
+    """
+    if table in FATOS:
+        conn = conexao_fatos(anos)
+        try: return _carregar_fato(conn, table, colunas, anos)
+        finally: conn.close()
+    conn = get_connection()
+    try: df = pd.read_sql(f"SELECT {','.join(colunas) if colunas else '*'} FROM {table}", conn)
+    except: df = pd.DataFrame()
+    conn.close()
+    return df
+
+# --- PARTIÇÕES POR ANO ---
+# Ano fechado (fechar_periodo): NF-e com itens e CT-e com vínculos do ano (pela data do documento)
+# saem do principal para <DB_FILE>_<ano>.db, compactado e somente leitura. Dimensões, logs e filas
+# ficam no principal. Leitores anexam as partições sob demanda (conexao_fatos). Documento de ano
+# fechado gravado de novo (reimportação, edição) fica no principal, que prevalece na leitura.
+# Tabela -> (chave do documento, cabeçalho com a data)
+PARTICIONADAS = {'nfe_base': ('chave_nf', 'nfe_base'), 'itens_base': ('chave_nf', 'nfe_base'),
+                 'cte_header': ('chave_cte_propria', 'cte_header'), 'cte_nf': ('chave_cte_propria', 'cte_header')}
+_INDICES_PART = {'idx_itens_nf': ('itens_base', 'chave_nf'), 'idx_cte_nf_nf': ('cte_nf', 'chave_nf')}
+
+def arquivo_particao(ano):
+    base, ext = os.path.splitext(DB_FILE)
+    return f"{base}_{ano}{ext or '.db'}"
+
+def _uri_leitura(arq): return f"file:{pathname2url(os.path.abspath(arq))}?mode=ro&immutable=1"
+
+def _ano(alias=''): return f"substr({alias}data, 7, 4)" # data em dd/mm/aaaa
+
+def _anos_fechados(c):
+    try: return [r[0] for r in c.execute("SELECT ano FROM main.particoes ORDER BY ano")]
+    except sqlite3.Error: return [] # Banco anterior às partições
+
+def _colunas(c, tabela, esquema='main'): return [r[1] for r in c.execute(f"PRAGMA {esquema}.table_info({tabela})")]
+
+def _chaves_ano(tabela, ano):
+    chave, cab = PARTICIONADAS[tabela]
+    return f"SELECT {chave} FROM main.{cab} WHERE {_ano()} = '{ano}'"
+
+def _filtro_ano(tabela, anos=None, ano=None):
+    """WHERE da tabela na união: no principal (ano None) só 'anos'; na partição do 'ano', só o que o principal não regravou."""
+    chave, cab = PARTICIONADAS[tabela]
+    if ano is not None: return f" WHERE t.{chave} NOT IN ({_chaves_ano(tabela, ano)})"
+    if anos is None: return ''
+    lista = ','.join(f"'{a}'" for a in anos)
+    if tabela == cab: return f" WHERE {_ano('t.')} IN ({lista})"
+    return f" WHERE t.{chave} IN (SELECT {chave} FROM main.{cab} WHERE {_ano()} IN ({lista}))"
+
+def _no_esquema(origem, esquema):
+    return re.sub(rf"\b({'|'.join(PARTICIONADAS)})\b", rf"{esquema}.\1", origem)
+
+def _esquemas(conn):
+    """[(esquema, ano)] lidos pelos fatos: o principal (ano None) e as partições anexadas."""
+    anexadas = [re.fullmatch(r"p(\d{4})", r[1]) for r in conn.execute("PRAGMA database_list")]
+    return [('main', None)] + [(m.group(0), m.group(1)) for m in anexadas if m]
+
+def _anexar(conn, fechados, anos):
+    limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(conn, 'getlimit') else 10
+    if len(fechados) > limite:
+        raise sqlite3.OperationalError(f"{len(fechados)} anos fechados: o SQLite anexa no máximo {limite} arquivos; filtre os anos")
+    for a in fechados: conn.execute(f"ATTACH DATABASE ? AS p{a}", (_uri_leitura(arquivo_particao(a)),))
+    for tabela in PARTICIONADAS:
+        cols = ','.join(f"t.{k}" for k in _colunas(conn, tabela))
+        partes = [f"SELECT {cols} FROM {esq}.{tabela} t{_filtro_ano(tabela, anos, ano)}" for esq, ano in _esquemas(conn)]
+        conn.execute(f"CREATE TEMP VIEW {tabela} AS {' UNION ALL '.join(partes)}")
+    for fato in FATOS: conn.execute(_sql_view(fato, temp=True))
+
+def _alinhar_particoes(conn):
+    """Colunas novas do schema também nas partições (congeladas: liberadas só para o ALTER)."""
+    for ano in _anos_fechados(conn):
+        arq = arquivo_particao(ano)
+        if not os.path.exists(arq): continue
+        p = sqlite3.connect(_uri_leitura(arq), uri=True)
+        try: faltam = {t: [r for r in conn.execute(f"PRAGMA table_info({t})") if r[1] not in _colunas(p, t)] for t in PARTICIONADAS}
+        finally: p.close()
+        if not any(faltam.values()): continue
+        os.chmod(arq, 0o644); p = sqlite3.connect(arq)
+        try:
+            for t, cols in faltam.items():
+                for r in cols: p.execute(f"ALTER TABLE {t} ADD COLUMN {r[1]} {r[2]}")
+            p.commit()
+        finally: p.close(); os.chmod(arq, 0o444)
+
+def _apagar_particao(ano):
+    for arq in (arquivo_particao(ano), arquivo_particao(ano) + ".tmp"):
+        try: os.chmod(arq, 0o644); os.remove(arq)
+        except OSError: pass
+
+def _na_main(c, tabela, chaves):
+    chave = PARTICIONADAS[tabela][0]; achadas = set()
+    for i in range(0, len(chaves), 500):
+        parte = chaves[i:i + 500]
+        achadas.update(r[0] for r in c.execute(f"SELECT {chave} FROM main.{tabela} WHERE {chave} IN ({','.join(['?'] * len(parte))})", parte))
+    return achadas
+
+def _reabrir(c, tabela, chaves):
+    """
+    Documentos de ano fechado que vão ser gravados ou alterados: copia os cabeçalhos com itens/vínculos
+    da partição para o principal (que prevalece na leitura), com as edições feitas no app. Assim
+    reimportar é no-op e reextrair atualiza a cópia. Devolve as chaves copiadas.
+    """
+    fechados = _anos_fechados(c)
+    chaves = list(dict.fromkeys(k for k in chaves if k))
+    if not fechados or not chaves: return set()
+    na_main = _na_main(c, tabela, chaves)
+    faltam = [k for k in chaves if k not in na_main]; copiadas = set()
+    for ano in fechados:
+        if not faltam: break
+        try:
+            p = sqlite3.connect(_uri_leitura(arquivo_particao(ano)), uri=True)
+            try:
+                p.execute("CREATE TEMP TABLE _chaves (chave TEXT PRIMARY KEY)")
+                p.executemany("INSERT OR IGNORE INTO _chaves VALUES (?)", [(k,) for k in faltam])
+                linhas = {}
+                for t, (k, cab) in PARTICIONADAS.items():
+                    if cab != tabela: continue
+                    cur = p.execute(f"SELECT t.* FROM temp._chaves x JOIN {t} t ON t.{k} = x.chave")
+                    linhas[t] = ([d[0] for d in cur.description], cur.fetchall())
+            finally: p.close()
+        except sqlite3.Error: continue # Partição ausente (avisada na leitura)
+        cols, valores = linhas[tabela]
+        achadas = {v[cols.index(PARTICIONADAS[tabela][0])] for v in valores}
+        for t, (cols, valores) in linhas.items():
+            if valores: c.executemany(f"INSERT OR IGNORE INTO main.{t} ({','.join(cols)}) VALUES ({','.join(['?'] * len(cols))})", valores)
+        copiadas |= achadas; faltam = [k for k in faltam if k not in achadas]
+    return copiadas
+
+@escrita(lambda e: (False, str(e)), exclusiva=True)
+def fechar_periodo(c, ano):
+    """
+    Fecha um ano anterior ao atual: os fatos dele vão para a partição (compactada com VACUUM e somente
+    leitura) e saem do principal. Fechar de novo junta à partição o que chegou ao principal depois.
+    Em duas fases: a partição nova substitui a antiga por os.replace antes de o principal apagar
+    qualquer linha, e o principal só apaga o que está idêntico nela: uma queda no meio não perde dados.
+    """
+    ano = str(int(ano))
+    if int(ano) >= datetime.now().year: return False, f"{ano} ainda está aberto: só anos anteriores ao atual podem ser fechados."
+    final = arquivo_particao(ano); tmp = final + ".tmp"
+    if os.path.exists(tmp): os.remove(tmp)
+    if os.path.exists(final): shutil.copyfile(final, tmp)
+    # 1) Partição nova = antiga + o ano no principal (a versão do principal substitui a congelada)
+    c.execute("ATTACH DATABASE ? AS particao", (tmp,))
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for t in PARTICIONADAS:
+                sql = c.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (t,)).fetchone()[0]
+                c.execute(re.sub(rf"^CREATE TABLE \"?{t}\"?", f"CREATE TABLE IF NOT EXISTS particao.{t}", sql))
+                tem = _colunas(c, t, 'particao')
+                for r in c.execute(f"PRAGMA main.table_info({t})").fetchall():
+                    if r[1] not in tem: c.execute(f"ALTER TABLE particao.{t} ADD COLUMN {r[1]} {r[2]}")
+            for idx, (t, col) in _INDICES_PART.items(): c.execute(f"CREATE INDEX IF NOT EXISTS particao.{idx} ON {t} ({col})")
+            for t in ('itens_base', 'cte_nf'):
+                c.execute(f"DELETE FROM particao.{t} WHERE {PARTICIONADAS[t][0]} IN ({_chaves_ano(t, ano)})")
+            for t in PARTICIONADAS:
+                cols = ','.join(_colunas(c, t))
+                c.execute(f"INSERT OR REPLACE INTO particao.{t} ({cols}) SELECT {cols} FROM main.{t} WHERE {PARTICIONADAS[t][0]} IN ({_chaves_ano(t, ano)})")
+            c.execute("COMMIT")
+        except:
+            if c.connection.in_transaction: c.execute("ROLLBACK")
+            raise
+        c.execute("VACUUM particao")
+    finally: c.execute("DETACH DATABASE particao")
+    os.chmod(tmp, 0o444)
+    if os.path.exists(final): os.chmod(final, 0o644)
+    os.replace(tmp, final)
+    # 2) Principal: sai o que está idêntico na partição, registra o ano
+    c.execute("ATTACH DATABASE ? AS particao", (final,))
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for t in ('itens_base', 'cte_nf', 'nfe_base', 'cte_header'): # Vínculos antes dos cabeçalhos que os selecionam
+                igual = ' AND '.join(f"p.{k} IS main.{t}.{k}" for k in _colunas(c, t))
+                c.execute(f"DELETE FROM main.{t} WHERE {PARTICIONADAS[t][0]} IN ({_chaves_ano(t, ano)}) AND EXISTS (SELECT 1 FROM particao.{t} p WHERE {igual})")
+            notas = c.execute("SELECT COUNT(*) FROM particao.nfe_base").fetchone()[0]
+            ctes = c.execute("SELECT COUNT(*) FROM particao.cte_header").fetchone()[0]
+            c.execute("INSERT OR REPLACE INTO main.particoes (ano, fechada_em, notas, ctes, bytes) VALUES (?,?,?,?,?)",
+                      (ano, _agora(), notas, ctes, os.path.getsize(final)))
+            _bump_version(c)
+            c.execute("COMMIT")
+        except:
+            if c.connection.in_transaction: c.execute("ROLLBACK")
+            raise
+    finally: c.execute("DETACH DATABASE particao")
+    return True, f"{ano} fechado: {notas:,} NF-e e {ctes:,} CT-e em {final} ({os.path.getsize(final) / 1024 / 1024:,.1f} MB)."
+
+@escrita(lambda e: (False, str(e)))
+def descartar_periodo(c, ano):
+    """Apaga os fatos de um ano (partição e o que houver dele no principal); dimensões e logs ficam."""
+    ano = str(int(ano))
+    for t in ('itens_base', 'cte_nf', 'nfe_base', 'cte_header'):
+        c.execute(f"DELETE FROM main.{t} WHERE {PARTICIONADAS[t][0]} IN ({_chaves_ano(t, ano)})")
+    c.execute("DELETE FROM particoes WHERE ano = ?", (ano,))
+    _apagar_particao(ano)
+    _bump_version(c)
+    return True, f"{ano} descartado."
+
+@medido()
+def load_cte_das_notas(chaves, colunas=None):
+    """
+    CT-e (todas as linhas CT-e x NF-e) que transportam alguma das NF-e: pela chave, no índice do
+    vínculo de cada partição (a data do CT-e não acompanha a da nota, ex.: virada do ano).
+    """
+    conn = conexao_fatos()
+    try:
+        conn.execute("CREATE TEMP TABLE _chaves (chave TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO _chaves VALUES (?)", [(k,) for k in chaves])
+        return _carregar_fato(conn, 'cte', colunas, condicao="t.chave_cte_propria IN (SELECT l.chave_cte_propria FROM temp._chaves k JOIN cte_nf l ON l.chave_nf = k.chave)")
+    finally: conn.close()
+
+@medido()
+def get_particoes():
+    """Anos fechados: ano, fechada_em, notas, ctes, bytes."""
+    conn = get_connection()
+    try: df = pd.read_sql("SELECT * FROM particoes ORDER BY ano", conn)
+    except: df = pd.DataFrame()
+    conn.close()
+    return df
+
+def get_particoes_ausentes():
+    """Anos fechados cujo arquivo de partição não existe (ficam fora da leitura)."""
+    conn = get_connection()
+    try: return [a for a in _anos_fechados(conn) if not os.path.exists(arquivo_particao(a))]
     finally: conn.close()
 
-def update_cte_etapa(chave_cte, etapa):
-    conn = get_connection(); c = conn.cursor()
+@medido()
+def get_anos():
+    """{ano: fechado?} dos anos com NF-e (principal + partições), sem ler os fatos das partições."""
+    conn = get_connection()
     try:
-        c.execute("UPDATE cte SET etapa_manual = ? WHERE chave_cte_propria = ?", (etapa, chave_cte))
-        conn.commit(); return True
-    except: return False
+        abertos = {r[0] for r in conn.execute(f"SELECT DISTINCT {_ano()} FROM nfe_base")}
+        fechados = set(_anos_fechados(conn))
+    except: return {}
     finally: conn.close()
+    return {int(a): a in fechados for a in abertos | fechados if a and a.isdigit()}
 
-def update_ia_memory(cfop, fluxo, tipo, chave):
-    conn = get_connection(); c = conn.cursor()
+def get_pesos_nf(chaves):
+    """{chave_nf: peso_bruto} das NF-e pedidas, no principal e nas partições do ano de emissão (AA da chave)."""
+    chaves = list(dict.fromkeys(chaves))
+    anos = {f"20{k[2:4]}" for k in chaves if len(k) == 44 and k[2:4].isdigit()}
+    conn = conexao_fatos(anos)
     try:
-        if chave: c.execute("UPDATE nfe SET tipo_operacao=? WHERE chave_nf=?", (tipo, chave))
-        c.execute("INSERT OR REPLACE INTO memoria_ia (cfop, fluxo, tipo_definido) VALUES (?, ?, ?)", (cfop, fluxo, tipo))
-        conn.commit(); return True
-    except: return False
+        conn.execute("CREATE TEMP TABLE _chaves (chave TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO _chaves VALUES (?)", [(k,) for k in chaves])
+        partes = [f"SELECT t.chave_nf, t.peso_bruto FROM {esq}.nfe_base t JOIN _chaves k ON k.chave = t.chave_nf{_filtro_ano('nfe_base', None, ano).replace(' WHERE', ' AND', 1) if ano else ''}"
+                  for esq, ano in _esquemas(conn)]
+        return dict(conn.execute(" UNION ALL ".join(partes)).fetchall())
     finally: conn.close()
 
-def get_ia_memory(cfop, fluxo):
+# --- FILA DE JOBS ---
+def _agora(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+@escrita()
+def create_job(c, tipo, arquivos, perfil=None):
+    agora = _agora()
+    c.execute("INSERT INTO jobs (tipo, status, arquivos, perfil, criado_em, atualizado_em) VALUES (?, 'pendente', ?, ?, ?, ?)", (tipo, json.dumps(arquivos), perfil, agora, agora))
+    return c.lastrowid
+
+@escrita(lambda e: None)
+def claim_next_job(c):
+    """Reserva o job pendente mais antigo (atômico entre processos: transação IMMEDIATE do escritor). Retorna dict ou None."""
+    row = c.execute("SELECT id, tipo, arquivos, processados, registros, erros, bytes, inicio, perfil FROM jobs WHERE status='pendente' ORDER BY id LIMIT 1").fetchone()
+    if not row: return None
+    agora = _agora()
+    c.execute("UPDATE jobs SET status='processando', inicio=COALESCE(inicio, ?), atualizado_em=? WHERE id=?", (agora, agora, row[0]))
+    return {'id': row[0], 'tipo': row[1], 'arquivos': json.loads(row[2]), 'processados': row[3],
+            'registros': row[4], 'erros': row[5], 'bytes': row[6], 'inicio': row[7] or agora, 'perfil': row[8]}
+
+@escrita()
+def update_job_progress(c, job_id, processados, registros, erros, n_bytes, total=None):
+    c.execute("UPDATE jobs SET processados=?, registros=?, erros=?, bytes=?, total=COALESCE(?, total), atualizado_em=? WHERE id=?", (processados, registros, erros, n_bytes, total, _agora(), job_id))
+
+@escrita()
+def finish_job(c, job_id, status, mensagem=""):
+    agora = _agora()
+    c.execute("UPDATE jobs SET status=?, mensagem=?, fim=?, atualizado_em=? WHERE id=?", (status, mensagem, agora, agora, job_id))
+
+@escrita()
+def falhar_job(c, job_id, mensagem, max_tentativas=1):
+    """Falha do job: volta à fila (retomando de 'processados') até max_tentativas, depois 'erro'. Retorna o status."""
+    row = c.execute("SELECT COALESCE(tentativas, 0) FROM jobs WHERE id=?", (job_id,)).fetchone()
+    tentativas = (row[0] if row else 0) + 1
+    status = 'pendente' if tentativas < max_tentativas else 'erro'
+    agora = _agora()
+    c.execute("UPDATE jobs SET status=?, tentativas=?, mensagem=?, fim=?, atualizado_em=? WHERE id=?",
+              (status, tentativas, mensagem, agora if status == 'erro' else None, agora, job_id))
+    return status
+
+@escrita()
+def reset_stale_jobs(c, minutos=10):
+    """Devolve à fila jobs 'processando' sem progresso recente (worker morto/reiniciado)."""
+    limite = (datetime.now() - timedelta(minutes=minutos)).strftime("%Y-%m-%d %H:%M:%S")
+    c.execute("UPDATE jobs SET status='pendente' WHERE status='processando' AND atualizado_em < ?", (limite,))
+
+def get_arquivos_jobs_ativos():
+    """Arquivos de spool dos jobs 'pendente'/'processando' (não podem ser apagados)."""
     conn = get_connection()
-    try:
-        res = conn.execute("SELECT tipo_definido FROM memoria_ia WHERE cfop=? AND fluxo=?", (cfop, fluxo)).fetchone()
-        return res[0] if res else None
-    except: return None
+    try: return [a for (arqs,) in conn.execute("SELECT arquivos FROM jobs WHERE status IN ('pendente', 'processando')") for a in json.loads(arqs or '[]')]
     finally: conn.close()
 
-def get_all_logs():
+@medido()
+def get_jobs(limite=20):
     conn = get_connection()
-    try: df = pd.read_sql("SELECT * FROM logs ORDER BY id DESC", conn)
+    try: df = pd.read_sql("SELECT id, tipo, status, total, processados, registros, erros, bytes, mensagem, criado_em, inicio, fim, atualizado_em FROM jobs ORDER BY id DESC LIMIT ?", conn, params=(limite,))
     except: df = pd.DataFrame()
     conn.close()
     return df
 
-def load_data(table):
+# --- MÉTRICAS DE INGESTÃO ---
+@escrita()
+def insert_ingest_run(c, origem, inicio, duracao, docs, registros, erros, n_bytes, etapas, perfil=None):
+    """inicio: timestamp (time.time()); etapas: dict de metrics.resumo()."""
+    ini = datetime.fromtimestamp(inicio).strftime("%Y-%m-%d %H:%M:%S")
+    c.execute("INSERT INTO ingest_runs (origem, inicio, duracao, docs, registros, erros, bytes, etapas, perfil) VALUES (?,?,?,?,?,?,?,?,?)",
+              (origem, ini, duracao, docs, registros, erros, n_bytes, json.dumps(etapas), perfil))
+
+@medido()
+def get_ingest_runs(limite=50):
     conn = get_connection()
-    try: df = pd.read_sql(f"SELECT * FROM {table}", conn)
+    try: df = pd.read_sql("SELECT * FROM ingest_runs ORDER BY id DESC LIMIT ?", conn, params=(limite,))
     except: df = pd.DataFrame()
     conn.close()
-    return df
\ No newline at end of file
+    return df
+
+# --- DISTÂNCIAS ---
+@escrita()
+def atualizar_distancias(c, recalcular=False):
+    """
+    Refaz o cache 'distancias' para os pares de cidades de todas as NF-e/CT-e, do principal e das
+    partições (lidas sem reabrir: a distância do fato vem do cache na leitura). Retorna o nº de pares.
+    """
+    if recalcular:
+        c.execute("DELETE FROM distancias"); c.execute("UPDATE cidades SET precisao = NULL")
+        for f in (rotas.carregar_matriz, rotas.carregar_municipios, rotas.distancia): f.cache_clear()
+    # Cidades sem coordenada do município: tenta de novo (tabela de municípios ampliada)
+    # e refaz as distâncias que foram estimadas sem ela
+    c.execute("UPDATE cidades SET precisao = NULL WHERE precisao != 'municipio'")
+    c.execute("DELETE FROM distancias WHERE fonte IN ('estimada_uf', 'sem_coordenada')")
+    _completar_cidades(c)
+    sql = "SELECT cidade_origem_id, cidade_destino_id FROM nfe_base UNION SELECT cidade_origem_id, cidade_destino_id FROM cte_header"
+    pares = set(c.execute(sql).fetchall())
+    for ano in _anos_fechados(c):
+        arq = arquivo_particao(ano)
+        if not os.path.exists(arq): continue
+        p = sqlite3.connect(_uri_leitura(arq), uri=True)
+        try: pares.update(p.execute(sql).fetchall())
+        finally: p.close()
+    _distancias(c, pares)
+    _bump_version(c)
+    return len({p for p in pares if None not in p})
+
+def get_distancias():
+    """Cache de distâncias por rótulo das cidades: cidade_origem, cidade_destino, km, fonte."""
+    conn = get_connection()
+    try:
+        return pd.read_sql('''SELECT o.rotulo AS cidade_origem, d.rotulo AS cidade_destino, x.km, x.fonte FROM distancias x
+                              JOIN cidades o ON o.id = x.origem_id JOIN cidades d ON d.id = x.destino_id''', conn)
+    except: return pd.DataFrame(columns=['cidade_origem', 'cidade_destino', 'km', 'fonte'])
+    finally: conn.close()
+
+# --- BACKFILL ---
+def get_chaves_incompletas(tabela, chave, campos):
+    """
+    Chaves com algum dos campos nulos (linhas gravadas antes do parser extraí-los), menos as já
+    registradas em backfill_pendencias. campos=None em 'itens': NF-e com qtd_itens > 0 sem itens.
+    """
+    if tabela == 'itens':
+        sql = "SELECT chave_nf FROM nfe n WHERE qtd_itens > 0 AND NOT EXISTS (SELECT 1 FROM itens i WHERE i.chave_nf = n.chave_nf)"
+        chave = 'chave_nf'
+    else:
+        sql = f"SELECT DISTINCT {chave} FROM {tabela} WHERE ({' OR '.join(f'{c} IS NULL' for c in campos)})"
+    sql += f" AND {chave} NOT IN (SELECT chave FROM backfill_pendencias WHERE tabela = ?)"
+    conn = conexao_fatos()
+    try: return [r[0] for r in conn.execute(sql, (tabela,)) if r[0]]
+    finally: conn.close()
+
+def get_arquivos_origem(tabela, chave, chaves):
+    """{chave: arquivo} gravado na ingestão (nome do XML solto ou membro do ZIP)."""
+    if tabela == 'itens': tabela = 'nfe'
+    conn = conexao_fatos()
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _chaves (chave TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO _chaves VALUES (?)", [(k,) for k in chaves])
+        return {k: a for k, a in conn.execute(f"SELECT t.{chave}, t.arquivo FROM {tabela} t JOIN _chaves k ON k.chave = t.{chave}") if a}
+    finally: conn.close()
+
+@escrita()
+def registrar_pendencias(c, tabela, lista):
+    """lista: [(chave, motivo)]"""
+    if not lista: return
+    agora = _agora()
+    c.executemany("INSERT OR REPLACE INTO backfill_pendencias (tabela, chave, motivo, tentado_em) VALUES (?,?,?,?)", [(tabela, k, m, agora) for k, m in lista])
+
+@escrita()
+def limpar_pendencias(c, tabela): c.execute("DELETE FROM backfill_pendencias WHERE tabela = ?", (tabela,))
+
+# --- ARQUIVOS PROCESSADOS (WATCHER) ---
+def get_arquivos_processados():
+    conn = get_connection()
+    try: return {r[0]: (r[1], r[2]) for r in conn.execute("SELECT caminho, mtime, hash FROM arquivos_processados")}
+    except: return {}
+    finally: conn.close()
+
+@escrita()
+def mark_arquivos_processados(cur, lista):
+    """lista: [(caminho, mtime, hash)]"""
+    if not lista: return
+    agora = _agora()
+    cur.executemany("INSERT OR REPLACE INTO arquivos_processados (caminho, mtime, hash, processado_em) VALUES (?,?,?,?)", [(c, m, h, agora) for c, m, h in lista])
+
@@ -0,0 +1,125 @@
+# escritor.py
+# Escritor único do banco: as escritas do processo (sessões do app, worker, importador) entram numa
+# fila atendida por uma thread com conexão própria. O que estiver na fila sai num único commit
+# (group commit), cada escrita isolada por SAVEPOINT: a falha de uma não desfaz as outras.
+# Quem envia recebe um concurrent.futures.Future. Leitores usam conexões próprias e, com WAL, não
+# esperam a escrita. Entre processos (importador x app) continua valendo o timeout do SQLite.
+# Tarefas marcadas 'exclusiva' (ATTACH, VACUUM: proibidos dentro de transação) rodam sozinhas,
+# depois das anteriores gravadas, com a conexão em autocommit: elas mesmas abrem as transações.
+import atexit
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from config import ESCRITOR_GRUPO
+
+_fila = queue.Queue()
+_lock = threading.Lock()
+_estado = {'thread': None, 'cursor': None}
+
+def enviar(caminho, tarefa, *args):
+    """Enfileira tarefa(cursor, *args) para o banco 'caminho'. O Future recebe o retorno (ou a exceção)."""
+    f = Future()
+    if threading.current_thread() is _estado['thread']: # Escrita dentro de outra: mesma transação
+        try: f.set_result(tarefa(_estado['cursor'], *args))
+        except Exception as e: f.set_exception(e)
+        return f
+    _iniciar()
+    _fila.put((caminho, tarefa, args, f))
+    return f
+
+def _iniciar():
+    with _lock:
+        if _estado['thread'] is None or not _estado['thread'].is_alive():
+            _estado['thread'] = threading.Thread(target=_loop, name="escritor-db", daemon=True)
+            _estado['thread'].start()
+
+def parar(timeout=30):
+    """Grava o que está na fila e encerra a thread (chamado na saída do processo)."""
+    t = _estado['thread']
+    if t is None or not t.is_alive(): return
+    _fila.put(None); t.join(timeout)
+
+atexit.register(parar)
+
+def _loop():
+    conn, atual = None, None
+    while True:
+        grupo = [_fila.get()]
+        while len(grupo) < ESCRITOR_GRUPO:
+            try: grupo.append(_fila.get_nowait())
+            except queue.Empty: break
+        fim = None in grupo
+        grupo = [g for g in grupo if g is not None]
+        feitas = []
+        try:
+            # Uma transação por banco (DB_FILE pode mudar entre chamadas), na ordem de chegada
+            for caminho in dict.fromkeys(g[0] for g in grupo):
+                tarefas = [g[1:] for g in grupo if g[0] == caminho]
+                try:
+                    if caminho != atual:
+                        if conn: conn.close()
+                        conn, atual = None, None
+                        conn = sqlite3.connect(caminho, timeout=30, isolation_level=None); atual = caminho
+                except Exception as e:
+                    for _, _, f in tarefas: f.set_exception(e)
+                    continue
+                lote = []
+                for t in tarefas + [None]:
+                    if t is not None and not getattr(t[0], 'exclusiva', False): lote.append(t); continue
+                    if lote: feitas += _gravar(conn, lote); lote = []
+                    if t is not None: feitas += _exclusiva(conn, *t)
+            if _fila.empty() and conn: # Ociosa: fecha antes de avisar (WAL no banco, arquivo livre para mover/apagar)
+                conn.close(); conn, atual = None, None
+            for f, r in feitas: f.set_result(r)
+        except BaseException as e: # Falha fora das tarefas (close, BaseException): ninguém fica esperando o Future
+            try:
+                if conn: conn.close() # Transação aberta é descartada
+            except Exception: pass
+            conn, atual = None, None
+            if not isinstance(e, Exception): # Encerra a thread: solta o posto antes de avisar, o próximo enviar() inicia outra
+                with _lock: _estado['thread'] = None
+            _falhar_grupo(grupo, feitas, e)
+            if not isinstance(e, Exception): raise
+        if fim: break
+    if conn: conn.close()
+
+def _falhar_grupo(grupo, feitas, e):
+    """Avisa o grupo após uma falha do laço: as já gravadas recebem o retorno, as demais a exceção."""
+    for f, r in feitas:
+        if not f.done(): f.set_result(r)
+    for _, _, _, f in grupo:
+        if not f.done(): f.set_exception(e)
+
+def _exclusiva(conn, tarefa, args, f):
+    """Tarefa fora do group commit: recebe o cursor em autocommit e controla as próprias transações."""
+    if not f.set_running_or_notify_cancel(): return []
+    c = conn.cursor(); _estado['cursor'] = c
+    try: return [(f, tarefa(c, *args))]
+    except Exception as e:
+        if conn.in_transaction: conn.rollback()
+        f.set_exception(e); return []
+    finally: _estado['cursor'] = None
+
+def _gravar(conn, tarefas):
+    """Grava as tarefas numa transação; devolve [(future, retorno)] das que deram certo (avisadas depois)."""
+    c = conn.cursor(); _estado['cursor'] = c
+    feitas = []
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        for tarefa, args, f in tarefas:
+            if not f.set_running_or_notify_cancel(): continue
+            c.execute("SAVEPOINT escrita")
+            try: r = tarefa(c, *args)
+            except Exception as e:
+                c.execute("ROLLBACK TO escrita"); c.execute("RELEASE escrita")
+                f.set_exception(e); continue
+            c.execute("RELEASE escrita"); feitas.append((f, r))
+        c.execute("COMMIT")
+    except Exception as e: # BEGIN/COMMIT falhou (ex.: outro processo segurou o banco além do timeout)
+        if conn.in_transaction: conn.rollback()
+        for _, _, f in tarefas:
+            if not f.done(): f.set_exception(e)
+        return []
+    finally: _estado['cursor'] = None
+    return feitas
@@ -0,0 +1,176 @@
+# exportar.py
+# Exportação em CSV, Parquet ou XLSX gravada em blocos num arquivo temporário: memória constante
+# mesmo com milhões de linhas. Tabelas do banco (itens, logs) vêm direto do cursor SQL
+# (read_sql com chunksize); frames derivados (dashboard filtrado, CT-e agregados) em fatias.
+# O XLSX é escrito em streaming (XML da planilha direto no zip, strings inline), sem openpyxl.
+# Uso: python -m exportar --fonte itens --formato parquet --saida itens.parquet
+import argparse
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import numpy as np
+import pandas as pd
+import database as db
+from config import EXPORT_DIR, EXPORT_LOTE, EXPORT_RETENCAO_HORAS
+
+FORMATOS = {'csv': "text/csv", 'parquet': "application/vnd.apache.parquet",
+            'xlsx': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+# Consultas das fontes que saem direto do banco
+SQL_FONTES = {'itens': "SELECT * FROM itens", 'logs': "SELECT * FROM logs ORDER BY id DESC"}
+FONTES = ['dashboard', 'cte', 'itens', 'logs']
+XLSX_LINHAS = 1048575 # Linhas de dados por aba (limite do Excel menos o cabeçalho)
+
+def blocos_sql(sql, params=(), tamanho=EXPORT_LOTE):
+    """DataFrames de até 'tamanho' linhas lidos do cursor (tipos anuláveis: iguais em todos os blocos)."""
+    conn = db.conexao_fatos() # Fatos: inclui os anos fechados
+    try:
+        for bloco in pd.read_sql(sql, conn, params=params, chunksize=tamanho, dtype_backend='numpy_nullable'): yield bloco
+    finally: conn.close()
+
+def blocos_frame(df, tamanho=EXPORT_LOTE):
+    """Fatias de um DataFrame já em memória."""
+    for i in range(0, len(df), tamanho): yield df.iloc[i:i + tamanho]
+
+def blocos_fonte(fonte, tamanho=EXPORT_LOTE):
+    """Blocos de uma fonte pelo nome (CLI); 'dashboard' sai sem os filtros da tela."""
+    import services
+    if fonte in SQL_FONTES: return blocos_sql(SQL_FONTES[fonte], tamanho=tamanho)
+    if fonte == 'cte': return blocos_frame(services.get_cte_aggregated(), tamanho)
+    if fonte == 'dashboard': return blocos_frame(services.get_dashboard_data(), tamanho)
+    raise ValueError(f"Fonte desconhecida: {fonte}")
+
+def exportar(blocos, formato, caminho=None, prefixo="exportacao"):
+    """Grava os blocos no formato pedido; devolve o caminho (novo arquivo em EXPORT_DIR se não informado)."""
+    if formato not in FORMATOS: raise ValueError(f"Formato desconhecido: {formato}")
+    novo = caminho is None # Só o arquivo criado aqui sai na falha; o --saida existente do usuário fica
+    if novo:
+        limpar()
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, caminho = tempfile.mkstemp(prefix=f"{prefixo}-", suffix=f".{formato}", dir=EXPORT_DIR); os.close(fd)
+    tmp = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        {'csv': _csv, 'parquet': _parquet, 'xlsx': _xlsx}[formato](blocos, tmp)
+        shutil.move(tmp, caminho)
+    except BaseException:
+        for a in (tmp, caminho) if novo else (tmp,):
+            try: os.remove(a)
+            except OSError: pass
+        raise
+    return caminho
+
+def limpar(horas=EXPORT_RETENCAO_HORAS):
+    """Apaga de EXPORT_DIR os arquivos com mais de 'horas' (sessões encerradas não apagam os seus)."""
+    limite = time.time() - horas * 3600
+    try: nomes = os.listdir(EXPORT_DIR)
+    except OSError: return
+    for n in nomes:
+        a = os.path.join(EXPORT_DIR, n)
+        try:
+            if os.path.getmtime(a) < limite: os.remove(a)
+        except OSError: pass
+
+def _csv(blocos, arq):
+    with open(arq, 'w', encoding='utf-8', newline='') as f:
+        primeiro = True
+        for bloco in blocos:
+            bloco.to_csv(f, index=False, header=primeiro); primeiro = False
+
+def _parquet(blocos, arq):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    escritor, esquema = None, None
+    try:
+        for bloco in blocos:
+            t = pa.Table.from_pandas(bloco, preserve_index=False).replace_schema_metadata(None)
+            if escritor is None:
+                # Coluna toda nula no 1º bloco: texto (o tipo do arquivo é fixado pelo 1º bloco)
+                esquema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in t.schema])
+                escritor = pq.ParquetWriter(arq, esquema)
+            escritor.write_table(t.cast(esquema))
+        if escritor is None: pq.write_table(pa.table({}), arq)
+    finally:
+        if escritor is not None: escritor.close()
+
+# --- XLSX em streaming ---
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+_NS_R = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_INVALIDOS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]') # Não representáveis em XML
+
+def _escapar(s):
+    return (s.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False)
+             .str.replace('>', '&gt;', regex=False).str.replace(_INVALIDOS, '', regex=True))
+
+def _celulas(s):
+    """XML das células de uma coluna (vetorizado); nulo vira célula vazia."""
+    vazio = np.array(s.isna(), dtype=bool)
+    if pd.api.types.is_bool_dtype(s):
+        xml = np.where(s.fillna(False).astype(bool), '<c t="b"><v>1</v></c>', '<c t="b"><v>0</v></c>').astype(object)
+    elif pd.api.types.is_numeric_dtype(s):
+        v = s.astype('float64').to_numpy(na_value=np.nan)
+        vazio |= ~np.isfinite(v)
+        xml = ('<c><v>' + s.astype(str) + '</v></c>').to_numpy(object)
+    else:
+        txt = s.dt.strftime('%Y-%m-%d %H:%M:%S') if pd.api.types.is_datetime64_any_dtype(s) else s.astype(str)
+        xml = ('<c t="inlineStr"><is><t xml:space="preserve">' + _escapar(txt) + '</t></is></c>').to_numpy(object)
+    xml[vazio] = '<c/>'
+    return xml
+
+def _linhas(bloco):
+    linhas = np.full(len(bloco), '<row>', dtype=object)
+    for col in bloco.columns: linhas = linhas + _celulas(bloco[col].reset_index(drop=True))
+    return ''.join(linhas + '</row>')
+
+def _xlsx(blocos, arq):
+    abas = []
+    with zipfile.ZipFile(arq, 'w', zipfile.ZIP_DEFLATED) as z:
+        f, usadas, cabecalho = None, 0, b''
+        def abrir():
+            abas.append(f"Dados{len(abas) + 1}" if abas else "Dados")
+            g = z.open(f"xl/worksheets/sheet{len(abas)}.xml", 'w', force_zip64=True)
+            g.write(f'{_XML}<worksheet {_NS}><sheetData>'.encode('utf-8') + cabecalho)
+            return g
+        try:
+            for bloco in blocos:
+                if not cabecalho: cabecalho = _linhas(pd.DataFrame([[str(c) for c in bloco.columns]])).encode('utf-8')
+                i = 0
+                while i < len(bloco):
+                    if f is None or usadas == XLSX_LINHAS: # Aba cheia: continua na próxima
+                        if f is not None: f.write(b'</sheetData></worksheet>'); f.close()
+                        f, usadas = abrir(), 0
+                    parte = bloco.iloc[i:i + XLSX_LINHAS - usadas]
+                    f.write(_linhas(parte).encode('utf-8')); usadas += len(parte); i += len(parte)
+            if f is None: f = abrir()
+            f.write(b'</sheetData></worksheet>')
+        finally:
+            if f is not None: f.close() # O zip só fecha sem aba aberta (também no erro)
+        folhas = ''.join(f'<sheet name="{n}" sheetId="{i}" r:id="rId{i}"/>' for i, n in enumerate(abas, 1))
+        z.writestr("xl/workbook.xml", f'{_XML}<workbook {_NS} {_NS_R}><sheets>{folhas}</sheets></workbook>')
+        rels = ''.join(f'<Relationship Id="rId{i}" Type="{_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>' for i in range(1, len(abas) + 1))
+        z.writestr("xl/_rels/workbook.xml.rels", f'{_XML}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{rels}</Relationships>')
+        z.writestr("_rels/.rels", f'{_XML}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                                  f'<Relationship Id="rId1" Type="{_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        planilhas = ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                            for i in range(1, len(abas) + 1))
+        z.writestr("[Content_Types].xml", f'{_XML}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                   f'{planilhas}</Types>')
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m exportar", description="Exporta uma fonte do banco em blocos.")
+    ap.add_argument("--fonte", choices=FONTES, required=True)
+    ap.add_argument("--formato", choices=list(FORMATOS), default='csv')
+    ap.add_argument("--saida", help="Arquivo de saída (padrão: <fonte>.<formato>)")
+    ap.add_argument("--lote", type=int, default=EXPORT_LOTE, help="Linhas por bloco")
+    args = ap.parse_args(argv)
+    arq = exportar(blocos_fonte(args.fonte, args.lote), args.formato, args.saida or f"{args.fonte}.{args.formato}")
+    print(f"{args.fonte} -> {arq} ({os.path.getsize(arq) / 1024 / 1024:,.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# filters.py
+import hashlib
+import numpy as np
+import pandas as pd
+from metrics import medido
+
+# Colunas da sidebar codificadas como inteiros (opções pré-calculadas por versão dos dados)
+FILTER_COLS = ['Ano', 'Mes', 'Dia', 'Transportadora_Final', 'Frete_Tipo', 'Operacao', 'UF_Dest',
+               'cidade_origem', 'cidade_destino', 'Label_Emitente', 'Label_Destinatario']
+
+# Colunas de texto livre que podem ter nulos: a sidebar sempre as tratou como str
+COLS_STR = ['cidade_origem', 'cidade_destino']
+
+@medido()
+def build_filter_index(df, cols=FILTER_COLS):
+    """
+    Codifica cada coluna de filtro como (códigos int32, categorias ordenadas).
+    Nulos recebem código -1 e não aparecem nas opções.
+    """
+    idx = {}
+    for c in cols:
+        if c not in df.columns: continue
+        s = df[c].astype(str) if c in COLS_STR else df[c]
+        codes, cats = pd.factorize(s, sort=True)
+        idx[c] = (codes.astype(np.int32), cats)
+    return idx
+
+def get_options(idx, col, mask=None, reverse=False):
+    """Lista ordenada de valores distintos da coluna (restrita às linhas do mask, se houver)."""
+    codes, cats = idx[col]
+    if mask is None: opts = list(cats)
+    else:
+        sel = codes[mask]
+        cnt = np.bincount(sel[sel >= 0], minlength=len(cats))
+        opts = list(cats[cnt > 0])
+    if reverse: opts.reverse()
+    return opts
+
+@medido()
+def build_mask(idx, selecoes, n):
+    """
+    Combina todas as seleções ativas em um único mask booleano NumPy.
+    Cada coluna vira uma tabela de lookup (categoria -> selecionada) indexada pelos códigos.
+    """
+    mask = np.ones(n, dtype=bool)
+    for col, sel in selecoes.items():
+        if not sel: continue
+        codes, cats = idx[col]
+        lut = np.zeros(len(cats) + 1, dtype=bool) # Último slot: código -1 (nulo), nunca selecionado
+        pos = cats.get_indexer(list(sel))
+        lut[pos[pos >= 0]] = True
+        mask &= lut[codes]
+    return mask
+
+def filter_hash(filtros):
+    """Hash estável das seleções ativas (chave dos caches de figuras)."""
+    ativos = sorted((c, sorted(str(x) for x in v)) for c, v in filtros.items() if v)
+    return hashlib.md5(repr(ativos).encode('utf-8')).hexdigest()
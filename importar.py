@@ -0,0 +1,102 @@
+# importar.py
+# Importação em massa de XML de CT-e/NF-e pela linha de comando (backfill).
+# Uso: python -m importar /dados/2020 /dados/2021.zip "/dados/**/*.xml" --workers 8 --batch-size 2000 --type auto
+import argparse
+import glob
+import os
+import sys
+import time
+import zipfile
+import database as db
+import ingest
+import metrics
+
+EXTENSOES = (".xml", ".zip")
+
+def expandir(entradas):
+    """Diretórios (recursivo), ZIPs, XMLs e padrões glob -> lista ordenada de arquivos."""
+    arquivos = set()
+    for e in entradas:
+        if any(ch in e for ch in "*?["): candidatos = glob.glob(e, recursive=True)
+        elif os.path.isdir(e): candidatos = [os.path.join(r, a) for r, _, fs in os.walk(e) for a in fs]
+        else: candidatos = [e]
+        arquivos.update(os.path.abspath(c) for c in candidatos if c.lower().endswith(EXTENSOES) and os.path.isfile(c))
+    return sorted(arquivos)
+
+def montar_tarefas(arquivos, tamanho):
+    """Quebra XMLs soltos e membros de ZIP em tarefas de até 'tamanho' documentos."""
+    tarefas = []; atual = []
+    def add(item):
+        atual.append(item)
+        if len(atual) >= tamanho: tarefas.append(list(atual)); atual.clear()
+    for a in arquivos:
+        if a.lower().endswith(".xml"): add((a, None))
+        else:
+            try:
+                with zipfile.ZipFile(a) as zf:
+                    for n in zf.namelist():
+                        if n.endswith(".xml"): add((a, n))
+            except zipfile.BadZipFile: print(f"ZIP inválido ignorado: {a}")
+    if atual: tarefas.append(atual)
+    return tarefas
+
+def relatorio(tot, etapas, wall):
+    mb = tot['bytes'] / 1e6
+    print("\n=== Importação concluída ===")
+    print(f"Documentos: {tot['docs']:,} | Registros: {tot['registros']:,} | Itens: {tot['itens']:,} | Erros: {tot['erros']:,} | {mb:,.1f} MB")
+    print(f"Tempo total: {wall:,.1f}s")
+    print(f"Vazão: {tot['docs']/wall:,.0f} docs/s | {tot['registros']/wall:,.0f} registros/s | {mb/wall:,.2f} MB/s")
+    if tot['lotes_falhos']: print(f"ATENÇÃO: {tot['lotes_falhos']:,} lote(s) com {tot['docs_falhos']:,} XML NÃO gravados (fora dos totais acima); rode de novo para importá-los")
+    print("\nEtapa                   n   Tempo (s)   % soma   p50 (ms)   p95 (ms)")
+    soma = sum(e['total_s'] for e in etapas.values()) or 1
+    for nome, e in sorted(etapas.items(), key=lambda x: -x[1]['total_s']):
+        print(f"{nome:<16}{e['n']:>9,}{e['total_s']:>12.2f}   {e['total_s']/soma*100:>5.1f}%{e['p50_ms']:>11.3f}{e['p95_ms']:>11.3f}")
+    print("(etapas de parse somam o tempo de todos os workers; gravação é o tempo no processo principal)")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m importar", description="Importa XML de CT-e/NF-e em massa para o banco.")
+    ap.add_argument("entradas", nargs="+", help="Diretórios, arquivos .zip/.xml ou padrões glob")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de parse (1 = sem pool)")
+    ap.add_argument("--batch-size", type=int, default=1000, help="Documentos por tarefa/commit")
+    ap.add_argument("--type", dest="tipo", choices=["cte", "nfe", "auto"], default="auto")
+    ap.add_argument("--sem-acervo", dest="arquivar", action="store_false", help="Não guarda os XML originais no acervo")
+    ap.add_argument("--perfil", choices=["cprofile", "pyinstrument"], help="Grava perfil do processo principal em perfis/ (use --workers 1 para incluir o parse)")
+    args = ap.parse_args(argv)
+
+    inicio = time.perf_counter()
+    db.init_db()
+    with metrics.coletar() as col, metrics.perfil(args.perfil, "importar") as prof:
+        tot = executar(args, col, inicio)
+    if tot is None: return 0
+    ingest.registrar_execucao("importar", col, tot['docs'], tot['registros'], tot['erros'], tot['bytes'], prof['arquivo'])
+    relatorio(tot, metrics.resumo(col), time.perf_counter() - inicio)
+    if prof['arquivo']: print(f"Perfil gravado em {prof['arquivo']}")
+    return tot['lotes_falhos']
+
+def executar(args, col, inicio):
+    with metrics.etapa('listagem'):
+        arquivos = expandir(args.entradas)
+        tarefas = montar_tarefas(arquivos, args.batch_size)
+    n_docs = sum(len(t) for t in tarefas)
+    print(f"{len(arquivos)} arquivo(s), {n_docs:,} XML em {len(tarefas)} tarefa(s), {args.workers} worker(s)")
+    if not tarefas: return None
+
+    tot = {'docs': 0, 'bytes': 0, 'registros': 0, 'itens': 0, 'erros': 0, 'lotes_falhos': 0, 'docs_falhos': 0}
+
+    def consumir(lote):
+        ok, msg = ingest.gravar_lote(lote)
+        if lote['metricas']: metrics.juntar(col, lote['metricas']) # Etapas medidas no worker
+        if not ok: # Lote perdido: fora da vazão, conta só nas falhas
+            print(f"\nERRO ao gravar lote de {lote['docs']:,} XML: {msg}")
+            tot['lotes_falhos'] += 1; tot['docs_falhos'] += lote['docs']
+        else:
+            tot['docs'] += lote['docs']; tot['bytes'] += lote['bytes']; tot['itens'] += len(lote['itens'])
+            tot['registros'] += ingest.registros(lote); tot['erros'] += len(lote['logs'])
+        el = time.perf_counter() - inicio
+        print(f"\r{tot['docs'] + tot['docs_falhos']:,}/{n_docs:,} XML ({tot['docs']/el:,.0f} docs/s gravados)", end="", flush=True)
+
+    ingest.em_paralelo(ingest.parse_tarefa, tarefas, args.workers, consumir, args.tipo, args.arquivar)
+    return tot
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0) # Código 1 se algum lote não foi gravado
@@ -0,0 +1,228 @@
+# ingest.py
+# Núcleo da ingestão: leitura de XML/ZIP, parse e gravação em lotes.
+# Usado pelo worker em segundo plano (worker.py), pelo watcher de pasta (watcher.py)
+# e pelo importador em massa (importar.py).
+import os
+import shutil
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import acervo
+import database as db
+import metrics
+import parsers
+from config import ACERVO_ATIVO, SPOOL_DIR, SPOOL_RETENCAO_HORAS, WORKER_LOTE
+from metrics import etapa
+
+TIPO_DOC = {'cte': 'CT-e', 'nfe': 'NF-e', 'evento': 'Evento'}
+CHAVE_DOC = {'cte': 'chave_cte_propria', 'nfe': 'chave_nf', 'evento': 'chave'} # Chave de acesso no acervo
+
+def iter_xml(caminho):
+    """Gera (nome, bytes) para cada XML de um arquivo .xml ou .zip em disco."""
+    nome = os.path.basename(caminho)
+    if nome.lower().endswith(".xml"):
+        with etapa('leitura'):
+            with open(caminho, 'rb') as f: c = f.read()
+        yield nome, c
+    elif nome.lower().endswith(".zip"):
+        try:
+            with zipfile.ZipFile(caminho) as zf:
+                for n in zf.namelist():
+                    if not n.endswith(".xml"): continue
+                    with etapa('leitura'): c = zf.read(n)
+                    yield n, c
+        except zipfile.BadZipFile: return
+
+def contar_xml(caminho):
+    nome = caminho.lower()
+    if nome.endswith(".xml"): return 1
+    if nome.endswith(".zip"):
+        try:
+            with zipfile.ZipFile(caminho) as zf: return sum(1 for n in zf.namelist() if n.endswith(".xml"))
+        except zipfile.BadZipFile: return 0
+    return 0
+
+def parse_documento(tipo, fn, c):
+    """
+    Retorna (tipo_doc, linhas, itens, log). 'log' é None quando o documento é válido.
+    tipo='auto' identifica CT-e/NF-e/evento pelo elemento raiz (parsers.detect_doc_type).
+    """
+    if tipo == "auto":
+        with etapa('deteccao'): tipo = parsers.detect_doc_type(c)
+        if tipo is None: return None, [], [], {'arquivo': fn, 'tipo': 'Desconhecido', 'msg': "Tipo de documento não identificado"}
+    if tipo == "cte":
+        rows, err = parsers.parse_cte(c, fn)
+        if err: return tipo, [], [], {'arquivo': fn, 'tipo': 'CT-e', 'msg': err}
+        return tipo, rows, [], None
+    if tipo == "evento":
+        ev, err = parsers.parse_evento(c, fn)
+        if err: return tipo, [], [], {'arquivo': fn, 'tipo': 'Evento', 'msg': err}
+        return tipo, [ev], [], None
+    h, it, err = parsers.parse_nfe(c, fn)
+    if err: return tipo, [], [], {'arquivo': fn, 'tipo': 'NF-e', 'msg': err}
+    return tipo, [h], it, None
+
+# --- LOTE: resultados acumulados por tipo de documento ---
+# 'metricas': coletor (metrics.py) das etapas medidas no processo que fez o parse
+# 'acervo': XML originais já comprimidos (acervo.preparar), gravados junto com o lote
+LISTAS = ('cte', 'nfe', 'evento', 'itens', 'logs', 'acervo')
+
+def novo_lote():
+    return {'cte': [], 'nfe': [], 'evento': [], 'itens': [], 'logs': [], 'acervo': [], 'docs': 0, 'bytes': 0, 'metricas': None}
+
+def acumular(lote, tipo, fn, c, arquivar=ACERVO_ATIVO):
+    tipo_doc, rows, its, log = parse_documento(tipo, fn, c)
+    if log: lote['logs'].append(log)
+    else:
+        # Textos das dimensões (db.COLUNAS_DIM) compartilhados entre linhas: menos memória e pickle menor
+        for d in rows + its:
+            for k in db.COLUNAS_DIM.intersection(d):
+                if isinstance(d[k], str): d[k] = sys.intern(d[k])
+        lote[tipo_doc].extend(rows); lote['itens'].extend(its)
+    lote['docs'] += 1; lote['bytes'] += len(c)
+    if arquivar: # Documentos inválidos também: um parser corrigido pode reextraí-los depois
+        chave = rows[0].get(CHAVE_DOC[tipo_doc]) if rows else None
+        with etapa('acervo'): lote['acervo'].append(acervo.preparar(c, tipo_doc, fn, chave))
+
+def juntar(lote, outro):
+    for k in LISTAS: lote[k].extend(outro[k])
+    for k in ('docs', 'bytes'): lote[k] += outro[k]
+    if outro['metricas']:
+        if lote['metricas'] is None: lote['metricas'] = metrics.novo_coletor()
+        metrics.juntar(lote['metricas'], outro['metricas'])
+
+def registros(lote): return len(lote['cte']) + len(lote['nfe']) + len(lote['evento'])
+
+def limpar(lote):
+    for k in LISTAS: lote[k].clear()
+
+def gravar_lote(lote, substituir=False):
+    """
+    Grava o lote no banco (e os originais no acervo). substituir=True (reextração) atualiza
+    as linhas já existentes em vez de ignorá-las, preservando as colunas editadas no app.
+    """
+    ok, msg = True, ""
+    with etapa('gravacao'):
+        if substituir:
+            ok, msg = db.upsert_documentos(lote['cte'], lote['nfe'], lote['itens'], lote['evento'])
+        else:
+            if lote['cte']:
+                ok, msg = db.insert_cte_many(lote['cte'])
+            if ok and (lote['nfe'] or lote['itens']):
+                ok, msg = db.insert_nfe_many(lote['nfe'], lote['itens'])
+            if ok and lote['evento']:
+                ok, msg = db.insert_eventos_many(lote['evento'])
+        if lote['logs']:
+            ok_log, msg_log = db.insert_log_many(lote['logs'])
+            if not ok_log: print(f"Aviso: log de erros do lote não gravado ({msg_log})", file=sys.stderr)
+    if ok and lote['acervo']:
+        with etapa('gravacao_acervo'): acervo.gravar(lote['acervo'])
+    return ok, msg
+
+def parse_arquivo(caminho, tipo):
+    """Faz o parse de todos os XML de um arquivo em disco (executável em processo filho)."""
+    lote = novo_lote(); lote['caminho'] = caminho
+    with metrics.coletar() as col:
+        for fn, c in iter_xml(caminho): acumular(lote, tipo, fn, c)
+    lote['metricas'] = col
+    return lote
+
+def parse_tarefa(tarefa, tipo, arquivar=ACERVO_ATIVO):
+    """
+    Tarefa do importador: lista de (caminho, membro). membro=None para .xml solto,
+    nome do XML dentro do .zip caso contrário.
+    """
+    lote = novo_lote(); zips = {}
+    with metrics.coletar() as col:
+        try:
+            for caminho, membro in tarefa:
+                with etapa('leitura'):
+                    if membro is None:
+                        fn = os.path.basename(caminho)
+                        with open(caminho, 'rb') as f: c = f.read()
+                    else:
+                        if caminho not in zips: zips[caminho] = zipfile.ZipFile(caminho)
+                        fn = membro; c = zips[caminho].read(membro)
+                acumular(lote, tipo, fn, c, arquivar)
+        finally:
+            for z in zips.values(): z.close()
+    lote['metricas'] = col
+    return lote
+
+def em_paralelo(funcao, tarefas, workers, consumir, *args):
+    """
+    Aplica funcao(tarefa, *args) em 'workers' processos e entrega cada resultado a consumir(), na
+    ordem. Janela limitada (2 x workers) de tarefas em voo: não acumula lotes parseados na memória
+    quando a gravação é mais lenta que o parse. workers <= 1 roda no processo atual.
+    """
+    if workers <= 1:
+        for t in tarefas: consumir(funcao(t, *args))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fila = deque()
+        for t in tarefas:
+            fila.append(pool.submit(funcao, t, *args))
+            if len(fila) >= workers * 2: consumir(fila.popleft().result())
+        while fila: consumir(fila.popleft().result())
+
+def registrar_execucao(origem, coletor, docs, regs, erros, n_bytes, perfil=None):
+    """Grava o resumo por etapa (n, p50, p95) da execução em ingest_runs, sem esperar o commit."""
+    try:
+        db.insert_ingest_run.enviar(origem, coletor['inicio'], time.time() - coletor['inicio'], docs, regs, erros, n_bytes, metrics.resumo(coletor), perfil)
+    except Exception: pass # Métrica nunca deve derrubar a ingestão
+
+def processar_job(job, lote_max=WORKER_LOTE):
+    """
+    Processa os arquivos do job em lotes de 'lote_max' documentos, atualizando o progresso a cada commit.
+    Retomável: documentos já contados em 'processados' são pulados.
+    Deve rodar dentro de metrics.coletar() para medir as etapas.
+    """
+    tipo = job['tipo']; pular = job['processados']
+    proc, regs, errs, n_bytes = job['processados'], job['registros'], job['erros'], job['bytes']
+    total = sum(contar_xml(a) for a in job['arquivos'])
+    db.update_job_progress(job['id'], proc, regs, errs, n_bytes, total)
+
+    lote = novo_lote()
+    def flush():
+        ok, msg = gravar_lote(lote)
+        if not ok: raise RuntimeError(msg)
+        db.update_job_progress(job['id'], proc, regs, errs, n_bytes)
+        limpar(lote)
+
+    i = 0
+    for caminho in job['arquivos']:
+        for fn, c in iter_xml(caminho):
+            i += 1
+            if i <= pular: continue
+            n_logs, n_regs = len(lote['logs']), registros(lote)
+            acumular(lote, tipo, fn, c)
+            errs += len(lote['logs']) - n_logs; regs += registros(lote) - n_regs
+            proc += 1; n_bytes += len(c)
+            if lote['docs'] >= lote_max: flush(); lote['docs'] = 0
+    flush()
+    return proc, regs, errs, n_bytes
+
+def remover_arquivos(arquivos):
+    pastas = set()
+    for a in arquivos:
+        try: os.remove(a); pastas.update((os.path.dirname(a), os.path.dirname(os.path.dirname(a))))
+        except OSError: pass
+    for p in sorted(pastas, key=len, reverse=True): # Subpasta do upload antes da pasta do job
+        try: os.rmdir(p) # Só remove se estiver vazia
+        except OSError: pass
+
+def limpar_spool(horas=SPOOL_RETENCAO_HORAS):
+    """Apaga as pastas de job do spool com mais de 'horas' que não pertencem a um job pendente/em andamento."""
+    limite = time.time() - horas * 3600
+    try: pastas = os.listdir(SPOOL_DIR)
+    except OSError: return
+    ativas = {os.path.relpath(a, SPOOL_DIR).split(os.sep)[0] for a in db.get_arquivos_jobs_ativos()}
+    for p in pastas:
+        caminho = os.path.join(SPOOL_DIR, p)
+        try:
+            if p in ativas or os.path.getmtime(caminho) >= limite: continue
+            if os.path.isdir(caminho): shutil.rmtree(caminho)
+            else: os.remove(caminho)
+        except OSError: pass
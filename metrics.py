@@ -0,0 +1,163 @@
+# metrics.py
+# Métricas por etapa da ingestão (leitura, parse XML, namespace, extração, classificação, gravação)
+# e das consultas/gráficos do app (medido, ver painel de desempenho no app.py).
+# Cada execução (job do worker, importação, lote do watcher, rerun do app) ativa um coletor na
+# thread atual; sem coletor ativo, etapa() e medido() não medem nada.
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Histograma logarítmico: bucket = floor(log(dt)/log(BASE)). Erro < 5% nos percentis,
+# memória constante e soma direta entre processos (importador/watcher).
+BASE = 1.05
+LOG_BASE = math.log(BASE)
+_local = threading.local()
+
+def novo_coletor(eventos=False):
+    """eventos=True guarda também cada medição (painel do app / export JSON-lines)."""
+    c = {'etapas': {}, 'inicio': time.time()}
+    if eventos: c['eventos'] = []
+    return c
+
+def coletor_ativo(): return getattr(_local, 'coletor', None)
+
+@contextmanager
+def coletar(coletor=None):
+    """Ativa um coletor na thread atual durante o bloco."""
+    anterior = coletor_ativo()
+    _local.coletor = coletor if coletor is not None else novo_coletor()
+    try: yield _local.coletor
+    finally: _local.coletor = anterior
+
+def ativar(coletor):
+    """Ativa o coletor na thread atual sem bloco with (rerun do Streamlit). None desativa."""
+    _local.coletor = coletor
+
+def registrar(coletor, nome, dt, n_bytes=0, **extra):
+    e = coletor['etapas'].get(nome)
+    if e is None: e = coletor['etapas'][nome] = {'n': 0, 'total': 0.0, 'bytes': 0, 'hist': {}}
+    e['n'] += 1; e['total'] += dt; e['bytes'] += n_bytes
+    b = math.floor(math.log(dt) / LOG_BASE) if dt > 0 else -1000
+    e['hist'][b] = e['hist'].get(b, 0) + 1
+    if 'eventos' in coletor: coletor['eventos'].append({'etapa': nome, 'ms': round(dt * 1000, 3), **extra})
+
+@contextmanager
+def etapa(nome, n_bytes=0):
+    c = coletor_ativo()
+    if c is None: yield; return
+    t = time.perf_counter()
+    try: yield
+    finally: registrar(c, nome, time.perf_counter() - t, n_bytes)
+
+def juntar(coletor, outro):
+    for nome, o in outro['etapas'].items():
+        e = coletor['etapas'].setdefault(nome, {'n': 0, 'total': 0.0, 'bytes': 0, 'hist': {}})
+        e['n'] += o['n']; e['total'] += o['total']; e['bytes'] += o['bytes']
+        for b, q in o['hist'].items(): e['hist'][b] = e['hist'].get(b, 0) + q
+
+def percentil(hist, n, p):
+    alvo = p * n; acum = 0
+    for b in sorted(hist):
+        acum += hist[b]
+        if acum >= alvo: return 0.0 if b == -1000 else BASE ** (b + 0.5)
+    return 0.0
+
+def resumo(coletor):
+    """{etapa: {n, total_s, p50_ms, p95_ms, bytes}} pronto para gravar em ingest_runs."""
+    return {nome: {
+        'n': e['n'], 'total_s': round(e['total'], 4), 'bytes': e['bytes'],
+        'p50_ms': round(percentil(e['hist'], e['n'], 0.50) * 1000, 4),
+        'p95_ms': round(percentil(e['hist'], e['n'], 0.95) * 1000, 4)
+    } for nome, e in coletor['etapas'].items()}
+
+# --- CONSULTAS E GRÁFICOS DO APP: tempo, linhas de entrada/saída e cache hit/miss ---
+def _forma(x):
+    f = getattr(x, 'shape', None) # DataFrame/Series/ndarray (objetos do Streamlit respondem a qualquer atributo)
+    return int(f[0]) if isinstance(f, tuple) and f else None
+
+def _linhas(x):
+    if isinstance(x, tuple) and x: x = x[0]
+    n = _forma(x)
+    return len(x) if n is None and isinstance(x, list) else n
+
+def _pilha():
+    if not hasattr(_local, 'cache'): _local.cache = []
+    return _local.cache
+
+def medido(nome=None, cache=False):
+    """
+    Decorador: mede a função como etapa 'nome' (padrão: modulo.funcao). Linhas de entrada =
+    1º argumento tabular, de saída = resultado. Para funções st.cache_*, usar cache=True por
+    fora do decorador de cache e @calculado por dentro: o corpo só roda no miss.
+    """
+    def deco(func):
+        rotulo = nome or (func.__name__ if func.__module__ == '__main__' else f"{func.__module__}.{func.__name__}")
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            c = coletor_ativo()
+            if c is None: return func(*args, **kwargs)
+            if cache: _pilha().append(False)
+            em = time.time() - c['inicio']; t = time.perf_counter()
+            try: res = func(*args, **kwargs)
+            finally: miss = _pilha().pop() if cache else None
+            extra = {'em_ms': round(em * 1000, 1), 'linhas_in': next((n for n in map(_forma, args) if n is not None), None), 'linhas_out': _linhas(res)}
+            if cache: extra['cache'] = 'miss' if miss else 'hit'
+            registrar(c, rotulo, time.perf_counter() - t, **extra)
+            return res
+        return wrapper
+    return deco
+
+def calculado(func):
+    """Marca, para o @medido(cache=True) mais externo, que o corpo da função cacheada rodou."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        p = _pilha()
+        if p: p[-1] = True
+        return func(*args, **kwargs)
+    return wrapper
+
+def medir(nome, func, *args, **kwargs):
+    """Chamada avulsa medida, ex.: medir('render:logs', st.dataframe, df)."""
+    return medido(nome)(func)(*args, **kwargs)
+
+def exportar_jsonl(coletor, caminho, **contexto):
+    """Acrescenta os eventos do coletor em 'caminho' (uma linha JSON por evento) para análise offline."""
+    if not coletor.get('eventos'): return
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    ts = datetime.fromtimestamp(coletor['inicio']).isoformat(timespec='seconds')
+    with open(caminho, 'a', encoding='utf-8') as f:
+        for ev in coletor['eventos']: f.write(json.dumps({'ts': ts, **contexto, **ev}, ensure_ascii=False, default=str) + "\n")
+
+# --- PERFIL OPCIONAL (cProfile / pyinstrument) DE UMA EXECUÇÃO ---
+PASTA_PERFIS = "perfis"
+
+@contextmanager
+def perfil(modo, nome):
+    """
+    modo: None (desligado), 'cprofile' ou 'pyinstrument'. Grava em perfis/<nome>.prof|.html
+    e devolve o caminho em info['arquivo']. Só mede a thread/processo atual.
+    """
+    info = {'arquivo': None}
+    if not modo: yield info; return
+    os.makedirs(PASTA_PERFIS, exist_ok=True)
+    base = os.path.join(PASTA_PERFIS, f"{nome}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    if modo == 'pyinstrument':
+        try: from pyinstrument import Profiler
+        except ImportError: modo = 'cprofile' # Dependência opcional: cai para cProfile
+    if modo == 'pyinstrument':
+        prof = Profiler(); prof.start()
+        try: yield info
+        finally:
+            prof.stop(); info['arquivo'] = base + ".html"
+            with open(info['arquivo'], 'w', encoding='utf-8') as f: f.write(prof.output_html())
+    else:
+        import cProfile
+        prof = cProfile.Profile(); prof.enable()
+        try: yield info
+        finally:
+            prof.disable(); info['arquivo'] = base + ".prof"; prof.dump_stats(info['arquivo'])
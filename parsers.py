@@ -1,7 +1,9 @@
 # parsers.py
+import re
 from lxml import etree
 from datetime import datetime
 import services
+from metrics import etapa
 from utils import xml_float, br_weight
 
 PARSER = etree.XMLParser(recover=True, encoding='utf-8')
@@ -13,132 +15,238 @@ def strip_namespace(root):
         if i >= 0: elem.tag = elem.tag[i+1:]
     return root
 
+def carregar_xml(raw):
+    """fromstring + remoção de namespace, medidos como etapas separadas (metrics)."""
+    if isinstance(raw, str): raw = raw.encode('utf-8')
+    with etapa('parse_xml', len(raw)): rt = etree.fromstring(raw, PARSER)
+    with etapa('namespace'): rt = strip_namespace(rt)
+    return rt
+
+# Elemento raiz -> tipo de documento (roteamento de uploads mistos)
+RAIZ_TIPO = {
+    'cteProc': 'cte', 'CTe': 'cte', 'cteOSProc': 'cte', 'CTeOS': 'cte',
+    'nfeProc': 'nfe', 'NFe': 'nfe',
+    'procEventoCTe': 'evento', 'eventoCTe': 'evento', 'retEventoCTe': 'evento',
+    'procEventoNFe': 'evento', 'evento': 'evento', 'retEvento': 'evento', 'envEvento': 'evento'
+}
+RE_TAG = re.compile(rb'<(?:[A-Za-z_][\w.\-]*:)?([A-Za-z_][\w.\-]*)')
+
+def detect_doc_type(raw):
+    """
+    Identifica o tipo pelo elemento raiz nos primeiros bytes, sem parse completo.
+    Retorna 'cte', 'nfe', 'evento' ou None.
+    """
+    if isinstance(raw, str): raw = raw.encode('utf-8')
+    ini = raw[:2048]; pos = 0
+    while True:
+        i = ini.find(b'<', pos)
+        if i < 0 or i + 1 >= len(ini): break
+        nx = ini[i+1:i+2]
+        if nx == b'?': fim = ini.find(b'?>', i); pos = fim + 2 # Declaração XML / instruções
+        elif ini.startswith(b'<!--', i): fim = ini.find(b'-->', i); pos = fim + 3
+        elif nx == b'!': fim = ini.find(b'>', i); pos = fim + 1 # DOCTYPE
+        else:
+            m = RE_TAG.match(ini, i)
+            tipo = RAIZ_TIPO.get(m.group(1).decode('ascii', 'ignore')) if m else None
+            if tipo: return tipo
+            break # Raiz desconhecida (ex.: envelope SOAP): procura os grupos de informação
+        if fim < 0: break
+    if b'infEvento' in ini: return 'evento'
+    if b'infCte' in ini: return 'cte'
+    if b'infNFe' in ini: return 'nfe'
+    return None
+
+# --- Extração declarativa: coluna -> caminho no XML, compilada num plano de uma passada ---
+# 'a/b': a partir do grupo de informação (infCte, infNFe); '//a/b': em qualquer profundidade;
+# '[]' no fim: todas as ocorrências (lista); '@x': atributo do próprio elemento;
+# (caminho, {spec}): grupo repetido -> lista de registros (dentro dele, só caminhos relativos).
+# Valor: texto do primeiro elemento encontrado ('' se vazio) ou None se ausente, como o findtext.
+CAMPOS_CTE = {
+    'id': '@Id', 'dh_emi': 'ide/dhEmi', 'numero_cte': 'ide/nCT', 'tp_cte': 'ide/tpCTe', # 0=Normal, 1=Complemento, 3=Substituto
+    'mun_ini': 'ide/xMunIni', 'uf_ini': 'ide/UFIni', 'mun_fim': 'ide/xMunFim', 'uf_fim': 'ide/UFFim',
+    'emitente': 'emit/xNome', 'cnpj_emit': 'emit/CNPJ', 'remetente': 'rem/xNome',
+    'destinatario': 'dest/xNome', 'mun_dest': 'dest/enderDest/xMun', 'uf_dest': 'dest/enderDest/UF',
+    'frete': '//vTPrest', 'cargas': '//qCarga[]', 'chave_ref': '//infCteComp/chCTe',
+    'componentes': ('//Comp', {'nome': 'xNome', 'valor': 'vComp'}),
+    'nfes': ('//infNFe', {'chave': 'chave'}),
+}
+CAMPOS_NFE = {
+    'id': '@Id', 'ide': 'ide', 'dh_emi': 'ide/dhEmi', 'numero_nf': 'ide/nNF',
+    'emit': 'emit', 'emitente': 'emit/xNome', 'cnpj_emit': 'emit/CNPJ', 'ender_emit': 'emit/enderEmit',
+    'mun_emit': 'emit/enderEmit/xMun', 'uf_emit': 'emit/enderEmit/UF', 'cep_emit': 'emit/enderEmit/CEP',
+    'dest': 'dest', 'destinatario': 'dest/xNome', 'cnpj_dest': 'dest/CNPJ', 'ender_dest': 'dest/enderDest',
+    'mun_dest': 'dest/enderDest/xMun', 'uf_dest': 'dest/enderDest/UF', 'cep_dest': 'dest/enderDest/CEP',
+    'valor_nf': '//ICMSTot/vNF', 'transportadora': 'transp/transporta/xNome', 'mod_frete': 'transp/modFrete',
+    'pesos': 'transp/vol/pesoB[]', 'cfop': 'det/prod/CFOP',
+    'itens': ('det', {'item_num': '@nItem', 'cod_produto': 'prod/cProd', 'produto': 'prod/xProd', 'ncm': 'prod/NCM',
+                      'cfop': 'prod/CFOP', 'unidade': 'prod/uCom', 'qtd': 'prod/qCom', 'vl_total': 'prod/vProd'}),
+}
+
+def compilar(spec, _grupo=None, _regras=None):
+    """Plano (spec, regras por tag): cada regra = (coluna, ancestrais do mais próximo ao grupo, livre, lista, subspec, grupo)."""
+    regras = {} if _regras is None else _regras
+    for col, cam in spec.items():
+        sub = None
+        if isinstance(cam, tuple): cam, sub = cam
+        if cam.startswith('@'): continue # Lido do próprio elemento ao abrir o registro
+        partes = cam.removesuffix('[]').strip('/').split('/')
+        regras.setdefault(partes[-1], []).append(
+            (col, tuple(reversed(partes[:-1])), cam.startswith('//'), cam.endswith('[]') or sub is not None, sub, _grupo))
+        if sub is not None: compilar(sub, col, regras)
+    return spec, regras
+
+def _registro(el, spec):
+    return {col: el.get(cam[1:]) if isinstance(cam, str) and cam.startswith('@') else
+            [] if isinstance(cam, tuple) or cam.endswith('[]') else None for col, cam in spec.items()}
+
+def extrair(raiz, plano):
+    """{coluna: valor} de raiz numa única passada pelos descendentes (cada elemento visitado uma vez)."""
+    spec, regras = plano
+    out = _registro(raiz, spec); abertos = {} # Elemento de grupo -> seu registro
+    for e in raiz.iterdescendants():
+        rs = regras.get(e.tag)
+        if rs is None: continue
+        for col, ancestrais, livre, lista, sub, grupo in rs:
+            base = e.getparent()
+            for tag in ancestrais:
+                if base is None or base.tag != tag: break
+                base = base.getparent()
+            else:
+                if livre: destino = out
+                elif grupo is None: destino = out if base is raiz else None
+                else: destino = abertos.get(base)
+                if destino is None: continue
+                if sub is not None: v = abertos[e] = _registro(e, sub)
+                else: v = e.text or ''
+                if lista: destino[col].append(v)
+                elif destino[col] is None: destino[col] = v
+    return out
+
+PLANO_CTE = compilar(CAMPOS_CTE)
+PLANO_NFE = compilar(CAMPOS_NFE)
+
+def _data_br(dh):
+    data = (dh or "")[:10]
+    try: return datetime.strptime(data, "%Y-%m-%d").strftime("%d/%m/%Y")
+    except: return data
+
 def parse_cte(raw, fname):
     try:
-        if isinstance(raw, str): raw = raw.encode('utf-8')
-        rt = etree.fromstring(raw, PARSER); rt = strip_namespace(rt)
-        inf = rt.find(".//infCte")
-        
-        if inf is None:
-            if rt.find(".//retEventoCTe") is not None: return [], "Evento de CT-e"
-            return [], "XML Inválido"
-        
-        chave_cte_propria = inf.get("Id", "").replace("CTe", "")
-        dh = inf.findtext("ide/dhEmi") or ""; data = dh[:10]
-        try: data = datetime.strptime(data, "%Y-%m-%d").strftime("%d/%m/%Y")
-        except: pass
+        rt = carregar_xml(raw)
+        with etapa('extracao'):
+            inf = rt.find(".//infCte")
         
-        # Tipo do CTE: 0=Normal, 1=Complemento, 3=Substituto
-        tp_cte = inf.findtext("ide/tpCTe")
+            if inf is None:
+                if rt.find(".//retEventoCTe") is not None: return [], "Evento de CT-e"
+                return [], "XML Inválido"
+            f = extrair(inf, PLANO_CTE)
         
-        vp = inf.find(".//vTPrest"); frete = xml_float(vp.text) if vp is not None else 0.0
-        peso = sum(xml_float(n.text) for n in inf.findall(".//qCarga"))
-        
-        pedagio = 0.0
-        for c in inf.findall(".//Comp"):
-            nm = c.findtext("xNome","").upper()
-            if "PEDAGIO" in nm or "VALE" in nm: pedagio += xml_float(c.findtext("vComp","0"))
+            pedagio = 0.0
+            for c in f['componentes']:
+                nm = (c['nome'] or "").upper()
+                if "PEDAGIO" in nm or "VALE" in nm: pedagio += xml_float(c['valor'])
                 
-        m_ini = inf.findtext("ide/xMunIni"); u_ini = inf.findtext("ide/UFIni")
-        m_fim = inf.findtext("ide/xMunFim") or inf.findtext("dest/enderDest/xMun")
-        u_fim = inf.findtext("ide/UFFim") or inf.findtext("dest/enderDest/UF")
-        chave_ref = inf.findtext(".//infCteComp/chCTe", "")
-        
-        chaves = [n.findtext("chave") for n in inf.findall(".//infNFe") if n.findtext("chave")]
-        if not chaves: chaves = [""]
-
-        lines = []
-        for k in chaves:
-            n_nf = str(int(k[25:34])) if k and len(k)==44 and k.isdigit() else ""
-            lines.append({
-                "chave_cte_propria": chave_cte_propria,
-                "chave_nf": k,
-                "data": data, 
-                "numero_cte": inf.findtext("ide/nCT"),
-                "emitente": inf.findtext("emit/xNome"), 
-                "cnpj_emit": inf.findtext("emit/CNPJ"),
-                "remetente": inf.findtext("rem/xNome"), 
-                "destinatario": inf.findtext("dest/xNome"),
-                "frete_valor": frete, 
-                "peso_kg": peso, 
-                "numero_nf_cte": n_nf,
-                "cidade_origem": f"{m_ini}-{u_ini}" if m_ini else "ND",
+            m_fim = f['mun_fim'] or f['mun_dest']; u_fim = f['uf_fim'] or f['uf_dest']
+            comum = {
+                "chave_cte_propria": (f['id'] or "").replace("CTe", ""),
+                "data": _data_br(f['dh_emi']),
+                "numero_cte": f['numero_cte'],
+                "emitente": f['emitente'],
+                "cnpj_emit": f['cnpj_emit'],
+                "remetente": f['remetente'],
+                "destinatario": f['destinatario'],
+                "frete_valor": xml_float(f['frete']),
+                "peso_kg": sum(xml_float(q) for q in f['cargas']),
+                "cidade_origem": f"{f['mun_ini']}-{f['uf_ini']}" if f['mun_ini'] else "ND",
                 "cidade_destino": f"{m_fim}-{u_fim}" if m_fim else "ND",
-                "pedagio_valor": pedagio, 
-                "chave_ref_cte": chave_ref,
-                "tp_cte": tp_cte, # Novo campo fundamental
+                "pedagio_valor": pedagio,
+                "chave_ref_cte": f['chave_ref'] or "",
+                "tp_cte": f['tp_cte'],
                 "arquivo": fname
-            })
-        return lines, None
+            }
+        
+            chaves = [n['chave'] for n in f['nfes'] if n['chave']] or [""]
+            lines = []
+            for k in chaves:
+                n_nf = str(int(k[25:34])) if k and len(k)==44 and k.isdigit() else ""
+                lines.append({**comum, "chave_nf": k, "numero_nf_cte": n_nf})
+            return lines, None
 
     except Exception as e: return [], str(e)
 
-def parse_nfe_header(raw, fname):
+def parse_nfe(raw, fname):
+    """(cabeçalho, itens, erro) da NF-e com um único parse do XML e uma única extração."""
     try:
-        if isinstance(raw, str): raw = raw.encode('utf-8')
-        rt = etree.fromstring(raw, PARSER); rt = strip_namespace(rt)
-        inf = rt.find(".//infNFe"); 
-        
-        if inf is None: return None, "XML NFe Inválido"
+        rt = carregar_xml(raw)
+        with etapa('extracao'):
+            inf = rt.find(".//infNFe")
+            if inf is None: return None, [], "XML NFe Inválido"
+            f = extrair(inf, PLANO_NFE)
+            if f['ide'] is None or f['emit'] is None: return None, [], "Dados Incompletos"
 
-        ide = inf.find("ide"); em = inf.find("emit"); dest = inf.find("dest")
-        tot = inf.find(".//ICMSTot"); tr = inf.find("transp")
-        if ide is None or em is None: return None, "Dados Incompletos"
+            tem_dest = f['dest'] is not None
+            c_emit = f['cnpj_emit'] or ""; c_dest = (f['cnpj_dest'] or "") if tem_dest else ""
+            cfop = f['cfop'] or ""
+            chave = (f['id'] or "").replace("NFe", "")
+            header = {
+                "chave_nf": chave, "data": _data_br(f['dh_emi']), "numero_nf": f['numero_nf'],
+                "emitente": f['emitente'], "destinatario": f['destinatario'] if tem_dest else "Consumidor",
+                "cnpj_emit": c_emit, "cnpj_dest": c_dest, "uf_dest": f['uf_dest'] if tem_dest else "",
+                "valor_nf": xml_float(f['valor_nf']),
+                "peso_bruto": sum(xml_float(p) for p in f['pesos']), "transportadora": f['transportadora'] or "",
+                "cidade_origem": f"{f['mun_emit'] or ''}-{f['uf_emit'] or ''}" if f['ender_emit'] is not None else "",
+                "cidade_destino": (f"{f['mun_dest'] or ''}-{f['uf_dest'] or ''}" if f['ender_dest'] is not None else "") if tem_dest else "ND",
+                "cep_origem": f['cep_emit'] or "", "cep_destino": (f['cep_dest'] or "") if tem_dest else "",
+                "distancia": 0.0, 
+                "mod_frete": f['mod_frete'] or "",
+                "cfop_predominante": cfop, 
+                "tipo_operacao": None, # Preenchido abaixo (etapa 'classificacao')
+                "qtd_itens": len(f['itens']), "arquivo": fname
+            }
+            items = [{
+                "chave_nf": chave, "numero_nf": f['numero_nf'], "emitente": f['emitente'], "cnpj_emit": c_emit,
+                "item_num": d['item_num'], "cod_produto": d['cod_produto'], "produto": d['produto'], "ncm": d['ncm'],
+                "cfop": d['cfop'], "unidade": d['unidade'],
+                "qtd_display": br_weight(xml_float(d['qtd'])), "qtd_float": xml_float(d['qtd']),
+                "vl_total": xml_float(d['vl_total']), "arquivo": fname
+            } for d in f['itens']]
+        with etapa('classificacao'): header["tipo_operacao"] = services.classificar_operacao(cfop,c_emit,c_dest)
+        return header, items, None
 
-        dh = ide.findtext("dhEmi") or ""; data = dh[:10]
-        try: data = datetime.strptime(data, "%Y-%m-%d").strftime("%d/%m/%Y")
-        except: pass
-        
-        pb = 0.0
-        if tr is not None: 
-            for v in tr.findall("vol"): pb += xml_float(v.findtext("pesoB","0"))
-        
-        qtd_itens = len(inf.findall(".//det"))
+    except Exception as e: return None, [], str(e)
 
-        def get_city(n, t):
-            x = n.find(t)
-            return f"{x.findtext('xMun','')}-{x.findtext('UF','')}" if x is not None else ""
-        
-        cep_orig = em.findtext("enderEmit/CEP", "")
-        cep_dest = dest.findtext("enderDest/CEP", "") if dest is not None else ""
-        cid_orig = get_city(em,"enderEmit")
-        cid_dest = get_city(dest,"enderDest") if dest is not None else "ND"
-
-        c_emit = em.findtext("CNPJ",""); c_dest = dest.findtext("CNPJ","") if dest is not None else ""
-        cfop = inf.findtext("det/prod/CFOP","")
-
-        header = {
-            "chave_nf": inf.get("Id","").replace("NFe",""), "data": data, "numero_nf": ide.findtext("nNF"),
-            "emitente": em.findtext("xNome"), "destinatario": dest.findtext("xNome") if dest is not None else "Consumidor",
-            "cnpj_emit": c_emit, "cnpj_dest": c_dest, "uf_dest": dest.findtext("enderDest/UF") if dest is not None else "",
-            "valor_nf": xml_float(tot.findtext("vNF","0")) if tot is not None else 0.0,
-            "peso_bruto": pb, "transportadora": tr.findtext("transporta/xNome","") if tr is not None else "",
-            "cidade_origem": cid_orig, "cidade_destino": cid_dest,
-            "cep_origem": cep_orig, "cep_destino": cep_dest, 
-            "distancia": 0.0, 
-            "mod_frete": tr.findtext("modFrete","") if tr is not None else "",
-            "cfop_predominante": cfop, 
-            "tipo_operacao": services.classificar_operacao(cfop,c_emit,c_dest),
-            "qtd_itens": qtd_itens, "arquivo": fname
-        }
-        return header, None
-
-    except Exception as e: return None, str(e)
+def parse_nfe_header(raw, fname):
+    h, _, err = parse_nfe(raw, fname)
+    return h, err
 
 def parse_nfe_items(raw, fname):
+    _, items, err = parse_nfe(raw, fname)
+    return items, err
+
+def parse_evento(raw, fname):
+    """Eventos de CT-e/NF-e (cancelamento, CC-e, EPEC...): uma linha por evento."""
     try:
-        if isinstance(raw, str): raw = raw.encode('utf-8')
-        rt = etree.fromstring(raw, PARSER); rt = strip_namespace(rt)
-        inf = rt.find(".//infNFe"); k = inf.get("Id","").replace("NFe","")
-        items = []
-        for d in inf.findall("det"):
-            p = d.find("prod")
-            items.append({
-                "chave_nf": k, "numero_nf": inf.findtext("ide/nNF"), "emitente": inf.findtext("emit/xNome"),
-                "item_num": d.get("nItem"), "produto": p.findtext("xProd"), "ncm": p.findtext("NCM"),
-                "cfop": p.findtext("CFOP"), "unidade": p.findtext("uCom"), 
-                "qtd_display": br_weight(xml_float(p.findtext("qCom"))), "qtd_float": xml_float(p.findtext("qCom")),
-                "vl_total": xml_float(p.findtext("vProd")), "arquivo": fname
-            })
-        return items, None
-    except Exception as e: return [], str(e)
\ No newline at end of file
+        rt = carregar_xml(raw)
+        with etapa('extracao'):
+            infs = rt.findall(".//infEvento")
+            if not infs: return None, "XML Evento Inválido"
+
+            inf = infs[0]
+            # procEvento*: 1º infEvento = evento, 2º = retorno da SEFAZ. retEvento* avulso: só o retorno.
+            ret = infs[1] if len(infs) > 1 else (inf if rt.tag.startswith('retEvento') else None)
+            ch_cte = inf.findtext("chCTe")
+            data = _data_br(inf.findtext("dhEvento") or (ret.findtext("dhRegEvento") if ret is not None else ""))
+
+            return {
+                "chave": ch_cte or inf.findtext("chNFe") or "",
+                "modelo": "CT-e" if ch_cte else "NF-e",
+                "tp_evento": inf.findtext("tpEvento"),
+                "n_seq": inf.findtext("nSeqEvento") or "1",
+                "desc_evento": inf.findtext(".//descEvento") or inf.findtext("xEvento"),
+                "data": data,
+                "protocolo": ret.findtext("nProt") if ret is not None else None,
+                "status": ret.findtext("cStat") if ret is not None else None,
+                "motivo": ret.findtext("xMotivo") if ret is not None else None,
+                "arquivo": fname
+            }, None
+    except Exception as e: return None, str(e)
@@ -0,0 +1,41 @@
+# particoes.py
+# Partições por ano do banco (database.fechar_periodo): fatos de um ano fechado num arquivo próprio,
+# compactado e somente leitura, anexado só quando a consulta pede aquele ano.
+# Uso: python -m particoes --status
+#      python -m particoes --fechar 2023 --fechar 2024
+#      python -m particoes --fechar-ate 2024
+#      python -m particoes --descartar 2019
+import argparse
+from datetime import datetime
+import database as db
+
+def status():
+    anos, part = db.get_anos(), db.get_particoes()
+    fechados = {r['ano']: r for _, r in part.iterrows()} if not part.empty else {}
+    for ano in sorted(anos):
+        r = fechados.get(str(ano))
+        if r is None: print(f"{ano}  aberto (banco principal)")
+        else: print(f"{ano}  fechado em {r['fechada_em']}: {r['notas']:,} NF-e, {r['ctes']:,} CT-e, {r['bytes'] / 1024 / 1024:,.1f} MB ({db.arquivo_particao(ano)})")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m particoes", description="Fecha, lista e descarta as partições anuais do banco.")
+    ap.add_argument("--status", action="store_true", help="Anos abertos e fechados")
+    ap.add_argument("--fechar", type=int, action="append", default=[], metavar="ANO", help="Fecha o ano (pode repetir)")
+    ap.add_argument("--fechar-ate", type=int, metavar="ANO", help="Fecha todos os anos abertos até ANO")
+    ap.add_argument("--descartar", type=int, action="append", default=[], metavar="ANO", help="Apaga os fatos do ano")
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    anos = list(args.fechar)
+    if args.fechar_ate:
+        anos += [a for a, fechado in db.get_anos().items() if a <= min(args.fechar_ate, datetime.now().year - 1) and not fechado]
+    for ano in sorted(set(anos)):
+        ok, msg = db.fechar_periodo(ano)
+        print(msg if ok else f"ERRO ao fechar {ano}: {msg}")
+    for ano in args.descartar:
+        ok, msg = db.descartar_periodo(ano)
+        print(msg if ok else f"ERRO ao descartar {ano}: {msg}")
+    if args.status or not (anos or args.descartar): status()
+
+if __name__ == "__main__":
+    main()
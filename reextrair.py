@@ -0,0 +1,62 @@
+# reextrair.py
+# Reextração a partir do acervo de XML (acervo.py): roda os parsers atuais sobre os documentos
+# arquivados, em paralelo, e atualiza as linhas do banco (upsert), sem reler a pasta de rede.
+# Uso: python -m reextrair --workers 8
+#      python -m reextrair --tipo cte --chaves chaves.txt
+import argparse
+import os
+import sys
+import time
+import acervo
+import database as db
+import ingest
+import metrics
+
+def reparse_bloco(bloco):
+    """Descomprime e faz o parse de um bloco do acervo (executável em processo filho)."""
+    lote = ingest.novo_lote()
+    with metrics.coletar() as col:
+        for _, tipo, nome, codec, dados in bloco:
+            with metrics.etapa('leitura'): raw = acervo.descomprimir(codec, dados)
+            ingest.acumular(lote, tipo or "auto", nome, raw, arquivar=False)
+    lote['metricas'] = col
+    return lote
+
+def ler_chaves(caminho):
+    with open(caminho, encoding='utf-8') as f: return {l.strip() for l in f if l.strip()}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m reextrair", description="Reaplica os parsers atuais aos XML do acervo.")
+    ap.add_argument("--tipo", choices=["cte", "nfe", "evento"], help="Só documentos deste tipo")
+    ap.add_argument("--chaves", help="Arquivo com uma chave de acesso por linha")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch-size", type=int, default=1000, help="Documentos por tarefa/commit")
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    est = acervo.estatisticas()
+    print(f"Acervo: {est['docs']:,} documentos, {est['bytes']/1e6:,.1f} MB ({est['comprimido']/1e6:,.1f} MB comprimidos, {est['taxa']:.1f}x)")
+    chaves = ler_chaves(args.chaves) if args.chaves else None
+    blocos = acervo.iter_blocos(args.tipo, chaves, args.batch_size)
+    tot = {'docs': 0, 'registros': 0, 'erros': 0, 'bytes': 0, 'lotes_falhos': 0, 'docs_falhos': 0}
+    inicio = time.perf_counter()
+
+    with metrics.coletar() as col:
+        def consumir(lote):
+            ok, msg = ingest.gravar_lote(lote, substituir=True)
+            if lote['metricas']: metrics.juntar(col, lote['metricas'])
+            if not ok:
+                print(f"\nERRO ao gravar lote de {lote['docs']:,} documentos: {msg}")
+                tot['lotes_falhos'] += 1; tot['docs_falhos'] += lote['docs']; return
+            tot['docs'] += lote['docs']; tot['bytes'] += lote['bytes']
+            tot['registros'] += ingest.registros(lote); tot['erros'] += len(lote['logs'])
+            print(f"\r{tot['docs']:,} documentos reextraídos ({tot['docs']/(time.perf_counter()-inicio):,.0f} docs/s)", end="", flush=True)
+        ingest.em_paralelo(reparse_bloco, blocos, args.workers, consumir)
+
+    ingest.registrar_execucao("reextrair", col, tot['docs'], tot['registros'], tot['erros'], tot['bytes'])
+    print(f"\nConcluído: {tot['docs']:,} documentos, {tot['registros']:,} registros, {tot['erros']:,} erros em {time.perf_counter()-inicio:,.1f}s")
+    if tot['lotes_falhos']: print(f"ATENÇÃO: {tot['lotes_falhos']:,} lote(s) com {tot['docs_falhos']:,} documentos NÃO gravados; rode de novo")
+    return tot['lotes_falhos']
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0) # Código 1 se algum lote não foi gravado
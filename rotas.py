@@ -0,0 +1,127 @@
+# rotas.py
+# Motor de distâncias offline (sem roteador/API externa). km rodoviário = distância em linha reta
+# (haversine, vetorizada) x FATOR_CIRCUITO; pares presentes em MATRIZ_DISTANCIAS (CSV opcional
+# com km rodoviário real) usam o valor da matriz. A ingestão grava os pares calculados na tabela
+# 'distancias' (database.py), de onde a leitura das NF-e tira a distância (também das partições);
+# consultas avulsas usam distancia() (LRU).
+# Coordenadas: tabela de municípios (MUNICIPIOS_CSV, código IBGE/nome/UF -> lat/lon) com índice
+# sem acento; município fora da tabela cai no centroide da UF.
+# Uso: python -m rotas               completa o cache para as NF-e/CT-e já gravadas
+#      python -m rotas --recalcular  refaz o cache (ex.: depois de trocar a matriz ou o fator)
+import argparse
+import csv
+import os
+import re
+import unicodedata
+from functools import lru_cache
+import numpy as np
+from config import FATOR_CIRCUITO, MATRIZ_DISTANCIAS, MUNICIPIOS_CSV
+from utils import COORDS_UF
+
+RAIO_TERRA_KM = 6371.0
+# Dois primeiros dígitos do código IBGE do município -> UF
+UF_IBGE = {'11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO', '21': 'MA', '22': 'PI',
+           '23': 'CE', '24': 'RN', '25': 'PB', '26': 'PE', '27': 'AL', '28': 'SE', '29': 'BA', '31': 'MG', '32': 'ES',
+           '33': 'RJ', '35': 'SP', '41': 'PR', '42': 'SC', '43': 'RS', '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF'}
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância em linha reta (km) entre coordenadas em graus; aceita escalares ou arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(a))
+
+def normalizar(texto):
+    """Maiúsculas, sem acento e sem pontuação: 'São João d'Aliança' -> 'SAO JOAO D ALIANCA'."""
+    t = unicodedata.normalize('NFKD', str(texto or "")).encode('ascii', 'ignore').decode()
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", t.upper()).split())
+
+def separar(rotulo):
+    """'Município-UF' -> (nome, UF) normalizados. O hífen do nome ('Embu-Guaçu-SP') fica no nome."""
+    nome, _, uf = str(rotulo or "").rpartition("-")
+    return normalizar(nome), normalizar(uf)
+
+@lru_cache(maxsize=1)
+def carregar_municipios(caminho=MUNICIPIOS_CSV):
+    """
+    Índice {(nome, UF): (lat, lon, cod_ibge)} + {cod_ibge: ...} do CSV de municípios.
+    Colunas por nome: cod_ibge/codigo_ibge, nome, uf (ou pelo código), lat/latitude, lon/longitude.
+    """
+    if not caminho or not os.path.exists(caminho): return {}
+    idx = {}
+    with open(caminho, encoding='utf-8-sig', newline='') as f:
+        amostra = f.read(2048); f.seek(0)
+        for r in csv.DictReader(f, delimiter=';' if ';' in amostra else ','):
+            r = {k.strip().lower(): (v or "").strip() for k, v in r.items() if k}
+            cod = r.get('cod_ibge') or r.get('codigo_ibge') or ''
+            uf = normalizar(r.get('uf') or UF_IBGE.get(cod[:2], ''))
+            try: lat, lon = float(r.get('lat') or r.get('latitude')), float(r.get('lon') or r.get('longitude'))
+            except (TypeError, ValueError): continue
+            valor = (lat, lon, cod or None)
+            idx.setdefault((normalizar(r.get('nome')), uf), valor)
+            if cod: idx[cod] = valor
+    return idx
+
+def coordenada(rotulo):
+    """
+    'Município-UF' (ou código IBGE) -> (lat, lon, precisao, cod_ibge). precisao 'municipio' pela
+    tabela, 'uf' pelo centroide do estado; (None, None, '', None) se não resolver.
+    """
+    idx = carregar_municipios()
+    r = str(rotulo or "").strip()
+    if r in idx: return (*idx[r][:2], 'municipio', idx[r][2])
+    nome, uf = separar(r)
+    if (nome, uf) in idx: return (*idx[(nome, uf)][:2], 'municipio', idx[(nome, uf)][2])
+    if uf in COORDS_UF: return (*COORDS_UF[uf], 'uf', None)
+    return None, None, '', None
+
+@lru_cache(maxsize=1)
+def carregar_matriz(caminho=MATRIZ_DISTANCIAS):
+    """{(origem, destino): km} do CSV 'origem;destino;km' (rótulos 'Município-UF'), nos dois sentidos."""
+    if not caminho or not os.path.exists(caminho): return {}
+    matriz = {}
+    with open(caminho, encoding='utf-8-sig', newline='') as f:
+        amostra = f.read(2048); f.seek(0)
+        for linha in csv.reader(f, delimiter=';' if ';' in amostra else ','):
+            if len(linha) < 3: continue
+            try: km = float(linha[2].replace(",", "."))
+            except ValueError: continue # cabeçalho
+            o, d = normalizar(linha[0]), normalizar(linha[1])
+            matriz[(o, d)] = km; matriz.setdefault((d, o), km)
+    return matriz
+
+def calcular(pares):
+    """
+    pares: [((rotulo, lat, lon, precisao) da origem, (idem) do destino)] -> [(km, fonte)].
+    fonte: 'matriz', 'estimada' (coordenadas do município), 'estimada_uf' (centroide de UF)
+    ou 'sem_coordenada' (km None). Mesma UF por centroide não tem distância (daria 0).
+    """
+    if not pares: return []
+    matriz = carregar_matriz()
+    o = np.array([p[0][1:3] for p in pares], dtype=float); d = np.array([p[1][1:3] for p in pares], dtype=float)
+    km = haversine_km(o[:, 0], o[:, 1], d[:, 0], d[:, 1]) * FATOR_CIRCUITO
+    saida = []
+    for (po, pd_), k in zip(pares, km):
+        ro, rd = normalizar(po[0]), normalizar(pd_[0])
+        if (ro, rd) in matriz: saida.append((matriz[(ro, rd)], 'matriz'))
+        elif ro == rd and ro: saida.append((0.0, 'estimada'))
+        elif np.isnan(k) or ('uf' in (po[3], pd_[3]) and k == 0): saida.append((None, 'sem_coordenada'))
+        else: saida.append((round(float(k), 1), 'estimada' if po[3] == pd_[3] == 'municipio' else 'estimada_uf'))
+    return saida
+
+@lru_cache(maxsize=20000)
+def distancia(origem, destino):
+    """(km, fonte) entre dois rótulos 'Município-UF', sem passar pelo banco."""
+    return calcular([((origem, *coordenada(origem)), (destino, *coordenada(destino)))])[0]
+
+def main(argv=None):
+    import database as db # Import tardio: database importa este módulo
+    ap = argparse.ArgumentParser(prog="python -m rotas", description="Preenche nfe.distancia pelo motor de distâncias offline.")
+    ap.add_argument("--recalcular", action="store_true", help="Descarta o cache de distâncias e coordenadas antes")
+    args = ap.parse_args(argv)
+    db.init_db()
+    n = db.atualizar_distancias(args.recalcular)
+    print(f"{n:,} pares de cidades com distância atualizada (NF-e de anos abertos e fechados).")
+    print(db.load_data("distancias").groupby('fonte').size().to_string())
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 # services.py
+import numpy as np
 import pandas as pd
 import database as db
+import rotas
 from config import CNPJS_CIA, TABELA_ANTT
-from utils import limpar_cnpj, get_regiao, COORDS_UF
+from utils import limpar_cnpj, get_regiao, MESES_ABREV
 from functools import lru_cache
+from metrics import medido
 
 # --- UTILITÁRIOS ---
 def get_fluxo(emit, dest):
@@ -39,34 +42,55 @@ def classificar_operacao(cfop, emit, dest):
 
 def get_antt_coef(t, e): return TABELA_ANTT.get(t, {}).get(e, (0.0, 0.0))
 
+def piso_antt(km, tipo_carga, eixos):
+    """Piso mínimo ANTT: coeficiente de deslocamento (R$/km) x km + carga e descarga (R$)."""
+    ccd, cc = get_antt_coef(tipo_carga, eixos)
+    return ccd * km + cc
+
 @lru_cache(maxsize=5000)
 def get_coords(query):
-    try:
-        uf = str(query).split("-")[-1].strip()
-        if uf in COORDS_UF: return COORDS_UF[uf]
-    except: pass
-    return None
+    """(lat, lon) do município 'Município-UF' (centroide da UF se fora da tabela) ou None."""
+    lat, lon, _, _ = rotas.coordenada(query)
+    return (lat, lon) if lat is not None else None
+
+@medido()
+def get_coords_cidades():
+    """Coordenadas gravadas por cidade (resolvidas uma vez na ingestão), para o mapa."""
+    return db.load_data("cidades", ['rotulo', 'lat', 'lon', 'precisao'])
 
-def iniciar_worker(): pass
-def get_route_data(a,b,c,d): return 0.0, []
+def iniciar_worker():
+    import worker # Import tardio: worker -> ingest -> parsers -> services
+    worker.iniciar()
+
+@lru_cache(maxsize=5000)
+def get_route_data(origem, destino):
+    """(km, fonte, [coords da origem, coords do destino]) entre rótulos 'Município-UF' (rotas.py)."""
+    km, fonte = rotas.distancia(origem, destino)
+    return km, fonte, [c for c in (get_coords(origem), get_coords(destino)) if c]
 
+@medido()
 def get_items_data(): return db.load_data("itens")
 
-def get_dashboard_data():
+@medido()
+def get_dashboard_data(anos=None):
     """
     Gera a tabela principal de NF-e enriquecida com dados do CT-e (Rateado).
+    anos: só as NF-e desses anos (lê só as partições deles) e os CT-e que as transportam.
     """
-    df_n = db.load_data("nfe"); df_c = db.load_data("cte")
+    df_n = db.load_data("nfe", anos=anos)
+    # Só o necessário para o rateio: vínculo CT-e x NF-e + valores do cabeçalho
+    cols_c = ['chave_cte_propria', 'chave_nf', 'numero_cte', 'emitente', 'frete_valor', 'pedagio_valor']
+    df_c = db.load_data("cte", cols_c) if anos is None else db.load_cte_das_notas(df_n['chave_nf'], cols_c)
     if df_n.empty and df_c.empty: return pd.DataFrame()
 
     # Prepara colunas NF
-    cols_n = ['chave_nf','numero_nf','destinatario','cnpj_dest','cnpj_emit','emitente','uf_dest','valor_nf','peso_bruto','data','mod_frete','tipo_operacao','cfop_predominante','cidade_origem','cidade_destino','transportadora','qtd_itens','cep_origem','cep_destino']
+    cols_n = ['chave_nf','numero_nf','destinatario','cnpj_dest','cnpj_emit','emitente','uf_dest','valor_nf','peso_bruto','data','mod_frete','tipo_operacao','cfop_predominante','cidade_origem','cidade_destino','transportadora','qtd_itens','cep_origem','cep_destino','distancia','fonte_distancia']
     for c in cols_n: 
         if c not in df_n.columns: df_n[c] = None
     df_n = df_n[cols_n].copy()
     
     # Garante tipos numéricos na NF
-    for c in ['valor_nf','peso_bruto']: 
+    for c in ['valor_nf','peso_bruto','distancia']: 
         df_n[c] = pd.to_numeric(df_n.get(c,0), errors='coerce').fillna(0)
 
     # Prepara chaves para merge
@@ -89,6 +113,12 @@ def get_dashboard_data():
         
         # Subset de pesos das notas disponíveis
         pesos_nf = df_n[['chave_nf', 'peso_bruto']].rename(columns={'peso_bruto': 'peso_nf_ref'})
+        if anos is not None:
+            # Outras notas dos CT-e (anos fora do filtro) entram no rateio com o peso do banco
+            fora = df_c.loc[~df_c['chave_nf'].isin(df_n['chave_nf']), 'chave_nf'].unique()
+            if len(fora):
+                extra = pd.Series(db.get_pesos_nf(fora), dtype='float64')
+                pesos_nf = pd.concat([pesos_nf, pd.DataFrame({'chave_nf': extra.index, 'peso_nf_ref': pd.to_numeric(extra, errors='coerce').fillna(0).values})], ignore_index=True)
         
         # Merge CTE -> Pesos NF
         df_c_calc = pd.merge(df_c, pesos_nf, on='chave_nf', how='left')
@@ -159,7 +189,11 @@ def get_dashboard_data():
     if 'transportadora_cte' not in df.columns: df['transportadora_cte'] = None
     for c in ['frete_valor','pedagio_valor']: df[c] = df[c].fillna(0)
     
-    df['distancia'] = 0
+    # Base do R$/t·km: só notas com distância conhecida e frete
+    df['ton_km'] = (df['peso_bruto'] / 1000 * df['distancia']).where(df['frete_valor'] > 0, 0)
+    df['frete_com_km'] = df['frete_valor'].where(df['ton_km'] > 0, 0)
+    # Parte das t·km com distância fora da matriz rodoviária (estimativa): o KPI avisa
+    df['ton_km_estimada'] = df['ton_km'].where(df['fonte_distancia'] != 'matriz', 0)
     s_cte = df['transportadora_cte']; s_nfe = df['transportadora']
     df['Transportadora_Final'] = s_cte.fillna(s_nfe).fillna('---')
     
@@ -182,7 +216,80 @@ def get_dashboard_data():
 
     return df
 
+# --- CUBO PRÉ-AGREGADO (GRÁFICOS E CARDS) ---
+CUBE_DIMS = ['Ano', 'Mes', 'UF_Dest', 'Regiao', 'Transportadora_Final', 'Operacao', 'Frete_Tipo', 'destinatario', 'cidade_destino']
+
+@medido()
+def build_cube(df):
+    """
+    Agrega as notas pelas dimensões usadas nos gráficos/cards (CUBE_DIMS).
+    Os gráficos fatiam o cubo em vez de varrer a tabela de notas a cada rerun.
+    """
+    if df.empty: return pd.DataFrame()
+    d = df[CUBE_DIMS + ['peso_bruto', 'frete_valor', 'pedagio_valor', 'valor_nf', 'ton_km', 'frete_com_km', 'ton_km_estimada']].copy()
+    # Peso apenas das notas com frete (base do R$/Ton da evolução mensal)
+    d['peso_com_frete'] = d['peso_bruto'].where(d['frete_valor'] > 0, 0)
+    cubo = d.groupby(CUBE_DIMS, dropna=False, sort=False).agg(
+        peso_bruto=('peso_bruto', 'sum'),
+        frete_valor=('frete_valor', 'sum'),
+        pedagio_valor=('pedagio_valor', 'sum'),
+        valor_nf=('valor_nf', 'sum'),
+        peso_com_frete=('peso_com_frete', 'sum'),
+        ton_km=('ton_km', 'sum'),
+        frete_com_km=('frete_com_km', 'sum'),
+        ton_km_estimada=('ton_km_estimada', 'sum'),
+        qtd=('peso_bruto', 'size')
+    ).reset_index()
+
+    cubo['Sort_YM'] = cubo['Ano'].astype(str) + cubo['Mes'].astype(str).str.zfill(2)
+    cubo['Periodo_Label'] = cubo['Mes'].map(MESES_ABREV).fillna('') + '-' + cubo['Ano'].astype(str).str[-2:]
+    return cubo
+
+@medido()
+def slice_cube(cubo, filtros):
+    """
+    Aplica os filtros da sidebar ao cubo. Retorna None se algum filtro ativo
+    usa coluna fora do cubo (o chamador deve reagregar a partir das notas).
+    """
+    ativos = {c: v for c, v in filtros.items() if v}
+    if any(c not in CUBE_DIMS for c in ativos): return None
+    if cubo.empty or not ativos: return cubo
+    mask = pd.Series(True, index=cubo.index)
+    for c, v in ativos.items(): mask &= cubo[c].isin(v)
+    return cubo[mask]
+
+# --- AUDITORIA ANTT ---
+ANTT_COLS = ['N° CTE', 'Data Emissão', 'Transportadora', 'Cidade Emitente', 'Cidade Destinatário', 'Valor Frete']
+FONTES_DISTANCIA = {'matriz': "Matriz rodoviária", 'estimada': "Estimada (coordenadas do município)",
+                    'estimada_uf': "Estimada (centroide da UF)", 'sem_coordenada': "Sem coordenadas"}
+# Fontes com veredito (abaixo/acima do piso); centroide da UF erra centenas de km: só 'Distância estimada'
+FONTES_AUDITAVEIS = ('matriz', 'estimada')
+
+@medido()
+def auditar_antt(df_cte, df_dist, tipo_carga, eixos, margem=0.5):
+    """
+    Piso ANTT de cada CT-e (get_cte_aggregated) com a distância do par de cidades (db.get_distancias),
+    em arrays NumPy. Status: abaixo do piso, acima de piso x (1 + margem), dentro da faixa, sem distância
+    ou distância estimada (fonte fora de FONTES_AUDITAVEIS: piso informativo, sem veredito).
+    """
+    if df_cte.empty: return pd.DataFrame(columns=ANTT_COLS + ['Distância (km)', 'Fonte Distância', 'Piso ANTT', 'Frete/Piso', 'Status ANTT'])
+    pares = pd.MultiIndex.from_arrays([df_dist['cidade_origem'], df_dist['cidade_destino']])
+    pos = pares.get_indexer(pd.MultiIndex.from_arrays([df_cte['Cidade Emitente'], df_cte['Cidade Destinatário']]))
+    km = np.append(pd.to_numeric(df_dist['km'], errors='coerce').to_numpy(float), np.nan)[pos] # pos -1 -> NaN
+    fonte = np.append(df_dist['fonte'].fillna('').to_numpy(object), '')[pos]
+    frete = pd.to_numeric(df_cte['Valor Frete'], errors='coerce').fillna(0).to_numpy(float)
+    piso = piso_antt(km, tipo_carga, eixos)
+    sem_km = np.isnan(km) | (km <= 0)
+    status = np.select([sem_km, ~np.isin(fonte, FONTES_AUDITAVEIS), frete < piso, frete > piso * (1 + margem)],
+                       ['Sem distância', 'Distância estimada', 'Abaixo do piso', 'Acima do piso'], 'Dentro da faixa')
+    out = df_cte[[c for c in ANTT_COLS if c in df_cte.columns]].copy()
+    out['Distância (km)'] = km; out['Fonte Distância'] = [FONTES_DISTANCIA.get(f, f) for f in fonte]
+    out['Piso ANTT'] = np.where(sem_km, np.nan, piso)
+    out['Frete/Piso'] = np.where(sem_km, np.nan, frete / piso); out['Status ANTT'] = status
+    return out
+
 # --- NOVA LÓGICA DE AGREGAÇÃO CTE ---
+@medido()
 def get_cte_aggregated():
     # Carrega dados
     df_raw = db.load_data("cte")
@@ -0,0 +1,27 @@
+# tests/conftest.py
+# Testes de regressão: python -m pytest tests (da raiz do projeto). Cada teste roda com um banco
+# novo numa pasta temporária; os documentos vêm do gerador sintético dos benchmarks.
+import pytest
+import acervo
+import database as db
+import ingest
+from benchmarks import gerador
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Banco vazio em tmp_path (DB_FILE, partições e acervo lá); devolve o caminho."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(acervo, '_iniciado', False)
+    monkeypatch.setattr(db, 'DB_FILE', str(tmp_path / "dados_fiscais.db"))
+    db.init_db()
+    return tmp_path
+
+def documentos(n, anos=(2023,), seed=7):
+    return list(gerador.gerar_documentos(n, seed=seed, anos=anos))
+
+def gravar(docs, substituir=False):
+    """Parse + gravação de (nome, bytes) como na importação (sem acervo)."""
+    lote = ingest.novo_lote()
+    for nome, x in docs: ingest.acumular(lote, "auto", nome, x, arquivar=False)
+    ok, msg = ingest.gravar_lote(lote, substituir=substituir)
+    assert ok, msg
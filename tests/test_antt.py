@@ -0,0 +1,35 @@
+# tests/test_antt.py
+# Auditoria ANTT: veredito (abaixo/acima do piso) só com distância de matriz ou coordenadas do
+# município; par pelo centroide da UF vira 'Distância estimada' e a fonte acompanha cada CT-e.
+# Notas: fonte da distância na carga e t·km estimadas no cubo (KPI de Custo/t·km).
+import sqlite3
+import pytest
+import pandas as pd
+import database as db
+import services
+from tests.conftest import documentos, gravar
+
+def test_auditoria_separa_distancia_estimada():
+    cte = pd.DataFrame({'N° CTE': ['1', '2', '3', '4'], 'Cidade Emitente': ['A-GO', 'A-GO', 'C-SP', 'X-BA'],
+                        'Cidade Destinatário': ['B-GO', 'D-GO', 'E-MG', 'Y-BA'], 'Valor Frete': [1.0, 1.0, 1.0, 1.0]})
+    dist = pd.DataFrame({'cidade_origem': ['A-GO', 'A-GO', 'C-SP'], 'cidade_destino': ['B-GO', 'D-GO', 'E-MG'],
+                         'km': [300.0, 250.0, 500.0], 'fonte': ['matriz', 'estimada', 'estimada_uf']})
+    aud = services.auditar_antt(cte, dist, "Carga Geral", 5)
+    assert aud['Status ANTT'].tolist() == ['Abaixo do piso', 'Abaixo do piso', 'Distância estimada', 'Sem distância']
+    assert aud['Fonte Distância'].tolist() == ["Matriz rodoviária", "Estimada (coordenadas do município)", "Estimada (centroide da UF)", ""]
+    assert aud['Piso ANTT'].notna().tolist() == [True, True, True, False] # Piso informativo também no estimado
+
+def test_fonte_da_distancia_nas_notas_e_no_cubo(banco):
+    gravar(documentos(60))
+    par = services.get_dashboard_data().query("ton_km > 0").iloc[0][['cidade_origem', 'cidade_destino']].tolist()
+    conn = sqlite3.connect(db.DB_FILE) # Esse par passa a vir da matriz rodoviária
+    conn.execute('''UPDATE distancias SET fonte = 'matriz' WHERE (origem_id, destino_id) =
+                    (SELECT o.id, d.id FROM cidades o, cidades d WHERE o.rotulo = ? AND d.rotulo = ?)''', par); conn.commit(); conn.close()
+    df = services.get_dashboard_data()
+    fonte = db.get_distancias().set_index(['cidade_origem', 'cidade_destino'])['fonte']
+    assert (df['fonte_distancia'] == fonte.reindex(pd.MultiIndex.from_frame(df[['cidade_origem', 'cidade_destino']])).to_numpy()).all()
+    com_km = df[df['ton_km'] > 0]
+    assert (com_km['fonte_distancia'] == 'matriz').any() and (com_km['fonte_distancia'] != 'matriz').any()
+    cubo = services.build_cube(df)
+    assert 0 < cubo['ton_km_estimada'].sum() < cubo['ton_km'].sum()
+    assert cubo['ton_km_estimada'].sum() == pytest.approx(com_km.loc[com_km['fonte_distancia'] != 'matriz', 'ton_km'].sum())
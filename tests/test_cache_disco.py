@@ -0,0 +1,23 @@
+# tests/test_cache_disco.py
+# Chave do cache em disco: banco recriado no mesmo caminho (mesma versão dos dados) ou código novo
+# não podem devolver o DataFrame calculado antes.
+import os
+import pandas as pd
+import cache_disco
+import database as db
+
+def test_banco_recriado_nao_reusa_cache(banco, monkeypatch):
+    monkeypatch.setattr(cache_disco, 'CACHE_DIR', str(banco / "cache"))
+    calc = lambda valor: (lambda: pd.DataFrame({'v': [valor]}))
+    versao = db.get_data_version()
+    assert cache_disco.obter("t", versao, calc(1))['v'].tolist() == [1]
+    assert cache_disco.obter("t", versao, calc(2))['v'].tolist() == [1] # Hit
+    os.remove(db.DB_FILE); db.init_db()
+    assert db.get_data_version() == versao
+    assert cache_disco.obter("t", versao, calc(2))['v'].tolist() == [2]
+
+def test_codigo_novo_nao_reusa_cache(banco, monkeypatch):
+    monkeypatch.setattr(cache_disco, 'CACHE_DIR', str(banco / "cache"))
+    assert cache_disco.obter("t", 0, lambda: pd.DataFrame({'v': [1]}))['v'].tolist() == [1]
+    monkeypatch.setattr(cache_disco, 'versao_codigo', lambda: "outra")
+    assert cache_disco.obter("t", 0, lambda: pd.DataFrame({'v': [2]}))['v'].tolist() == [2]
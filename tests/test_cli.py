@@ -0,0 +1,47 @@
+# tests/test_cli.py
+# Importador, reextração e backfill pela linha de comando: lote que não grava fica fora da vazão e o
+# main devolve o número de lotes perdidos (código de saída 1).
+import sqlite3
+import backfill
+import database as db
+import ingest
+import importar
+import reextrair
+from tests.conftest import documentos
+
+def _falha_no_primeiro(monkeypatch):
+    gravar, chamadas = ingest.gravar_lote, []
+    def gravar_lote(lote, substituir=False):
+        chamadas.append(1)
+        return (False, "database is locked") if len(chamadas) == 1 else gravar(lote, substituir)
+    monkeypatch.setattr(ingest, 'gravar_lote', gravar_lote)
+
+def test_importar_lote_falho(banco, monkeypatch, capsys):
+    pasta = banco / "xml"; pasta.mkdir()
+    for nome, x in documentos(30): (pasta / nome).write_bytes(x)
+    _falha_no_primeiro(monkeypatch)
+    assert importar.main([str(pasta), "--workers", "1", "--batch-size", "10", "--sem-acervo"]) == 1
+    saida = capsys.readouterr().out
+    assert "Documentos: 20 |" in saida and "1 lote(s) com 10 XML NÃO gravados" in saida
+
+def _arquivar(docs):
+    lote = ingest.novo_lote()
+    for nome, x in docs: ingest.acumular(lote, "auto", nome, x, arquivar=True)
+    assert ingest.gravar_lote(lote)[0]
+
+def test_reextrair_lote_falho(banco, monkeypatch, capsys):
+    _arquivar(documentos(30))
+    _falha_no_primeiro(monkeypatch)
+    assert reextrair.main(["--workers", "1", "--batch-size", "10"]) == 1
+    saida = capsys.readouterr().out
+    assert "Concluído: 20 documentos" in saida and "1 lote(s) com 10 documentos NÃO gravados" in saida
+
+def test_backfill_lote_falho_nao_vira_pendencia(banco, monkeypatch):
+    _arquivar(documentos(60))
+    conn = sqlite3.connect(db.DB_FILE); conn.execute("UPDATE cte_header SET tp_cte = NULL"); conn.commit(); conn.close()
+    n = len(db.get_chaves_incompletas('cte', 'chave_cte_propria', ['tp_cte']))
+    _falha_no_primeiro(monkeypatch)
+    assert backfill.executar('cte', ['tp_cte'], 1, 10)['lotes_falhos'] == 1
+    assert 0 < len(db.get_chaves_incompletas('cte', 'chave_cte_propria', ['tp_cte'])) < n # Falhas seguem na fila
+    assert backfill.executar('cte', ['tp_cte'], 1, 10)['lotes_falhos'] == 0
+    assert db.get_chaves_incompletas('cte', 'chave_cte_propria', ['tp_cte']) == []
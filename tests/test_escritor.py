@@ -0,0 +1,38 @@
+# tests/test_escritor.py
+# Falha do laço do escritor fora das tarefas (fechar a conexão, BaseException numa tarefa): os
+# Futures do grupo são resolvidos com a exceção em vez de deixar quem chamou esperando para sempre.
+import sqlite3
+import threading
+import pytest
+import escritor
+
+class _Parar(BaseException): pass
+
+class _ConexaoFechaComErro:
+    """Conexão real cujo close() falha uma vez."""
+    def __init__(self, conn): self._conn, self._falhou = conn, False
+    def __getattr__(self, nome): return getattr(self._conn, nome)
+    def close(self):
+        self._conn.close()
+        if not self._falhou: self._falhou = True; raise sqlite3.OperationalError("close falhou")
+
+def _criar(c): c.execute("CREATE TABLE IF NOT EXISTS t (x)")
+def _inserir(c, x): c.execute("INSERT INTO t VALUES (?)", (x,)); return x
+def _parar(c): raise _Parar()
+
+def test_erro_ao_fechar_conexao_resolve_futures(tmp_path, monkeypatch):
+    arq = str(tmp_path / "e.db")
+    escritor.enviar(arq, _criar).result(10)
+    escritor.parar() # Próximo grupo abre a conexão que falha ao fechar
+    conectar = sqlite3.connect
+    monkeypatch.setattr(escritor.sqlite3, 'connect', lambda *a, **k: _ConexaoFechaComErro(conectar(*a, **k)))
+    assert escritor.enviar(arq, _inserir, 1).result(10) == 1 # Gravada antes do close: recebe o retorno
+    assert escritor.enviar(arq, _inserir, 2).result(10) == 2 # Thread seguiu viva
+    assert [r[0] for r in conectar(arq).execute("SELECT x FROM t ORDER BY x")] == [1, 2]
+
+def test_base_exception_na_tarefa_resolve_futures(tmp_path, monkeypatch):
+    monkeypatch.setattr(threading, 'excepthook', lambda args: None) # A thread do escritor termina com _Parar
+    arq = str(tmp_path / "e.db")
+    escritor.enviar(arq, _criar).result(10)
+    with pytest.raises(_Parar): escritor.enviar(arq, _parar).result(10)
+    assert escritor.enviar(arq, _inserir, 3).result(10) == 3 # Nova thread atende o próximo envio
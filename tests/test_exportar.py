@@ -0,0 +1,20 @@
+# tests/test_exportar.py
+# Falha no meio da exportação: some o temporário e o arquivo criado em EXPORT_DIR, mas o arquivo de
+# saída que o usuário indicou (--saida) e que já existia continua intacto.
+import pandas as pd
+import pytest
+import exportar
+
+def _blocos_com_falha():
+    yield pd.DataFrame({'a': [1, 2]})
+    raise RuntimeError("falha na leitura")
+
+def test_falha_preserva_saida_existente(tmp_path):
+    saida = tmp_path / "itens.csv"; saida.write_text("conteúdo anterior")
+    with pytest.raises(RuntimeError): exportar.exportar(_blocos_com_falha(), 'csv', str(saida))
+    assert saida.read_text() == "conteúdo anterior" and [p.name for p in tmp_path.iterdir()] == ["itens.csv"]
+
+def test_falha_remove_arquivo_novo(tmp_path, monkeypatch):
+    monkeypatch.setattr(exportar, 'EXPORT_DIR', str(tmp_path))
+    with pytest.raises(RuntimeError): exportar.exportar(_blocos_com_falha(), 'csv')
+    assert list(tmp_path.iterdir()) == []
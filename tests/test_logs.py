@@ -0,0 +1,24 @@
+# tests/test_logs.py
+# Resumo de erros: mensagens que só diferem na posição (lxml) ou em números longos caem no mesmo
+# grupo; dias além de LOG_RESUMO_DIAS saem do resumo; a tela recebe o resumo limitado e o total.
+import database as db
+
+def _logs(msgs, tipo="NFe"):
+    db.insert_log_many([{'arquivo': f"a{i}.xml", 'tipo': tipo, 'msg': m} for i, m in enumerate(msgs)])
+
+def test_mensagens_agrupadas_sem_posicao(banco):
+    _logs(["Opening and ending tag mismatch: det line 12 and prod, line 40, column 9",
+           "Opening and ending tag mismatch: det line 7 and prod, line 88, column 131",
+           "Chave 35230112345678000190550010000012341000012345 duplicada"])
+    _logs(["Chave 35230112345678000190550010000099991000099999 duplicada"])
+    resumo, total = db.get_logs_resumo()
+    assert total == 2 and sorted(resumo['qtd']) == [2, 2]
+
+def test_resumo_antigo_removido_e_limite(banco, monkeypatch):
+    _logs([f"erro {c}" for c in "abc"])
+    conn = db.get_connection()
+    conn.execute("UPDATE logs_resumo SET dia = '2000-01-01' WHERE mensagem = 'erro a'"); conn.commit(); conn.close()
+    _logs(["erro d"])
+    resumo, total = db.get_logs_resumo(limite=2)
+    assert total == 3 and len(resumo) == 2 and 'erro a' not in set(resumo['mensagem'])
+    assert db.get_logs_filtros() == (["NFe"], [resumo['dia'].iloc[0]])
@@ -0,0 +1,131 @@
+# tests/test_parsers.py
+# parse_nfe/parse_cte sobre XML pequenos montados aqui, comparados com o dicionário esperado:
+# variantes de namespace (padrão, prefixado, sem namespace, sem o envelope *Proc), NF-e sem dest,
+# sem transp e com vários vol, CT-e com duas NF-e e CT-e complementar.
+import re
+import pytest
+import parsers
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+NS_CTE = "http://www.portalfiscal.inf.br/cte"
+ASSINATURA = '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo><Reference URI="#x"/></SignedInfo></Signature>'
+CHAVE_NF = "52230108471163001306550010000012341000012345"
+CHAVE_NF2 = "52230108471163001306550010000012351000012352"
+CHAVE_CTE = "52230140000100000120570010000000011465742579"
+
+def _xml(raiz, doc, inf, ns, variante):
+    """Envolve infNFe/infCte no documento: 'padrao', 'prefixo', 'sem_ns' ou 'sem_proc' (sem o *Proc)."""
+    chave = 'chNFe' if raiz == 'nfeProc' else 'chCTe'
+    prot = f"<prot{doc}><infProt><{chave}>x</{chave}><cStat>100</cStat></infProt></prot{doc}>"
+    if variante == 'sem_proc': corpo = f'<{doc} xmlns="{ns}">{inf}</{doc}>'
+    else: corpo = f'<{raiz} versao="4.00"><{doc}>{inf}</{doc}>{prot}</{raiz}>'
+    if variante == 'padrao': corpo = corpo.replace(f'<{raiz} ', f'<{raiz} xmlns="{ns}" ', 1)
+    elif variante == 'prefixo':
+        corpo = re.sub(r'<(/?)([A-Za-z])', r'<\1p:\2', corpo).replace(f'<p:{raiz} ', f'<p:{raiz} xmlns:p="{ns}" ', 1)
+    xml = f'<?xml version="1.0" encoding="UTF-8"?>{corpo}'
+    if variante != 'prefixo': xml = xml.replace(f"</{doc}>", f"{ASSINATURA}</{doc}>", 1)
+    return xml.encode('utf-8')
+
+DEST_NFE = ("<dest><CNPJ>11222333000181</CNPJ><xNome>Cliente SA</xNome>"
+            "<enderDest><xMun>Goiânia</xMun><UF>GO</UF><CEP>74000000</CEP></enderDest></dest>")
+TRANSP_NFE = ("<transp><modFrete>0</modFrete><transporta><xNome>Transportes X</xNome></transporta>"
+              "<vol><qVol>10</qVol><pesoB>1000.000</pesoB></vol><vol><qVol>4</qVol><pesoB>520.500</pesoB></vol></transp>")
+
+def nfe(variante='padrao', dest=DEST_NFE, transp=TRANSP_NFE):
+    inf = (f'<infNFe Id="NFe{CHAVE_NF}" versao="4.00">'
+           "<ide><cUF>52</cUF><nNF>1234</nNF><dhEmi>2023-01-15T10:30:00-03:00</dhEmi></ide>"
+           "<emit><CNPJ>08471163001306</CNPJ><xNome>Fabrica Rialma</xNome>"
+           "<enderEmit><xMun>Rialma</xMun><UF>GO</UF><CEP>76310000</CEP></enderEmit></emit>"
+           f"{dest}"
+           '<det nItem="1"><prod><cProd>A1</cProd><xProd>Produto A</xProd><NCM>12345678</NCM><CFOP>5102</CFOP>'
+           "<uCom>KG</uCom><qCom>1500.5000</qCom><vProd>3001.00</vProd></prod></det>"
+           '<det nItem="2"><prod><cProd>B2</cProd><xProd>Produto B</xProd><NCM>87654321</NCM><CFOP>5102</CFOP>'
+           "<uCom>UN</uCom><qCom>10.0000</qCom><vProd>99.90</vProd></prod></det>"
+           "<total><ICMSTot><vProd>3100.90</vProd><vNF>3100.90</vNF></ICMSTot></total>"
+           f"{transp}</infNFe>")
+    return _xml('nfeProc', 'NFe', inf, NS_NFE, variante)
+
+CABECALHO = {
+    "chave_nf": CHAVE_NF, "data": "15/01/2023", "numero_nf": "1234", "emitente": "Fabrica Rialma",
+    "destinatario": "Cliente SA", "cnpj_emit": "08471163001306", "cnpj_dest": "11222333000181", "uf_dest": "GO",
+    "valor_nf": 3100.90, "peso_bruto": 1520.5, "transportadora": "Transportes X",
+    "cidade_origem": "Rialma-GO", "cidade_destino": "Goiânia-GO", "cep_origem": "76310000", "cep_destino": "74000000",
+    "distancia": 0.0, "mod_frete": "0", "cfop_predominante": "5102", "tipo_operacao": "Venda",
+    "qtd_itens": 2, "arquivo": "nf.xml",
+}
+ITENS = [
+    {"chave_nf": CHAVE_NF, "numero_nf": "1234", "emitente": "Fabrica Rialma", "cnpj_emit": "08471163001306",
+     "item_num": "1", "cod_produto": "A1", "produto": "Produto A", "ncm": "12345678", "cfop": "5102", "unidade": "KG",
+     "qtd_display": "1.500,500", "qtd_float": 1500.5, "vl_total": 3001.0, "arquivo": "nf.xml"},
+    {"chave_nf": CHAVE_NF, "numero_nf": "1234", "emitente": "Fabrica Rialma", "cnpj_emit": "08471163001306",
+     "item_num": "2", "cod_produto": "B2", "produto": "Produto B", "ncm": "87654321", "cfop": "5102", "unidade": "UN",
+     "qtd_display": "10,000", "qtd_float": 10.0, "vl_total": 99.9, "arquivo": "nf.xml"},
+]
+
+@pytest.mark.parametrize("variante", ['padrao', 'prefixo', 'sem_ns', 'sem_proc'])
+def test_nfe_variantes_de_namespace(banco, variante):
+    assert parsers.detect_doc_type(nfe(variante)) == 'nfe'
+    assert parsers.parse_nfe(nfe(variante), "nf.xml") == (CABECALHO, ITENS, None)
+
+def test_nfe_sem_dest(banco):
+    h, itens, err = parsers.parse_nfe(nfe(dest=""), "nf.xml")
+    assert err is None and itens == ITENS
+    assert h == {**CABECALHO, "destinatario": "Consumidor", "cnpj_dest": "", "uf_dest": "", "cidade_destino": "ND", "cep_destino": ""}
+
+def test_nfe_sem_transp(banco):
+    h, _, err = parsers.parse_nfe(nfe(transp=""), "nf.xml")
+    assert err is None
+    assert h == {**CABECALHO, "peso_bruto": 0.0, "transportadora": "", "mod_frete": ""}
+
+def test_nfe_vol_unico_e_sem_peso(banco):
+    um = "<transp><modFrete>1</modFrete><vol><pesoB>75.250</pesoB></vol><vol><qVol>1</qVol></vol></transp>"
+    h, _, _ = parsers.parse_nfe(nfe(transp=um), "nf.xml")
+    assert (h["peso_bruto"], h["mod_frete"], h["transportadora"]) == (75.25, "1", "")
+
+def test_nfe_invalida():
+    assert parsers.parse_nfe(b"<nfeProc><outro/></nfeProc>", "x.xml") == (None, [], "XML NFe Inválido")
+
+def cte(variante='padrao', complementar=False):
+    ide_fim = "" if complementar else "<xMunFim>Goiânia</xMunFim><UFFim>GO</UFFim>"
+    if complementar:
+        prest = "<vPrest><vTPrest>120.00</vTPrest><Comp><xNome>VALE PEDAGIO</xNome><vComp>120.00</vComp></Comp></vPrest>"
+        corpo = f"<infCteComp><chCTe>{CHAVE_CTE}</chCTe></infCteComp>"
+    else:
+        prest = ("<vPrest><vTPrest>850.00</vTPrest><vRec>850.00</vRec><Comp><xNome>FRETE PESO</xNome><vComp>800.00</vComp></Comp>"
+                 "<Comp><xNome>PEDAGIO</xNome><vComp>50.00</vComp></Comp></vPrest>")
+        corpo = ("<infCTeNorm><infCarga><vCarga>3100.90</vCarga><infQ><cUnid>01</cUnid><tpMed>PESO BRUTO</tpMed>"
+                 "<qCarga>1520.5000</qCarga></infQ></infCarga>"
+                 f"<infDoc><infNFe><chave>{CHAVE_NF}</chave></infNFe><infNFe><chave>{CHAVE_NF2}</chave></infNFe></infDoc></infCTeNorm>")
+    inf = (f'<infCte Id="CTe{CHAVE_CTE if not complementar else CHAVE_CTE[:-1] + "0"}" versao="4.00">'
+           f"<ide><nCT>{2 if complementar else 1}</nCT><dhEmi>2023-01-16T08:00:00-03:00</dhEmi><tpCTe>{1 if complementar else 0}</tpCTe>"
+           f"<xMunIni>Rialma</xMunIni><UFIni>GO</UFIni>{ide_fim}</ide>"
+           "<emit><CNPJ>40000100000120</CNPJ><xNome>Transportes X</xNome></emit>"
+           "<rem><xNome>Fabrica Rialma</xNome></rem>"
+           "<dest><xNome>Cliente SA</xNome><enderDest><xMun>Goiânia</xMun><UF>GO</UF></enderDest></dest>"
+           f"{prest}{corpo}</infCte>")
+    return _xml('cteProc', 'CTe', inf, NS_CTE, variante)
+
+CTE = {
+    "chave_cte_propria": CHAVE_CTE, "data": "16/01/2023", "numero_cte": "1", "emitente": "Transportes X",
+    "cnpj_emit": "40000100000120", "remetente": "Fabrica Rialma", "destinatario": "Cliente SA",
+    "frete_valor": 850.0, "peso_kg": 1520.5, "cidade_origem": "Rialma-GO", "cidade_destino": "Goiânia-GO",
+    "pedagio_valor": 50.0, "chave_ref_cte": "", "tp_cte": "0", "arquivo": "cte.xml",
+}
+
+@pytest.mark.parametrize("variante", ['padrao', 'prefixo', 'sem_ns', 'sem_proc'])
+def test_cte_variantes_de_namespace(variante):
+    assert parsers.detect_doc_type(cte(variante)) == 'cte'
+    assert parsers.parse_cte(cte(variante), "cte.xml") == ([
+        {**CTE, "chave_nf": CHAVE_NF, "numero_nf_cte": "1234"},
+        {**CTE, "chave_nf": CHAVE_NF2, "numero_nf_cte": "1235"},
+    ], None)
+
+def test_cte_complementar():
+    # Sem infCTeNorm (sem NF-e nem carga) e sem município de fim na ide: destino pelo dest
+    assert parsers.parse_cte(cte(complementar=True), "cte.xml") == ([{
+        **CTE, "chave_cte_propria": CHAVE_CTE[:-1] + "0", "numero_cte": "2", "frete_valor": 120.0, "peso_kg": 0.0,
+        "pedagio_valor": 120.0, "chave_ref_cte": CHAVE_CTE, "tp_cte": "1", "chave_nf": "", "numero_nf_cte": "",
+    }], None)
+
+def test_cte_invalido():
+    assert parsers.parse_cte(b"<cteProc><outro/></cteProc>", "x.xml") == ([], "XML Inválido")
@@ -0,0 +1,83 @@
+# tests/test_particoes.py
+# Partições por ano (database.fechar_periodo): leitura igual antes/depois de fechar e edições do
+# app preservadas quando um documento de ano fechado é reimportado.
+import os
+import sqlite3
+import pytest
+import database as db
+from tests.conftest import documentos, gravar
+
+def _ordenar(df, chaves): return df.sort_values(chaves).reset_index(drop=True)
+
+def test_fechar_mantem_leitura(banco):
+    gravar(documentos(80, anos=(2023, 2024)))
+    antes = {f: db.load_data(f) for f in db.FATOS}
+    ok, msg = db.fechar_periodo(2023)
+    assert ok, msg
+    chaves = {'nfe': ['chave_nf'], 'itens': ['id'], 'cte': ['chave_cte_propria', 'chave_nf']}
+    for f, df in antes.items():
+        assert _ordenar(db.load_data(f), chaves[f]).equals(_ordenar(df, chaves[f]))
+    nfe_2023 = db.load_data('nfe', anos=[2023])
+    assert len(nfe_2023) == antes['nfe']['data'].str.endswith('2023').sum()
+    principal = sqlite3.connect(db.DB_FILE)
+    assert principal.execute(f"SELECT COUNT(*) FROM nfe_base WHERE {db._ano()} = '2023'").fetchone()[0] == 0
+    principal.close()
+
+def test_reimportar_ano_fechado_mantem_edicoes(banco):
+    docs = documentos(60)
+    gravar(docs)
+    cte, nfe = db.load_data('cte'), db.load_data('nfe')
+    n_itens = len(db.load_data('itens'))
+    ch_cte, ch_nf = cte['chave_cte_propria'].iloc[0], nfe['chave_nf'].iloc[0]
+    assert db.update_cte_etapa(ch_cte, 'Coleta')
+    assert db.update_ia_memory('5102', 'teste', 'MANUAL', ch_nf)
+    ok, msg = db.fechar_periodo(2023)
+    assert ok, msg
+
+    gravar(docs) # Reimportação do mesmo ZIP
+    cte2, nfe2 = db.load_data('cte'), db.load_data('nfe')
+    assert len(cte2) == len(cte) and len(nfe2) == len(nfe) and len(db.load_data('itens')) == n_itens
+    assert cte2.loc[cte2['chave_cte_propria'] == ch_cte, 'etapa_manual'].unique().tolist() == ['Coleta']
+    assert nfe2.loc[nfe2['chave_nf'] == ch_nf, 'tipo_operacao'].tolist() == ['MANUAL']
+
+    gravar(docs, substituir=True) # Reextração
+    cte3 = db.load_data('cte')
+    assert len(cte3) == len(cte)
+    assert cte3.loc[cte3['chave_cte_propria'] == ch_cte, 'etapa_manual'].unique().tolist() == ['Coleta']
+    nfe3 = db.load_data('nfe')
+    assert nfe3.loc[nfe3['chave_nf'] == ch_nf, 'tipo_operacao'].tolist() == ['MANUAL']
+
+def test_particao_ausente_nao_esconde_anos_abertos(banco):
+    gravar(documentos(80, anos=(2023, 2024)))
+    n_2024 = len(db.load_data('nfe', anos=[2024]))
+    ok, msg = db.fechar_periodo(2023)
+    assert ok, msg
+    os.chmod(db.arquivo_particao(2023), 0o644); os.remove(db.arquivo_particao(2023))
+    assert db.get_particoes_ausentes() == ['2023']
+    assert len(db.load_data('nfe')) == n_2024
+
+def test_anexos_demais_propaga_erro(banco):
+    gravar(documentos(20, anos=(2023,)))
+    conn = sqlite3.connect(db.DB_FILE)
+    for ano in range(2000, 2012): # Registro de 12 anos fechados (o SQLite anexa no máximo 10)
+        open(db.arquivo_particao(ano), 'wb').close()
+        conn.execute("INSERT INTO particoes (ano) VALUES (?)", (str(ano),))
+    conn.commit(); conn.close()
+    with pytest.raises(sqlite3.OperationalError, match="anexa no máximo"): db.load_data('nfe')
+
+def test_distancia_recalculada_vale_para_ano_fechado(banco, monkeypatch):
+    import rotas
+    gravar(documentos(60, anos=(2023, 2024)))
+    ok, msg = db.fechar_periodo(2023)
+    assert ok, msg
+    antes = db.load_data('nfe').set_index('chave_nf')['distancia']
+    monkeypatch.setattr(rotas, 'FATOR_CIRCUITO', rotas.FATOR_CIRCUITO * 2)
+    assert db.atualizar_distancias(True) > 0
+    nfe = db.load_data('nfe')
+    depois = nfe.set_index('chave_nf')['distancia']
+    fechadas = nfe.loc[nfe['data'].str.endswith('2023'), 'chave_nf']
+    est = db.load_data('distancias').set_index(['origem_id', 'destino_id'])['fonte']
+    assert len(fechadas) and (est == 'matriz').sum() == 0 and antes[fechadas].notna().all()
+    assert ((depois[fechadas] - 2 * antes[fechadas]).abs() < 0.2).all() # Partição congelada lê a distância nova
+    view = sqlite3.connect(db.DB_FILE).execute("SELECT chave_nf, distancia FROM nfe").fetchall()
+    assert {k: v for k, v in view} == pytest.approx({k: v for k, v in depois.items() if k not in set(fechadas)}, nan_ok=True)
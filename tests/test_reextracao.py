@@ -0,0 +1,24 @@
+# tests/test_reextracao.py
+# Reextração (gravar_lote com substituir=True): valores do parse atual, edições do app preservadas.
+import database as db
+from tests.conftest import documentos, gravar
+
+def test_reextracao_mantem_tipo_manual(banco):
+    docs = documentos(40)
+    gravar(docs)
+    nfe = db.load_data('nfe')
+    manual, outra = nfe['chave_nf'].iloc[0], nfe['chave_nf'].iloc[1]
+    assert db.update_ia_memory('5102', 'teste', 'MANUAL', manual)
+    automatico = nfe.loc[nfe['chave_nf'] == outra, 'tipo_operacao'].iloc[0]
+    gravar(docs, substituir=True)
+    nfe2 = db.load_data('nfe').set_index('chave_nf')
+    assert nfe2.loc[manual, 'tipo_operacao'] == 'MANUAL'
+    assert nfe2.loc[outra, 'tipo_operacao'] == automatico
+
+def test_reextracao_atualiza_campos_do_parse(banco):
+    docs = documentos(40)
+    gravar(docs)
+    conn = db.get_connection()
+    conn.execute("UPDATE nfe_base SET valor_nf = -1"); conn.commit(); conn.close()
+    gravar(docs, substituir=True)
+    assert (db.load_data('nfe')['valor_nf'] > 0).all()
@@ -0,0 +1,23 @@
+# tests/test_spool.py
+# Job de upload: arquivos com o mesmo nome vão para subpastas próprias do spool, os dois são
+# importados e a limpeza remove as subpastas e a pasta do job.
+import os
+import database as db
+import ingest
+from tests.conftest import documentos
+
+def test_nomes_repetidos_no_mesmo_job(banco):
+    docs = [x for _, x in documentos(10) if b'<nfeProc' in x][:2]
+    pasta = banco / "spool" / "job"
+    arquivos = []
+    for i, x in enumerate(docs): # Como app.proc_ui: uma subpasta por upload
+        os.makedirs(pasta / str(i)); (pasta / str(i) / "nota.xml").write_bytes(x); arquivos.append(str(pasta / str(i) / "nota.xml"))
+    job_id = db.create_job("auto", arquivos)
+    job = db.claim_next_job()
+    assert job['id'] == job_id
+    proc, _, errs, _ = ingest.processar_job(job)
+    assert (proc, errs) == (2, 0)
+    nfe = db.load_data('nfe')
+    assert len(nfe) == 2 and nfe['arquivo'].tolist() == ["nota.xml", "nota.xml"]
+    ingest.remover_arquivos(job['arquivos'])
+    assert not pasta.exists() and (banco / "spool").exists()
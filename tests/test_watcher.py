@@ -0,0 +1,34 @@
+# tests/test_watcher.py
+# Watcher: lote que falha (parse ou commit) volta para a fila em vez de se perder até reiniciar.
+from concurrent.futures import ThreadPoolExecutor
+import ingest
+import watcher
+from tests.conftest import documentos
+
+def _arquivos(pasta, docs):
+    caminhos = []
+    for nome, x in docs:
+        c = pasta / nome; c.write_bytes(x); caminhos.append(str(c))
+    return watcher.filtrar_novos(caminhos, {}, 0)[0]
+
+def test_commit_falho_devolve_lote(banco, monkeypatch):
+    novos, registrados = _arquivos(banco, documentos(6)), {}
+    gravar = ingest.gravar_lote
+    monkeypatch.setattr(ingest, 'gravar_lote', lambda lote: (False, "database is locked"))
+    with ThreadPoolExecutor(1) as pool:
+        assert watcher.processar(novos, "auto", pool, registrados) == novos
+        assert registrados == {}
+        monkeypatch.setattr(ingest, 'gravar_lote', gravar)
+        assert watcher.processar(novos, "auto", pool, registrados) == []
+    assert sorted(registrados) == sorted(c for c, _, _ in novos)
+
+def test_falha_de_parse_isolada(banco):
+    novos = _arquivos(banco, documentos(4))
+    (banco / "ilegivel.xml").mkdir() # open() falha com IsADirectoryError
+    ilegivel = [(str(banco / "ilegivel.xml"), 0.0, "")]
+    sumiu = (str(banco / "sumiu.xml"), 0.0, "")
+    registrados = {}
+    with ThreadPoolExecutor(1) as pool:
+        falhas = watcher.processar(novos + ilegivel + [sumiu], "auto", pool, registrados)
+    assert falhas == ilegivel
+    assert sorted(registrados) == sorted(c for c, _, _ in novos)
@@ -0,0 +1,55 @@
+# tests/test_worker.py
+# Worker da fila de jobs: erro no banco não derruba a thread, job que falha volta à fila até
+# WORKER_TENTATIVAS e, esgotadas, tem o spool apagado; pastas antigas do spool são podadas.
+import os
+import threading
+import time
+import database as db
+import ingest
+import worker
+from tests.conftest import documentos
+
+def _job(pasta, nome="nota.xml"):
+    os.makedirs(pasta / "0", exist_ok=True)
+    arq = pasta / "0" / nome; arq.write_bytes(documentos(1)[0][1])
+    return db.create_job("auto", [str(arq)]), str(arq)
+
+class _Parar(BaseException): pass # Encerra o loop do worker no teste (o loop só captura Exception)
+
+def _rodar_loop():
+    try: worker._loop()
+    except _Parar: pass
+
+def _status(job_id): return db.get_jobs().set_index('id').loc[job_id, 'status']
+
+def test_erro_no_banco_nao_derruba_worker(banco, monkeypatch):
+    _job(banco / "spool" / "a")
+    def travado(*a): raise RuntimeError("database is locked")
+    monkeypatch.setattr(db, 'finish_job', travado); monkeypatch.setattr(db, 'falhar_job', travado)
+    chamadas, claim = [], db.claim_next_job
+    def contar():
+        chamadas.append(1)
+        if len(chamadas) > 3: raise _Parar
+        return claim()
+    monkeypatch.setattr(db, 'claim_next_job', contar)
+    monkeypatch.setattr(worker, 'WORKER_INTERVALO', 0.01)
+    t = threading.Thread(target=_rodar_loop, daemon=True); t.start(); t.join(5)
+    assert len(chamadas) == 4 # Sobreviveu às falhas de finish_job/falhar_job e seguiu consumindo a fila
+
+def test_job_com_falha_volta_a_fila_e_depois_apaga_spool(banco, monkeypatch):
+    job_id, arq = _job(banco / "spool" / "b")
+    def falha(job, *a): raise RuntimeError("disco cheio")
+    monkeypatch.setattr(ingest, 'processar_job', falha)
+    for esperado in ['pendente'] * (worker.WORKER_TENTATIVAS - 1) + ['erro']:
+        assert worker._executar(db.claim_next_job()) is False
+        assert _status(job_id) == esperado
+    assert not os.path.exists(arq) and not (banco / "spool" / "b").exists()
+    assert db.claim_next_job() is None
+
+def test_limpar_spool_mantem_jobs_ativos(banco):
+    _job(banco / "spool" / "ativo")
+    os.makedirs(banco / "spool" / "orfao"); os.makedirs(banco / "spool" / "recente")
+    velho = time.time() - 100 * 3600
+    for p in ("ativo", "orfao"): os.utime(banco / "spool" / p, (velho, velho))
+    ingest.limpar_spool(horas=72)
+    assert sorted(os.listdir(banco / "spool")) == ["ativo", "recente"]
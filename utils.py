@@ -11,6 +11,8 @@ COORDS_UF = {
     'SE': (-10.90, -37.07), 'SP': (-23.55, -46.64), 'TO': (-9.00, -48.39)
 }
 
+MESES_ABREV = {1:'Jan',2:'Fev',3:'Mar',4:'Abr',5:'Mai',6:'Jun',7:'Jul',8:'Ago',9:'Set',10:'Out',11:'Nov',12:'Dez'}
+
 def get_regiao(uf):
     uf = str(uf).upper().strip()
     if uf in ['RS','SC','PR']: return 'Sul'
@@ -0,0 +1,141 @@
+# watcher.py
+# Ingestão headless de pasta monitorada (hot folder).
+# Uso: python -m watcher /mnt/erp/xml --workers 4
+# Usa inotify via 'watchdog' quando instalado; sem ele (ou com --polling, p/ compartilhamentos
+# de rede onde inotify não dispara) faz varredura periódica da pasta.
+import argparse
+import hashlib
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import database as db
+import ingest
+import metrics
+
+EXTENSOES = (".xml", ".zip")
+
+def log(msg): print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}", flush=True)
+
+def hash_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''): h.update(bloco)
+    return h.hexdigest()
+
+def varrer(pasta, recursivo=True):
+    for raiz, dirs, arqs in os.walk(pasta):
+        for a in arqs:
+            if a.lower().endswith(EXTENSOES): yield os.path.abspath(os.path.join(raiz, a))
+        if not recursivo: break
+
+def filtrar_novos(caminhos, registrados, espera):
+    """
+    Retorna [(caminho, mtime, hash)] dos arquivos estáveis ainda não processados e a lista
+    dos que ainda estão sendo escritos. Mesmo caminho+mtime: pula sem ler; mtime mudou mas
+    hash igual: só atualiza o registro.
+    """
+    novos = []; instaveis = []; tocados = []
+    agora = time.time()
+    for c in caminhos:
+        try: mtime = os.stat(c).st_mtime
+        except OSError: continue # Removido antes de processar
+        if agora - mtime < espera: instaveis.append(c); continue
+        reg = registrados.get(c)
+        if reg and reg[0] == mtime: continue
+        try: h = hash_arquivo(c)
+        except FileNotFoundError: continue # Movido entre o stat e a leitura
+        except OSError: instaveis.append(c); continue # Ex.: ainda bloqueado pelo ERP: próximo ciclo
+        if reg and reg[1] == h: tocados.append((c, mtime, h)); continue
+        novos.append((c, mtime, h))
+    if tocados:
+        db.mark_arquivos_processados(tocados)
+        for c, m, h in tocados: registrados[c] = (m, h)
+    return novos, instaveis
+
+def processar(novos, tipo, pool, registrados):
+    """
+    Parse em paralelo e um commit. Devolve os (caminho, mtime, hash) a tentar de novo no próximo
+    ciclo: os que falharam no parse e, se o commit falhar, o lote inteiro. Arquivo que sumiu antes
+    do parse (movido pelo ERP) sai da fila.
+    """
+    ini = time.time()
+    lote = ingest.novo_lote(); lidos, falhas = [], []
+    with metrics.coletar() as col:
+        futuros = [(n, pool.submit(ingest.parse_arquivo, n[0], tipo)) for n in novos]
+        for n, f in futuros:
+            try: ingest.juntar(lote, f.result()); lidos.append(n)
+            except FileNotFoundError: log(f"{n[0]} removido antes do parse")
+            except Exception as e: log(f"ERRO no parse de {n[0]}: {e!r}"); falhas.append(n)
+        if not lidos: return falhas
+        ok, msg = ingest.gravar_lote(lote)
+    if lote['metricas']: metrics.juntar(col, lote['metricas'])
+    ingest.registrar_execucao("watcher", col, lote['docs'], ingest.registros(lote), len(lote['logs']), lote['bytes'])
+    if not ok: log(f"ERRO ao gravar lote: {msg}"); return falhas + lidos
+    db.mark_arquivos_processados(lidos)
+    for c, m, h in lidos: registrados[c] = (m, h)
+    seg = max(time.time() - ini, 1e-6)
+    log(f"{len(lidos)} arquivo(s), {lote['docs']} XML, {ingest.registros(lote)} registros, {len(lote['logs'])} erros em {seg:.1f}s ({lote['docs']/seg:,.0f} docs/s)")
+    return falhas
+
+def iniciar_observer(pasta, fila, recursivo):
+    """Observer inotify (watchdog). Retorna None se a biblioteca não estiver instalada."""
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError: return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, ev):
+            if ev.is_directory: return
+            c = getattr(ev, 'dest_path', '') or ev.src_path
+            if c.lower().endswith(EXTENSOES): fila.put(os.path.abspath(c))
+
+    obs = Observer()
+    obs.schedule(Handler(), pasta, recursive=recursivo)
+    obs.start()
+    return obs
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m watcher", description="Monitora uma pasta e ingere os XML de CT-e/NF-e que chegarem.")
+    ap.add_argument("pasta")
+    ap.add_argument("--tipo", choices=["cte", "nfe", "auto"], default="auto")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de parse em paralelo")
+    ap.add_argument("--lote", type=int, default=200, help="Máximo de arquivos por commit")
+    ap.add_argument("--intervalo", type=float, default=5.0, help="Segundos entre ciclos")
+    ap.add_argument("--espera", type=float, default=2.0, help="Idade mínima (s) do arquivo, evita ler arquivo ainda sendo copiado")
+    ap.add_argument("--polling", action="store_true", help="Força varredura periódica (ex.: compartilhamento de rede)")
+    ap.add_argument("--nao-recursivo", dest="recursivo", action="store_false")
+    ap.add_argument("--uma-vez", action="store_true", help="Processa o que existe na pasta e sai")
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    registrados = db.get_arquivos_processados()
+    fila = queue.Queue()
+    obs = None if (args.polling or args.uma_vez) else iniciar_observer(args.pasta, fila, args.recursivo)
+    log(f"Monitorando {args.pasta} ({'inotify' if obs else 'polling'}, {args.workers} workers)")
+
+    pendentes = set(varrer(args.pasta, args.recursivo)) # Recupera o que chegou com o watcher parado
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        try:
+            while True:
+                if obs is None: pendentes |= set(varrer(args.pasta, args.recursivo))
+                else:
+                    while not fila.empty(): pendentes.add(fila.get_nowait())
+                try: novos, instaveis = filtrar_novos(sorted(pendentes), registrados, 0 if args.uma_vez else args.espera)
+                except Exception as e: log(f"ERRO ao verificar a pasta: {e!r}"); novos, instaveis = [], sorted(pendentes)
+                pendentes = set(instaveis)
+                for i in range(0, len(novos), args.lote):
+                    bloco = novos[i:i + args.lote]
+                    try: falhas = processar(bloco, args.tipo, pool, registrados)
+                    except Exception as e: log(f"ERRO no lote de {len(bloco)} arquivo(s): {e!r}"); falhas = bloco
+                    pendentes.update(c for c, _, _ in falhas) # Tentados de novo no próximo ciclo (também com inotify)
+                if args.uma_vez: break
+                time.sleep(args.intervalo)
+        except KeyboardInterrupt: pass
+        finally:
+            if obs: obs.stop(); obs.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# worker.py
+# Worker de ingestão em segundo plano: consome a tabela 'jobs' (fila persistente no SQLite).
+import sys
+import threading
+import time
+import database as db
+import ingest
+import metrics
+from config import WORKER_INTERVALO, WORKER_TENTATIVAS
+
+MANUTENCAO = 600 # Segundos entre rodadas de reset_stale_jobs + limpeza do spool
+
+_lock = threading.Lock()
+_thread = None
+
+def _executar(job):
+    """Processa um job reservado. Falha volta à fila (db.falhar_job); esgotadas as tentativas, apaga o spool."""
+    try:
+        with metrics.coletar() as col, metrics.perfil(job.get('perfil'), f"job{job['id']}") as prof:
+            proc, regs, errs, n_bytes = ingest.processar_job(job)
+        ingest.registrar_execucao(f"job {job['id']}", col, proc, regs, errs, n_bytes, prof['arquivo'])
+        db.finish_job(job['id'], 'concluido', f"{proc} documentos, {regs} registros, {errs} erros.")
+    except Exception as e:
+        if db.falhar_job(job['id'], str(e), WORKER_TENTATIVAS) == 'erro': ingest.remover_arquivos(job['arquivos'])
+        return False
+    ingest.remover_arquivos(job['arquivos'])
+    return True
+
+def _loop():
+    ultima = 0
+    while True:
+        try:
+            if time.time() - ultima > MANUTENCAO:
+                ultima = time.time()
+                db.reset_stale_jobs(); ingest.limpar_spool()
+            job = db.claim_next_job()
+            if job and _executar(job): continue
+        except Exception as e: # Banco travado ou job com erro não podem parar a fila: registra e tenta de novo
+            print(f"Worker: {e!r}", file=sys.stderr)
+        time.sleep(WORKER_INTERVALO)
+
+def iniciar():
+    """Inicia a thread do worker uma única vez por processo."""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive(): return
+        _thread = threading.Thread(target=_loop, name="worker-ingestao", daemon=True)
+        _thread.start()